@@ -7,4 +7,12 @@ from .pac import PICKUP, USE_ITEM, USE_OBJECT, COMBINE, START, ENTER, MUSIC_CHAN
 from .pac import PacException, MissingParameters, InvalidParameters, NotLinked, AlreadyExists
 
 # Classes
-from .pac import Music, Room, Item, StaticObject, EventDispatcher, SaveGame, TextInterface, PaCInterpreter
+from .pac import Music, Room, Item, StaticObject, EventDispatcher, SaveGame, TextInterface, PaCInterpreter, CommandResult, \
+    Player
+
+# Command parsing
+from .pac import parse_command, normalize_name
+
+# Tools
+from .solver import Solver, SolverReport
+from .replay import Replayer, ReplayReport, load_transcript
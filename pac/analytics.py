@@ -0,0 +1,388 @@
+# coding=utf-8
+"""
+Streaming gameplay analytics: where players get stuck, in fixed memory.
+
+The interpreter hands every CommandResult to the sink (PaCInterpreter.enable_analytics()), which only appends it
+to a queue, so commands do not wait for anything. A thread of the sink takes the results off the queue and keeps
+aggregates whose size does not grow with the number of commands or players:
+
+- counters of commands and errors per verb
+- top-K (Space-Saving) of the rooms walks are denied into, of the failed combinations, of the rooms with the
+  most failed commands and of the rooms where sessions end
+- distinct players per room (HyperLogLog)
+
+Every interval the aggregates are written to a file as one JSON line (a rollup of that interval) and start over.
+
+    pac.enable_analytics("analytics.jsonl", interval=60)
+"""
+
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from collections import deque, OrderedDict
+
+from .pac import normalize_name
+
+log = logging.getLogger(__name__)
+
+# Separators of the two items of "combine item with item" (as in PaCInterpreter._execute())
+COMBINE_SEPARATORS = (" with ", " and ")
+
+
+def _hash64(value):
+    # Stable across processes (unlike hash()), so estimates of workers can be compared
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class TopK:
+    """
+    Approximate heavy hitters (Space-Saving): keeps capacity counters, a new key takes over the smallest one.
+    Counts are at most the count of the key that was replaced too high, keys more frequent than
+    1 / capacity of all are always kept.
+    """
+    def __init__(self, capacity=100):
+        self.capacity = int(capacity)
+        self.counts = {}
+
+    def add(self, key, count=1):
+        counts = self.counts
+
+        if key in counts:
+            counts[key] += count
+
+        elif len(counts) < self.capacity:
+            counts[key] = count
+
+        else:
+            smallest = min(counts, key=counts.get)
+            counts[key] = counts.pop(smallest) + count
+
+    def top(self, k):
+        """
+        :return: list of [key, count], the k most frequent first
+        """
+        return [[key, count] for key, count in sorted(self.counts.items(), key=lambda c: (-c[1], c[0]))[:k]]
+
+    def __len__(self):
+        return len(self.counts)
+
+    def clear(self):
+        self.counts.clear()
+
+
+class HyperLogLog:
+    """
+    Approximate number of distinct strings in 2 ** precision bytes (standard error 1.04 / sqrt(2 ** precision)).
+    """
+    def __init__(self, precision=10):
+        self.precision = int(precision)
+        self.registers = bytearray(1 << self.precision)
+
+    def add(self, value):
+        self.add_hash(_hash64(value))
+
+    def add_hash(self, hashed):
+        """
+        :param hashed: 64 bit hash of the value
+        :return: None
+        """
+        precision = self.precision
+
+        index = hashed & ((1 << precision) - 1)
+        rest = hashed >> precision
+
+        # Position of the first set bit of the rest
+        rank = 64 - precision - rest.bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        """
+        :return: estimated number of distinct values (int)
+        """
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+
+        # Linear counting is more precise while many registers are empty
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(size / zeros)
+
+        return int(round(estimate))
+
+
+class Analytics:
+    """
+    Analytics sink of a PaCInterpreter.
+    """
+    def __init__(self, pac, path="analytics.jsonl", interval=60.0, top=10, capacity=100, precision=10,
+                 sessions=10000, session_timeout=1800.0, queue_size=65536, clock=time.time):
+        """
+        :param pac: PaCInterpreter (names typed by players are resolved to its rooms and items)
+        :param path: file the rollups are appended to
+        :param interval: seconds between rollups
+        :param top: entries of every top list in a rollup
+        :param capacity: counters of every top list (more are more precise)
+        :param precision: distinct players per room use 2 ** precision bytes per room
+        :param sessions: players whose last room is remembered, the one idle the longest is counted as ended
+        :param session_timeout: seconds without a command after which a session is counted as ended
+        :param queue_size: results waiting for the thread, results over it are dropped (and counted)
+        :param clock: function returning the time in seconds
+        :return: None
+        """
+        self.pac = pac
+        self.path = str(path)
+
+        self.interval = float(interval)
+        self.top = int(top)
+        self.capacity = int(capacity)
+        self.precision = int(precision)
+
+        self.sessions = int(sessions)
+        self.session_timeout = float(session_timeout)
+
+        self.queue_size = int(queue_size)
+        self.clock = clock
+
+        # (player, CommandResult) or (player, None) for ended sessions, see observe() and end_session()
+        self.queue = deque()
+        self.dropped = 0
+
+        # Player: (room name, time of the last command, hash of the name), least recently active first
+        self.last_rooms = OrderedDict()
+
+        self.lock = threading.Lock()
+        self._thread = None
+        self._stop = None
+
+        self._reset(clock())
+
+    def _reset(self, now):
+        # Starts the aggregates of a new rollup
+        self.started = now
+
+        self.commands = {}  # (verb, ok): count
+        self.errors = {}    # (verb, error): count
+
+        self.denied_walks = TopK(self.capacity)
+        self.failed_combines = TopK(self.capacity)
+        self.failed_rooms = TopK(self.capacity)
+        self.session_ends = TopK(self.capacity)
+
+        self.players = {}   # room name: HyperLogLog
+
+    # Called by the interpreter, must stay cheap
+
+    def observe(self, player, result):
+        """
+        Queues a result of a command (PaCInterpreter._execute() calls it when analytics are enabled).
+        :param player: name of the player (None for the interpreter's player)
+        :param result: CommandResult
+        :return: None
+        """
+        if len(self.queue) < self.queue_size:
+            self.queue.append((player, result))
+        else:
+            self.dropped += 1
+
+    def end_session(self, player):
+        """
+        Counts the session of the player as ended in the room of their last command.
+        :param player: name of the player
+        :return: None
+        """
+        if len(self.queue) < self.queue_size:
+            self.queue.append((player, None))
+        else:
+            self.dropped += 1
+
+    # Aggregating (in the thread)
+
+    def _room_name(self, name):
+        pac = self.pac
+        room = pac.rooms.get(name) or pac.room_names.get(normalize_name(name))
+
+        return room.name if room is not None else normalize_name(name)
+
+    def _item_name(self, name):
+        item = self.pac.item_names.get(normalize_name(name))
+        return item.name if item is not None else normalize_name(name)
+
+    def _add(self, player, result, now):
+        player = "player" if player is None else str(player)
+        last_rooms = self.last_rooms
+
+        if result is None:
+            last = last_rooms.pop(player, None)
+            if last is not None:
+                self.session_ends.add(last[0])
+
+            return
+
+        verb = result.verb or "unknown"
+        room = result.room
+
+        key = (verb, result.ok)
+        self.commands[key] = self.commands.get(key, 0) + 1
+
+        if result.error:
+            key = (verb, result.error)
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+            if room is not None and result.error != "unknown-command":
+                self.failed_rooms.add(room)
+
+            if verb == "walk" and result.error == "requirements":
+                self.denied_walks.add(self._room_name(result.argument))
+
+            elif verb == "combine" and result.error in ("no-blueprint", "unknown-item"):
+                for separator in COMBINE_SEPARATORS:
+                    names = result.argument.split(separator)
+
+                    if len(names) > 1:
+                        self.failed_combines.add(" + ".join(sorted(self._item_name(name) for name in names[:2])))
+                        break
+
+        if room is None:
+            return
+
+        # Hashed once while the player is remembered
+        last = last_rooms.pop(player, None)
+        hashed = last[2] if last is not None else _hash64(player)
+
+        hll = self.players.get(room)
+        if hll is None:
+            hll = self.players[room] = HyperLogLog(self.precision)
+        hll.add_hash(hashed)
+
+        if verb == "exit":
+            self.session_ends.add(room)
+            return
+
+        last_rooms[player] = (room, now, hashed)
+
+        # The player idle the longest makes room
+        if len(last_rooms) > self.sessions:
+            idle, (last, _, _) = last_rooms.popitem(last=False)
+            self.session_ends.add(last)
+
+    def _expire(self, now):
+        # Sessions without a command for session_timeout seconds have ended
+        last_rooms = self.last_rooms
+        deadline = now - self.session_timeout
+
+        while last_rooms:
+            player, (room, seen, _) = next(iter(last_rooms.items()))
+            if seen > deadline:
+                break
+
+            del last_rooms[player]
+            self.session_ends.add(room)
+
+    def drain(self):
+        """
+        Aggregates the queued results.
+        :return: number of results
+        """
+        queue = self.queue
+        count = 0
+
+        with self.lock:
+            now = self.clock()
+
+            while queue:
+                player, result = queue.popleft()
+                self._add(player, result, now)
+                count += 1
+
+        return count
+
+    def rollup(self):
+        """
+        :return: dict with the aggregates since the last rollup (JSON-serializable)
+        """
+        with self.lock:
+            now = self.clock()
+            self._expire(now)
+
+            return {
+                "start": round(self.started, 3),
+                "end": round(now, 3),
+                "commands": {"{}:{}".format(verb, "ok" if ok else "failed"): n
+                             for (verb, ok), n in self.commands.items()},
+                "errors": {"{}:{}".format(verb, error): n for (verb, error), n in self.errors.items()},
+                "denied_walks": self.denied_walks.top(self.top),
+                "failed_combines": self.failed_combines.top(self.top),
+                "failed_rooms": self.failed_rooms.top(self.top),
+                "session_ends": self.session_ends.top(self.top),
+                "players": {room: hll.estimate() for room, hll in self.players.items()},
+                "active_sessions": len(self.last_rooms),
+                "dropped": self.dropped,
+            }
+
+    def flush(self):
+        """
+        Aggregates the queued results, appends a rollup to the file and starts the next one.
+        :return: the rollup (dict)
+        """
+        self.drain()
+        rollup = self.rollup()
+
+        with self.lock:
+            self._reset(rollup["end"])
+            self.dropped = 0
+
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(rollup, separators=(",", ":"), sort_keys=True) + "\n")
+
+        return rollup
+
+    # Thread
+
+    def _run(self, stop):
+        # Drains ten times per interval (at least every second), so the queue stays short
+        wait = min(1.0, self.interval / 10)
+        next_rollup = self.clock() + self.interval
+
+        while not stop.wait(wait):
+            try:
+                if self.clock() >= next_rollup:
+                    next_rollup += self.interval
+                    self.flush()
+                else:
+                    self.drain()
+            except Exception:
+                log.exception("Analytics failed")
+
+    def start(self):
+        """
+        Starts the thread that aggregates and writes the rollups.
+        :return: None
+        """
+        if self._thread is not None:
+            return
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name="pac-analytics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the thread and writes what is left as a last rollup.
+        :return: None
+        """
+        thread = self._thread
+        if thread is None:
+            return
+
+        self._stop.set()
+        self._thread = None
+        thread.join()
+
+        self.flush()
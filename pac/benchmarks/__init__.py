@@ -0,0 +1,7 @@
+# coding=utf-8
+"""
+Benchmarks for PaC. Run with: python -m pac.benchmarks --help
+"""
+
+from .world import SyntheticWorld, generate_world
+from .suite import BENCHMARKS, benchmark, run, compare, save, load
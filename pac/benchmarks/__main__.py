@@ -0,0 +1,58 @@
+# coding=utf-8
+"""
+Command line runner for the benchmarks.
+
+python -m pac.benchmarks --sizes 10 100 1000 --output results.json
+python -m pac.benchmarks --compare results.json
+"""
+
+import argparse
+import sys
+
+from . import suite
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pac.benchmarks", description="Runs the PaC benchmarks.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="world sizes (number of rooms)")
+    parser.add_argument("--only", nargs="+", choices=sorted(suite.BENCHMARKS), help="benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=3, help="timing repeats, the best one is kept")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results to this baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown counted as a regression")
+
+    parser.add_argument("--link-density", type=float, default=2.0)
+    parser.add_argument("--items-per-room", type=int, default=2)
+    parser.add_argument("--requirement-depth", type=int, default=2)
+    parser.add_argument("--blueprints", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args(argv)
+
+    results = suite.run(args.sizes, args.only, args.repeat,
+                        link_density=args.link_density, items_per_room=args.items_per_room,
+                        requirement_depth=args.requirement_depth, blueprints=args.blueprints, seed=args.seed)
+
+    if args.output:
+        suite.save(results, args.output)
+
+    if not args.compare:
+        for key, res in sorted(results["results"].items()):
+            size = " {:>10} bytes".format(res["bytes"]) if "bytes" in res else ""
+            print("{:<32} {:>12.2f} us {:>14.0f} ops/s{}".format(key, res["per_op_us"], res["ops_per_sec"], size))
+
+        return 0
+
+    rows = suite.compare(results, suite.load(args.compare), args.threshold)
+
+    for row in rows:
+        if row["ratio"] is None:
+            print("{:<32} {:>12.2f} us {:>12} {}".format(row["key"], row["per_op_us"], "", row["status"]))
+        else:
+            print("{:<32} {:>12.2f} us {:>11.2f}x {}".format(row["key"], row["per_op_us"], row["ratio"], row["status"]))
+
+    return 1 if any(row["status"] == "regression" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+# coding=utf-8
+"""
+Load benchmark of the HTTP/JSON command API (pac.server) and the worker pool (pac.cluster).
+
+The server runs in a separate process with a generated world and client threads send commands of many
+sessions over keep-alive connections. Reports requests per second and latency percentiles.
+
+python -m pac.benchmarks.load --rooms 100 --clients 8 --requests 5000 --sessions 200
+python -m pac.benchmarks.load --workers 1 2 4 8 --client-processes 4 --clients 32 --requests 20000
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from ..server import CommandService, CommandServer, SessionStore, MemoryStore
+from .. import cluster
+from .world import generate_world
+
+
+def _serve(ready, rooms, store_path, seed, workers):
+    world = generate_world(rooms, seed=seed)
+
+    if workers:
+        cluster.serve(world.pac, workers, SessionStore(store_path), port=0, ready=ready.send)
+        return
+
+    store = SessionStore(store_path) if store_path else MemoryStore()
+
+    server = CommandServer(CommandService(world.pac, store), ("127.0.0.1", 0))
+    ready.send(server.server_address[1])
+    ready.close()
+
+    server.serve_forever()
+
+
+def start_server(rooms=100, store_path=None, seed=0, workers=None):
+    """
+    Starts a server with a generated world in a new process.
+    :param rooms: world size
+    :param store_path: session store directory, None keeps the sessions in memory
+    :param workers: serve with a pac.cluster pool of this many workers (needs store_path)
+    :return: tuple - (Process, port)
+    """
+    receive, send = multiprocessing.Pipe(duplex=False)
+
+    # Not a daemon, the pool forks its workers
+    process = multiprocessing.Process(target=_serve, args=(send, rooms, store_path, seed, workers))
+    process.start()
+
+    port = receive.recv()
+    return process, port
+
+
+def _commands(rooms, rng):
+    # A mix of looking around, walking (to any room, most are not linked) and picking up
+    while True:
+        roll = rng.random()
+
+        if roll < 0.4:
+            yield rng.choice(("where", "items", "ways", "inventory"))
+        elif roll < 0.8:
+            yield "walk to room {}".format(rng.randrange(rooms))
+        else:
+            yield "pick up item {}".format(rng.randrange(rooms * 2))
+
+
+def _client(port, count, sessions, rooms, seed, latencies, errors):
+    rng = random.Random(seed)
+    commands = _commands(rooms, rng)
+
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Content-Type": "application/json"}
+
+    for _ in range(count):
+        body = json.dumps({"session": "player-{}".format(rng.randrange(sessions)), "command": next(commands)})
+        body = body.encode("utf-8")
+
+        started = time.perf_counter()
+        connection.request("POST", "/command", body, headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - started)
+
+        if response.status != 200:
+            errors.append(response.status)
+
+    connection.close()
+
+
+def percentile(values, p):
+    """
+    :param values: sorted list
+    :param p: percentile (0 - 100)
+    :return: value at the percentile (nearest rank)
+    """
+    if not values:
+        return 0.0
+
+    return values[min(len(values) - 1, max(0, int(round(p / 100.0 * len(values))) - 1))]
+
+
+def _run_clients(job):
+    port, count, clients, sessions, rooms, seed = job
+
+    latencies = []
+    errors = []
+
+    threads = [threading.Thread(target=_client, args=(port, count, sessions, rooms, seed + c, latencies, errors))
+               for c in range(clients)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, errors
+
+
+def run_load(port, requests=5000, clients=8, sessions=200, rooms=100, seed=0, processes=1):
+    """
+    Sends the requests to a running server.
+    :param processes: client processes the clients (threads) are split across
+    :return: dict with requests, errors, seconds, requests_per_sec and p50/p90/p99 latencies in ms
+    """
+    processes = max(1, min(processes, clients))
+    per_client = max(1, requests // clients)
+
+    jobs = [(port, per_client, clients // processes + (1 if c < clients % processes else 0), sessions, rooms,
+             seed + c * clients) for c in range(processes)]
+
+    started = time.perf_counter()
+
+    if processes == 1:
+        parts = [_run_clients(jobs[0])]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            parts = pool.map(_run_clients, jobs)
+
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for part in parts for latency in part[0])
+    errors = [error for part in parts for error in part[1]]
+
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "seconds": elapsed,
+        "requests_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pac.benchmarks.load", description="Load benchmark of pac.server.")
+    parser.add_argument("--rooms", type=int, default=100, help="world size")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent connections")
+    parser.add_argument("--sessions", type=int, default=200, help="number of different players")
+    parser.add_argument("--client-processes", type=int, default=1, help="processes the clients are split across")
+    parser.add_argument("--memory", action="store_true", help="keep the sessions in memory instead of files")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        help="serve with pac.cluster pools of these sizes instead (one run per size)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+
+    args = parser.parse_args(argv)
+
+    if args.workers and args.memory:
+        parser.error("worker pools need a session store on disk")
+
+    runs = []
+    for workers in (args.workers or [None]):
+        store_path = None if args.memory else tempfile.mkdtemp(prefix="pac-sessions-")
+        process, port = start_server(args.rooms, store_path, args.seed, workers)
+
+        try:
+            # Warm up (creates the sessions)
+            run_load(port, args.sessions, 1, args.sessions, args.rooms, args.seed)
+
+            results = run_load(port, args.requests, args.clients, args.sessions, args.rooms, args.seed,
+                               args.client_processes)
+        finally:
+            process.terminate()
+            process.join()
+
+            if store_path:
+                shutil.rmtree(store_path, ignore_errors=True)
+
+        results["workers"] = workers
+        runs.append(results)
+
+        print("{}{requests} requests in {seconds:.2f} s, {requests_per_sec:.0f} req/s, p50 {p50_ms:.2f} ms, "
+              "p90 {p90_ms:.2f} ms, p99 {p99_ms:.2f} ms, {errors} errors".format(
+                  "{:>3} workers: ".format(workers) if workers else "", **results))
+
+    if len(runs) > 1:
+        base = runs[0]["requests_per_sec"] / runs[0]["workers"]
+        for results in runs:
+            print("{:>3} workers: {:.2f}x of linear".format(results["workers"], results["requests_per_sec"] / (base * results["workers"])))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"params": vars(args), "runs": runs}, file, indent=2)
+
+    return 1 if any(results["errors"] for results in runs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+# coding=utf-8
+"""
+Memory of forked workers serving sessions of a shared world (Linux only, reads /proc/<pid>/smaps_rollup).
+
+Workers are forked from a process holding a generated world and execute commands of their sessions
+(pac.server.CommandService). The private memory of a worker is what it copied from the world or allocated
+itself: ideally little more than its session states. Measured with and without PaCInterpreter.finalize().
+
+python -m pac.benchmarks.memory --rooms 20000 --workers 4 --sessions 200 --commands 5000
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import random
+import sys
+
+from ..pac import PaCInterpreter
+from ..server import CommandService, MemoryStore
+from .load import _commands
+from .world import generate_world
+
+
+def private_memory(pid="self"):
+    """
+    :param pid: process id ("self" for this process)
+    :return: private (not shared with any other process) memory of the process in bytes, None if it can not be read
+    """
+    try:
+        with open("/proc/{}/smaps_rollup".format(pid), "r") as file:
+            lines = file.readlines()
+    except OSError:
+        return None
+
+    total = 0
+    for line in lines:
+        if line.startswith(("Private_Clean:", "Private_Dirty:")):
+            total += int(line.split()[1]) * 1024
+
+    return total
+
+
+def _worker(conn, sessions, commands, rooms, seed):
+    started = private_memory()
+
+    store = MemoryStore()
+    service = CommandService(PaCInterpreter(), store)
+
+    rng = random.Random(seed)
+    source = _commands(rooms, rng)
+
+    for _ in range(commands):
+        service.handle("player-{}".format(rng.randrange(sessions)), next(source))
+
+    # A long running worker goes through full collections too
+    gc.collect()
+
+    conn.send({
+        "private_at_fork": started,
+        "private": private_memory(),
+        "session_bytes": sum(len(state) for state in store.states.values()),
+    })
+    conn.close()
+
+
+def measure(rooms=20000, workers=4, sessions=200, commands=5000, finalize=False, seed=0):
+    """
+    Builds a world and forks the workers.
+    :return: dict with the private memory of the world's process and of every worker
+    """
+    world = generate_world(rooms, seed=seed)
+    world.pac.begin()
+
+    if finalize:
+        world.pac.finalize()
+
+    context = multiprocessing.get_context("fork")
+    results = []
+
+    for c in range(workers):
+        receive, send = context.Pipe(duplex=False)
+
+        process = context.Process(target=_worker, args=(send, sessions, commands, rooms, seed + c))
+        process.start()
+        send.close()
+
+        results.append(receive.recv())
+        process.join()
+
+    return {"world": private_memory(), "workers": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pac.benchmarks.memory", description="Memory of forked workers.")
+    parser.add_argument("--rooms", type=int, default=20000, help="world size")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--sessions", type=int, default=200, help="sessions per worker")
+    parser.add_argument("--commands", type=int, default=5000, help="commands per worker")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+
+    args = parser.parse_args(argv)
+
+    if private_memory() is None:
+        print("/proc/self/smaps_rollup can not be read (Linux only)")
+        return 1
+
+    mb = 1024.0 * 1024.0
+    results = {}
+
+    # Finalized last, freezing is not undone for the next world
+    for finalize in (False, True):
+        res = measure(args.rooms, args.workers, args.sessions, args.commands, finalize, args.seed)
+        results["finalized" if finalize else "plain"] = res
+
+        per_worker = [worker["private"] / mb for worker in res["workers"]]
+
+        print("{:<10} world {:8.1f} MB, private per worker {:7.1f} MB (max {:.1f} MB, {:.1f} MB at fork), "
+              "session states {:.2f} MB".format(
+                  "finalized" if finalize else "plain", res["world"] / mb, sum(per_worker) / len(per_worker),
+                  max(per_worker), res["workers"][0]["private_at_fork"] / mb,
+                  res["workers"][0]["session_bytes"] / mb))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"params": vars(args), "results": results}, file, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,608 @@
+# coding=utf-8
+"""
+The benchmarks, runner and baseline comparison.
+
+Benchmarks are registered with the @benchmark decorator. A benchmark gets a freshly generated
+SyntheticWorld and returns a function without arguments that is timed. The runner calls its teardown()
+attribute (see _teardown()) after timing it.
+"""
+
+import json
+import os
+import pickle
+import platform
+import shutil
+import tempfile
+import time
+import timeit
+
+from ..pac import PaCInterpreter, EventDispatcher, PICKUP, parse_command
+from .. import codec
+from ..server import CommandService, HibernatingStore, SessionStore
+from ..timers import TimerWheel
+from ..multiplayer import SharedWorld
+from ..hotreload import build_world, diff_worlds
+from ..trace import ENTER
+from .world import generate_world
+
+# name: function(world) -> function to time
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    Decorator that registers a benchmark.
+    :param name: benchmark name
+    """
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+
+    return register
+
+
+def _teardown(fn, teardown):
+    # The runner calls teardown() after timing fn (stops threads the benchmark started)
+    fn.teardown = teardown
+    return fn
+
+
+def _free_item(world, room=None):
+    """
+    :return: an Item without pick up requirements (from the room if given)
+    """
+    items = world.items if room is None else list(room.items.values())
+
+    for item in items:
+        if not item.pickup_requires:
+            return item
+
+
+@benchmark("walk")
+def bench_walk(world):
+    pac = world.pac
+    pac.begin()
+
+    there = pac.get_room_by_name(pac.ways()[0])
+    here = pac.current_room
+
+    def run():
+        pac.walk(there)
+        pac.walk(here)
+
+    return run
+
+
+@benchmark("room_enter")
+def bench_room_enter(world):
+    return world.rooms[0].enter
+
+
+@benchmark("pick_up_item")
+def bench_pick_up_item(world):
+    pac = world.pac
+    pac.begin()
+
+    room = pac.current_room
+    item = _free_item(world, room)
+    description = room.item_descriptions[item.name]
+
+    def run():
+        pac.pick_up_item(item)
+
+        # Put it back
+        pac.inv.remove(item)
+        room.put_item(item, description)
+
+    return run
+
+
+@benchmark("use_item")
+def bench_use_item(world):
+    pac = world.pac
+    pac.begin()
+
+    item = _free_item(world)
+    pac.put_into_inv(item)
+
+    return lambda: pac.use_item(item)
+
+
+@benchmark("use_static_object")
+def bench_use_static_object(world):
+    pac = world.pac
+    pac.begin()
+
+    obj = world.statics[0]
+
+    return lambda: pac.use_static_object(obj)
+
+
+@benchmark("combine")
+def bench_combine(world):
+    pac = world.pac
+    pac.begin()
+
+    first, second, result = pac.blueprints[0]
+    pac.put_into_inv(first)
+    pac.put_into_inv(second)
+
+    def run():
+        pac.combine(first, second)
+
+        # Undo the combination
+        pac.inv.remove(result)
+        pac.inv.append(first)
+        pac.inv.append(second)
+
+    return run
+
+
+@benchmark("save_game")
+def bench_save_game(world):
+    pac = world.pac
+    pac.begin()
+
+    return pac._save_game
+
+
+@benchmark("load_game")
+def bench_load_game(world):
+    pac = world.pac
+    pac.begin()
+    pac._save_game()
+
+    return pac._load_game
+
+
+@benchmark("dispatch_event")
+def bench_dispatch_event(world):
+    EventDispatcher.reset_instance()
+    events = EventDispatcher()
+
+    for _ in range(10):
+        events.on_pickup(lambda **kwargs: None)
+
+    item = world.items[0]
+
+    return lambda: events.dispatch_event(PICKUP, item=item, desc="")
+
+
+@benchmark("parse_command")
+def bench_parse_command(world):
+    commands = ["walk to room 1", "pick up the item 0", "use item 0 on static 0", "combine item 0 with item 1",
+                "inventory", "where am i", "go back", "something else"]
+
+    def run():
+        for command in commands:
+            parse_command(command)
+
+    return run
+
+
+@benchmark("resolve_typo")
+def bench_resolve_typo(world):
+    pac = world.pac
+    pac.begin()
+
+    names = pac.current_room.item_names
+    typos = ["{}x{}".format(name[:-1], name[-1]) for name in names] + ["nothing like it"]
+
+    def run():
+        for typo in typos:
+            pac.resolve(typo, names)
+
+    return run
+
+
+@benchmark("execute")
+def bench_execute(world):
+    pac = world.pac
+    pac.begin()
+
+    commands = ["walk to " + pac.ways()[0], "items", "inv", "where", "go back"]
+
+    return lambda: pac.execute_many(commands)
+
+
+@benchmark("execute_metrics")
+def bench_execute_metrics(world):
+    # Same as execute, with metrics enabled (to see the instrumentation overhead)
+    world.pac.enable_metrics()
+    return bench_execute(world)
+
+
+@benchmark("execute_traced")
+def bench_execute_traced(world):
+    # Same as execute, with the mutation trace enabled
+    world.pac.enable_tracing()
+    return bench_execute(world)
+
+
+@benchmark("execute_history")
+def bench_execute_history(world):
+    # Same as execute, with a checkpoint before every command
+    world.pac.enable_history()
+    return bench_execute(world)
+
+
+@benchmark("execute_analytics")
+def bench_execute_analytics(world):
+    # Same as execute, with results streamed into the analytics sink (aggregated by its thread)
+    pac = world.pac
+    pac.enable_analytics(os.path.join(tempfile.mkdtemp(prefix="analytics-", dir="."), "analytics.jsonl"),
+                         interval=3600)
+
+    return _teardown(bench_execute(world), pac.disable_analytics)
+
+
+@benchmark("undo_redo")
+def bench_undo_redo(world):
+    pac = world.pac
+    pac.enable_history()
+    pac.begin()
+
+    room = pac.current_room
+    pac.execute_many(["pick up " + name for name in room.items] + ["walk to " + pac.ways()[0]])
+
+    history = pac.history
+
+    def run():
+        history.undo()
+        history.redo()
+
+    return run
+
+
+@benchmark("complete")
+def bench_complete(world):
+    pac = world.pac
+    pac.begin()
+
+    lines = ["wa", "pick up it", "walk to ro", "use st", "combine it"]
+
+    def run():
+        for line in lines:
+            pac.complete(line)
+
+    return run
+
+
+@benchmark("session_command")
+def bench_session_command(world):
+    # Commands of a stateless session: load its state, execute, store and rewind (without HTTP)
+    service = CommandService(world.pac)
+
+    way = "walk to " + world.pac.ways()[0]
+    pickup = "pick up " + _free_item(world, world.pac.current_room).name
+
+    def run():
+        # Visits grow with every walk, a new session keeps the state the same size
+        service.reset_session("player")
+        service.handle("player", pickup)
+        service.handle("player", way)
+        service.handle("player", "go back")
+
+    return run
+
+
+@benchmark("session_revive")
+def bench_session_revive(world):
+    # A session hibernated to disk and revived by its next command
+    store = HibernatingStore(SessionStore(tempfile.mkdtemp(prefix="sessions-", dir=".")))
+    service = CommandService(world.pac, store)
+
+    service.handle("player", "pick up " + _free_item(world, world.pac.current_room).name)
+
+    def run():
+        store.hibernate(0)
+        service.handle("player", "where")
+
+    return run
+
+
+@benchmark("shared_world_execute")
+def bench_shared_world_execute(world):
+    # Same commands as execute, by one of 100 players of a shared world (room locks and events for the others)
+    shared = SharedWorld(world.pac)
+
+    for c in range(100):
+        shared.join("player {}".format(c))
+
+    commands = ["walk to " + world.pac.ways()[0], "items", "inv", "where", "go back"]
+
+    def run():
+        for command in commands:
+            shared.execute("player 0", command)
+
+        # Nobody reads them here
+        for player in shared.players.values():
+            player.inbox.clear()
+
+    return run
+
+
+def _edited_world(world):
+    # The world built again with the descriptions of the first ten rooms edited
+    new = build_world(lambda: generate_world(**world.params).pac)
+
+    for room in list(new.rooms.values())[:10]:
+        room.desc = "Edited. " + room.desc
+
+    return new
+
+
+@benchmark("reload_diff")
+def bench_reload_diff(world):
+    new = _edited_world(world)
+    return lambda: diff_worlds(world.pac, new)
+
+
+@benchmark("reload_apply")
+def bench_reload_apply(world):
+    # The same ten edits whatever the size of the world, applied and reverted
+    new = _edited_world(world)
+
+    forth = diff_worlds(world.pac, new)
+    back = diff_worlds(new, world.pac)
+
+    def run():
+        forth.apply(world.pac)
+        back.apply(world.pac)
+
+    return run
+
+
+class _Clock:
+    # Time of the timer benchmarks, moved by hand
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _nothing():
+    pass
+
+
+def _loaded_wheel(world, clock):
+    # A wheel with 1000 pending timers per room, up to an hour ahead
+    wheel = TimerWheel(clock=clock)
+
+    for c in range(len(world.rooms) * 1000):
+        wheel.schedule((c * 7919) % 3600, _nothing)
+
+    return wheel
+
+
+@benchmark("timer_schedule_cancel")
+def bench_timer_schedule_cancel(world):
+    wheel = _loaded_wheel(world, _Clock())
+
+    def run():
+        wheel.cancel(wheel.schedule(30, _nothing))
+
+    return run
+
+
+@benchmark("timer_fire")
+def bench_timer_fire(world):
+    # 100 timers expiring in the next tick, fired by the game loop
+    clock = _Clock()
+    wheel = _loaded_wheel(world, clock)
+
+    def run():
+        for _ in range(100):
+            wheel.schedule(wheel.resolution, _nothing)
+
+        clock.now += wheel.resolution
+        wheel.advance()
+
+    return run
+
+
+@benchmark("trace_record")
+def bench_trace_record(world):
+    tracer = world.pac.enable_tracing()
+    return lambda: tracer.record(ENTER, "room 0")
+
+
+def _played_state(world):
+    """
+    Plays the world a bit (half the rooms entered, a third of them emptied) and returns its state.
+    """
+    pac = world.pac
+    pac.begin()
+
+    for room in world.rooms[::2]:
+        room.entered = True
+        pac.visits.append(room)
+
+    for room in world.rooms[::3]:
+        for item in list(room.items.values()):
+            room.pick_up_item(item)
+            pac.inv.append(item)
+
+    return pac.get_state()
+
+
+@benchmark("flag_snapshot")
+def bench_flag_snapshot(world):
+    _played_state(world)
+    return world.pac.flag_snapshot
+
+
+@benchmark("flag_diff")
+def bench_flag_diff(world):
+    # Flags changed in a tenth of the rooms since the snapshot
+    pac = world.pac
+    snapshot = pac.flag_snapshot()
+
+    for room in world.rooms[::10]:
+        room.entered = True
+
+    return lambda: pac.flag_diff(snapshot)
+
+
+@benchmark("select_used_items")
+def bench_select_used_items(world):
+    for item in world.items[::4]:
+        item.used = True
+
+    return lambda: world.pac.item_flags.select("used")
+
+
+def _sized(fn, data):
+    # The runner records the size of the encoded state
+    fn.size = len(data)
+    return fn
+
+
+@benchmark("state_encode_pickle")
+def bench_state_encode_pickle(world):
+    state = _played_state(world)
+    return _sized(lambda: pickle.dumps(state, pickle.HIGHEST_PROTOCOL), pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+
+
+# get_state() of a world that has not started: no names at all
+EMPTY_STATE = {"rooms": {}, "items": {}, "statics": [], "inventory": [], "visits": [],
+               "current_room": None, "previous_room": None}
+
+
+def _checked(state):
+    # A state that does not survive the codec would be timed as if it did
+    for checked in (state, EMPTY_STATE):
+        if codec.decode_state(codec.encode_state(checked))[0] != checked:
+            raise codec.CodecError("state does not round-trip: {}".format(checked))
+
+    return state
+
+
+@benchmark("state_encode_codec")
+def bench_state_encode_codec(world):
+    state = _checked(_played_state(world))
+    return _sized(lambda: codec.encode_state(state), codec.encode_state(state))
+
+
+@benchmark("state_decode_pickle")
+def bench_state_decode_pickle(world):
+    data = pickle.dumps(_played_state(world), pickle.HIGHEST_PROTOCOL)
+    return _sized(lambda: pickle.loads(data), data)
+
+
+@benchmark("state_decode_codec")
+def bench_state_decode_codec(world):
+    data = codec.encode_state(_checked(_played_state(world)))
+    return _sized(lambda: codec.decode_state(data), data)
+
+
+def _time(fn, repeat=3):
+    """
+    :return: tuple - (best seconds per call, number of calls per repeat)
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+
+    return min(timer.repeat(repeat=repeat, number=number)) / number, number
+
+
+def run(sizes=(10, 100, 1000), only=None, repeat=3, **world_params):
+    """
+    Runs the benchmarks on worlds of different sizes.
+    Saves are written into a temporary directory.
+    :param sizes: list of world sizes (number of rooms)
+    :param only: list of benchmark names to run (optional, defaults to all)
+    :param repeat: timing repeats, the best one is kept
+    :param world_params: passed to generate_world()
+    :return: dict (JSON-serializable)
+    """
+    names = [name for name in BENCHMARKS if not only or name in only]
+    results = {}
+
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp(prefix="pac-bench-")
+
+    try:
+        os.chdir(tmp)
+
+        for size in sizes:
+            for name in names:
+                # Every benchmark gets its own event handlers (and no instrumentation left over)
+                EventDispatcher.reset_instance()
+                world = generate_world(rooms=size, **world_params)
+                fn = BENCHMARKS[name](world)
+
+                try:
+                    seconds, number = _time(fn, repeat)
+                finally:
+                    if hasattr(fn, "teardown"):
+                        fn.teardown()
+
+                results["{}@{}".format(name, size)] = {
+                    "benchmark": name,
+                    "size": size,
+                    "per_op_us": seconds * 1e6,
+                    "ops_per_sec": 1 / seconds if seconds else 0.0,
+                    "number": number,
+                }
+
+                if hasattr(fn, "size"):
+                    results["{}@{}".format(name, size)]["bytes"] = fn.size
+
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+        PaCInterpreter.reset_instance()
+        EventDispatcher.reset_instance()
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "world": world_params,
+        },
+        "results": results,
+    }
+
+
+def save(results, path):
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Compares results to a baseline.
+    :param results: dict returned by run()
+    :param baseline: dict returned by run() (or loaded from its JSON)
+    :param threshold: relative slowdown that counts as a regression (0.1 = 10%)
+    :return: list of dicts (key, baseline_us, per_op_us, ratio, status), status is one of "regression", "improvement", "same", "new"
+    """
+    rows = []
+    base = baseline.get("results", {})
+
+    for key, res in sorted(results["results"].items()):
+        if key not in base:
+            rows.append({"key": key, "baseline_us": None, "per_op_us": res["per_op_us"], "ratio": None, "status": "new"})
+            continue
+
+        ratio = res["per_op_us"] / base[key]["per_op_us"] if base[key]["per_op_us"] else 1.0
+
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 - threshold:
+            status = "improvement"
+        else:
+            status = "same"
+
+        rows.append({"key": key, "baseline_us": base[key]["per_op_us"], "per_op_us": res["per_op_us"], "ratio": ratio, "status": status})
+
+    return rows
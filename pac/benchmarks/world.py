@@ -0,0 +1,110 @@
+# coding=utf-8
+"""
+Synthetic world generator for benchmarks.
+"""
+
+import random
+
+from ..pac import PaCInterpreter
+
+
+class SyntheticWorld:
+    """
+    A generated world and references to the objects the benchmarks need.
+    """
+    def __init__(self, pac, rooms, items, statics, params):
+        self.pac = pac
+
+        self.rooms = rooms
+        self.items = items
+        self.statics = statics
+
+        self.params = params
+
+
+def generate_world(rooms=100, link_density=2.0, items_per_room=2, requirement_depth=2, blueprints=10, seed=0):
+    """
+    Builds a random, fully connected world. The interpreter Singleton is reset, so any previous world is dropped.
+    :param rooms: number of rooms
+    :param link_density: average number of links going out of a room (two-way links are counted on both ends)
+    :param items_per_room: items placed in every room
+    :param requirement_depth: length of the pick up requirement chains (0 for no requirements)
+    :param blueprints: number of blueprints
+    :param seed: random seed, the same parameters and seed always build the same world
+    :return: SyntheticWorld
+    """
+    rng = random.Random(seed)
+    params = {
+        "rooms": rooms, "link_density": link_density, "items_per_room": items_per_room,
+        "requirement_depth": requirement_depth, "blueprints": blueprints, "seed": seed,
+    }
+
+    PaCInterpreter.reset_instance()
+    pac = PaCInterpreter(name="Synthetic {}".format(rooms), desc="Benchmark world", version="1")
+
+    room_list = []
+    for c in range(rooms):
+        room_list.append(pac.create_room(
+            name="room {}".format(c),
+            desc="You are in room number {}. It looks like every other room.".format(c),
+            on_first_enter="You enter room {} for the first time.".format(c),
+            starting=c == 0))
+
+    # A spanning tree of two-way links keeps every room reachable, the rest are random
+    for c in range(1, rooms):
+        pac.link_room(room_list[rng.randrange(c)], room_list[c], two_way=True)
+
+    extra = max(0, int(rooms * link_density / 2) - (rooms - 1))
+    for _ in range(extra):
+        pac.link_room(rng.choice(room_list), rng.choice(room_list), two_way=rng.random() < 0.5)
+
+    item_list = []
+    for room in room_list:
+        for _ in range(items_per_room):
+            item = pac.create_item(
+                name="item {}".format(len(item_list)),
+                desc="A perfectly ordinary item.",
+                on_use="You use the item. Nothing happens.",
+                is_craftable=True)
+
+            pac.put_item(room, item, "There is an item on the floor.")
+            item_list.append(item)
+
+    # Requirement chains: each item of a chain needs the previous one to be picked up
+    if requirement_depth > 0:
+        for c, item in enumerate(item_list):
+            if c % (requirement_depth + 1):
+                item.add_pick_up_requirement(item_list[c - 1])
+
+    static_list = []
+    for c, room in enumerate(room_list):
+        obj = pac.create_static_item(
+            name="static {}".format(c),
+            display="A static object stands in the corner.",
+            on_use="You poke the static object.")
+
+        pac.put_static_item(room, obj)
+        static_list.append(obj)
+
+        if room.items:
+            obj.add_item_blueprint(rng.choice(list(room.items.values())), "You use the item on the static object.")
+
+    # Results are items of their own that are in no room until they are crafted
+    # (an item in a room and in the inventory at once would be in two places of pac.locations)
+    for c in range(blueprints):
+        if len(item_list) < 2:
+            break
+
+        first, second = rng.sample(item_list, 2)
+        result = pac.create_item(
+            name="crafted item {}".format(c),
+            desc="An item made of two others.",
+            on_use="You use the crafted item. Nothing happens.",
+            is_craftable=True,
+            crafting_desc="You combine the items.")
+
+        pac.create_blueprint(first, second, result)
+
+    pac.set_starting_message("Synthetic benchmark world.")
+
+    return SyntheticWorld(pac, room_list, item_list, static_list, params)
@@ -0,0 +1,641 @@
+# coding=utf-8
+"""
+Serving a world from a pool of pre-forked worker processes.
+
+One interpreter only ever uses one core. WorkerPool forks the workers after the world is built (they share its
+memory until they write to it) and a dispatcher (an asyncio HTTP server with the same API as pac.server) sends
+every request to a worker chosen by consistent hashing of the session ID. The sessions are kept in a SessionStore
+shared by all workers, so when a worker dies or one is added the hash ring only moves the sessions of that worker
+and nothing else changes.
+
+python -m pac.cluster --world mygame:build_world --workers 8 --port 8080 --store sessions
+
+SIGHUP applies the edited world module to the pool and every worker (see pac.hotreload).
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+from collections import deque
+
+from .pac import PacException, InvalidParameters, PaCInterpreter
+from .server import CommandService, SessionStore, MAX_BODY_SIZE, check_session, respond, load_factory
+from .hotreload import reload_world
+
+log = logging.getLogger(__name__)
+
+# Frames between the dispatcher and the workers: length, then the path code and body (or the status and response)
+_frame = struct.Struct("!I")
+_status = struct.Struct("!H")
+
+PATHS = {"/command": b"c", "/complete": b"t", "/reset": b"r"}
+_CODES = {code: path for path, code in PATHS.items()}
+
+# Frame from the pool only (not a path: it imports code), body {"world": "module:function"}
+RELOAD = b"w"
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class WorkerLost(PacException):
+    """
+    Raised for requests that were sent to a worker that died before answering.
+    """
+    pass
+
+
+def _hash(key):
+    # Must be the same in every process (unlike hash())
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hashing: every node is put on the ring at a number of points (replicas) and owns the keys that hash
+    up to them. Adding or removing a node only moves the keys of that node, about 1/n of all.
+    """
+    def __init__(self, nodes=(), replicas=160):
+        """
+        :param nodes: initial nodes (anything with a stable str())
+        :param replicas: points per node, more spread the keys more evenly
+        :return: None
+        """
+        self.replicas = int(replicas)
+
+        self.points = []  # sorted hashes
+        self.owners = []  # node of every point
+        self.nodes = set()
+
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+
+        self.nodes.add(node)
+
+        for c in range(self.replicas):
+            point = _hash("{}#{}".format(node, c))
+            index = bisect.bisect(self.points, point)
+
+            self.points.insert(index, point)
+            self.owners.insert(index, node)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+
+        self.nodes.discard(node)
+
+        kept = [(point, owner) for point, owner in zip(self.points, self.owners) if owner != node]
+        self.points = [point for point, _ in kept]
+        self.owners = [owner for _, owner in kept]
+
+    def get(self, key):
+        """
+        :param key: string
+        :return: node owning the key, None if the ring is empty
+        """
+        if not self.points:
+            return None
+
+        index = bisect.bisect(self.points, _hash(key))
+        return self.owners[index % len(self.owners)]
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+
+        data += chunk
+
+    return bytes(data)
+
+
+def _worker_main(sock, close, store):
+    """
+    Runs in the forked worker: answers the dispatcher's requests until it closes the connection.
+    """
+    # Other workers' connections and the dispatcher's sockets belong to the parent
+    for fd in close:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+    # Workers forked while the dispatcher runs inherit its signal handling
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # The world was built before the fork, the interpreter is a Singleton
+    service = CommandService(PaCInterpreter(), store)
+
+    while True:
+        header = _recv_exactly(sock, _frame.size)
+        if header is None:
+            break
+
+        data = _recv_exactly(sock, _frame.unpack(header)[0])
+        if data is None:
+            break
+
+        try:
+            body = json.loads(data[1:].decode("utf-8"))
+        except (ValueError, UnicodeDecodeError):
+            status, body = 400, {"error": "bad-request", "message": "the body is not valid JSON"}
+        else:
+            if data[:1] == RELOAD:
+                status, body = _reload(service, body["world"])
+            else:
+                status, body = respond(service, _CODES.get(data[:1]), body)
+
+        response = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        sock.sendall(_frame.pack(len(response) + _status.size) + _status.pack(status) + response)
+
+
+def _reload(service, world):
+    # Every worker builds the new world itself, string ids of the pool's one mean nothing in a worker
+    try:
+        return 200, {"reloaded": service.reload(load_factory(world, reload=True)).summary()}
+    except Exception as e:
+        log.exception("Reloading the world failed")
+        return 500, {"error": "internal", "message": e.__class__.__name__}
+
+
+class _Worker:
+    __slots__ = ("slot", "process", "sock", "reader", "writer", "pending", "leaving", "task")
+
+    def __init__(self, slot, process, sock, reader, writer):
+        self.slot = slot
+        self.process = process
+        self.sock = sock
+
+        self.reader = reader
+        self.writer = writer
+
+        # Futures of the requests sent and not answered yet, a worker answers in order
+        self.pending = deque()
+
+        self.leaving = False
+        self.task = None
+
+
+class WorkerPool:
+    """
+    Worker processes forked from the one holding the world, with a hash ring of their slots.
+    A worker that dies is taken off the ring (its sessions move to the others) and a new one is forked into its slot.
+    Must be used from a running asyncio event loop.
+    """
+    def __init__(self, pac, workers=None, store=None, replicas=160, respawn=True, finalize=True):
+        """
+        :param pac: PaCInterpreter with the world built
+        :param workers: number of workers, defaults to the number of cores
+        :param store: SessionStore shared by the workers (defaults to the "sessions" directory)
+        :param replicas: points of every worker on the hash ring
+        :param respawn: fork a new worker when one dies
+        :param finalize: call PaCInterpreter.finalize() before forking, so the workers share the world's memory
+        :return: None
+        """
+        if not isinstance(pac, PaCInterpreter):
+            raise InvalidParameters
+
+        if store is None:
+            store = SessionStore()
+
+        if not isinstance(store, SessionStore):
+            raise InvalidParameters("workers need a shared SessionStore")
+
+        self.pac = pac
+        self.store = store
+
+        self.size = int(workers or os.cpu_count() or 1)
+        self.respawn = respawn
+        self.finalize = finalize
+
+        self.ring = HashRing(replicas=replicas)
+        self.workers = {}  # slot: _Worker
+        self.deaths = 0
+
+        # Session: (worker, future) of its last request, see request()
+        self.last = {}
+
+        # File descriptors the workers close after the fork (the dispatcher's sockets)
+        self.close_fds = []
+
+        self._context = multiprocessing.get_context("fork")
+        self._stopping = False
+
+    async def start(self):
+        """
+        Forks the workers.
+        :return: None
+        """
+        # Every worker starts from the beginning, done once so it is shared
+        if not self.pac.current_room:
+            self.pac.begin()
+
+        if self.finalize:
+            self.pac.finalize()
+
+        for slot in range(self.size):
+            await self.add_worker(slot)
+
+    async def add_worker(self, slot=None):
+        """
+        Forks a worker and puts it on the ring.
+        :param slot: slot of the worker (the first free one by default)
+        :return: slot
+        """
+        if slot is None:
+            slot = next(c for c in range(len(self.workers) + 1) if c not in self.workers)
+
+        if slot in self.workers:
+            raise InvalidParameters("slot {} is taken".format(slot))
+
+        parent, child = socket.socketpair()
+        close = [worker.sock.fileno() for worker in self.workers.values()] + [parent.fileno()] + self.close_fds
+
+        process = self._context.Process(target=_worker_main, args=(child, close, self.store), daemon=True)
+        process.start()
+        child.close()
+
+        reader, writer = await asyncio.open_connection(sock=parent)
+
+        worker = _Worker(slot, process, parent, reader, writer)
+        worker.task = asyncio.ensure_future(self._read_responses(worker))
+
+        self.workers[slot] = worker
+        self.ring.add(slot)
+
+        log.info("Worker {} started (pid {})".format(slot, process.pid))
+        return slot
+
+    async def remove_worker(self, slot):
+        """
+        Takes a worker off the ring and stops it once it has answered what was sent to it.
+        :return: None
+        """
+        worker = self.workers[slot]
+        worker.leaving = True
+        self.ring.remove(slot)
+
+        if worker.pending:
+            await asyncio.wait(list(worker.pending))
+
+        worker.writer.close()
+
+    async def _read_responses(self, worker):
+        reader = worker.reader
+
+        try:
+            while True:
+                header = await reader.readexactly(_frame.size)
+                data = await reader.readexactly(_frame.unpack(header)[0])
+
+                future = worker.pending.popleft()
+                if not future.done():
+                    future.set_result((_status.unpack_from(data)[0], data[_status.size:]))
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        await self._lost(worker)
+
+    async def _lost(self, worker):
+        if self.workers.get(worker.slot) is not worker:
+            return
+
+        del self.workers[worker.slot]
+        self.ring.remove(worker.slot)
+
+        while worker.pending:
+            future = worker.pending.popleft()
+            if not future.done():
+                future.set_exception(WorkerLost())
+
+        worker.writer.close()
+
+        if worker.process.is_alive():
+            worker.process.terminate()
+
+        # Reaped in a thread, requests to the other workers go on meanwhile
+        await asyncio.get_event_loop().run_in_executor(None, worker.process.join, 1)
+
+        if self._stopping or worker.leaving:
+            return
+
+        self.deaths += 1
+        log.warning("Worker {} (pid {}) died with exit code {}".format(worker.slot, worker.process.pid, worker.process.exitcode))
+
+        if self.respawn:
+            asyncio.ensure_future(self.add_worker(worker.slot))
+
+    async def request(self, session, path, body):
+        """
+        Sends a request to the worker of the session.
+        :param session: session ID
+        :param path: "/command", "/complete" or "/reset"
+        :param body: raw JSON body
+        :return: tuple - (HTTP status, raw JSON response)
+        :raise WorkerLost: if the worker died before answering (the command may or may not have been executed)
+        """
+        while True:
+            slot = self.ring.get(session)
+            if slot is None:
+                raise WorkerLost("no workers")
+
+            worker = self.workers[slot]
+
+            # A session that moved to another worker (a worker was added or died) waits for its last
+            # request on the old one, so two workers never run commands of the same session at once
+            last = self.last.get(session)
+            if last is None or last[0] is worker or last[1].done():
+                break
+
+            await asyncio.wait([last[1]])
+
+        future = asyncio.get_event_loop().create_future()
+
+        worker.pending.append(future)
+        worker.writer.write(_frame.pack(len(body) + 1) + PATHS[path] + body)
+
+        self.last[session] = (worker, future)
+
+        try:
+            return await future
+        finally:
+            if self.last.get(session, (None, None))[1] is future:
+                del self.last[session]
+
+    async def reload(self, world):
+        """
+        Applies the edited world to the pool's interpreter (workers forked later start with it) and
+        to every worker's, between their requests (see pac.hotreload).
+        :param world: "module:function" that builds the world
+        :return: list of tuples - (HTTP status, raw JSON response) of the workers
+        """
+        loop = asyncio.get_event_loop()
+
+        # The dispatcher keeps sending requests while the world is built
+        await loop.run_in_executor(None, reload_world, self.pac, load_factory(world, reload=True))
+
+        body = json.dumps({"world": world}).encode("utf-8")
+        futures = []
+
+        for worker in list(self.workers.values()):
+            future = loop.create_future()
+
+            worker.pending.append(future)
+            worker.writer.write(_frame.pack(len(body) + 1) + RELOAD + body)
+            futures.append(future)
+
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    def status(self):
+        """
+        :return: dict with the workers (slot, pid and requests waiting) and the number of deaths
+        """
+        return {
+            "workers": [{"slot": w.slot, "pid": w.process.pid, "pending": len(w.pending)}
+                        for _, w in sorted(self.workers.items())],
+            "deaths": self.deaths,
+        }
+
+    def stop(self):
+        """
+        Stops all workers.
+        :return: None
+        """
+        self._stopping = True
+
+        for worker in list(self.workers.values()):
+            worker.writer.close()
+
+        for worker in list(self.workers.values()):
+            worker.process.join(1)
+
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+
+        self.workers.clear()
+
+
+class _BadRequest(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+async def _read_request(reader):
+    """
+    :return: tuple - (method, path, headers, body), None when the client closed the connection
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+
+    try:
+        method, path, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise _BadRequest(400, "invalid request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise _BadRequest(400, "invalid Content-Length")
+
+    if length < 0 or length > MAX_BODY_SIZE:
+        raise _BadRequest(413 if length > 0 else 400, "invalid Content-Length")
+
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def _response(status, data, keep_alive=True):
+    head = "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n{}\r\n".format(
+        status, REASONS.get(status, ""), len(data), "" if keep_alive else "Connection: close\r\n")
+
+    return head.encode("latin-1") + data
+
+
+def _json(body):
+    return json.dumps(body, separators=(",", ":")).encode("utf-8")
+
+
+class Dispatcher:
+    """
+    The HTTP front of a WorkerPool: POST /command, /complete and /reset are sent to the worker of the session,
+    GET /health and /workers are answered by the dispatcher.
+    """
+    def __init__(self, pool):
+        """
+        :param pool: WorkerPool
+        :return: None
+        """
+        self.pool = pool
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=8080):
+        """
+        Starts listening.
+        :return: asyncio Server
+        """
+        self.server = await asyncio.start_server(self._connection, host, port)
+        self.pool.close_fds.extend(sock.fileno() for sock in self.server.sockets)
+
+        return self.server
+
+    async def _handle(self, method, path, body):
+        """
+        :return: tuple - (HTTP status, raw JSON response)
+        """
+        if method == "GET":
+            if path == "/health":
+                return 200, _json({"ok": bool(self.pool.workers), "workers": len(self.pool.workers)})
+            if path == "/workers":
+                return 200, _json(self.pool.status())
+
+        if method != "POST" or path not in PATHS:
+            return 404, _json({"error": "not-found", "message": "unknown path"})
+
+        try:
+            request = json.loads(body.decode("utf-8"))
+            session = check_session(request.get("session") if isinstance(request, dict) else None)
+        except (ValueError, UnicodeDecodeError):
+            return 400, _json({"error": "bad-request", "message": "the body is not valid JSON"})
+        except InvalidParameters as e:
+            return 400, _json({"error": "bad-request", "message": str(e)})
+
+        try:
+            return await self.pool.request(session, path, body)
+        except WorkerLost:
+            return 503, _json({"error": "unavailable", "message": "the worker was lost, the command may not have been executed"})
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except _BadRequest as e:
+                    writer.write(_response(e.status, _json({"error": "bad-request", "message": str(e)}), False))
+                    break
+
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+
+                status, data = await self._handle(method, path, body)
+
+                writer.write(_response(status, data, keep_alive))
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _reload_pool(pool, world):
+    try:
+        responses = await pool.reload(world)
+    except Exception:
+        log.exception("Reloading the world failed")
+    else:
+        log.info("Reloaded the world in {} of {} workers".format(
+            sum(1 for r in responses if not isinstance(r, Exception) and r[0] == 200), len(responses)))
+
+
+def serve(pac, workers=None, store=None, host="127.0.0.1", port=8080, ready=None, world=None):
+    """
+    Forks the workers and runs the dispatcher until interrupted (SIGINT or SIGTERM).
+    :param pac: PaCInterpreter with the world built
+    :param workers: number of workers, defaults to the number of cores
+    :param store: SessionStore
+    :param ready: function called with the port once the dispatcher is listening (optional)
+    :param world: "module:function" the world was built with, reloaded on SIGHUP (optional)
+    :return: None
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    pool = WorkerPool(pac, workers, store)
+
+    try:
+        loop.run_until_complete(pool.start())
+
+        server = loop.run_until_complete(Dispatcher(pool).start(host, port))
+        log.info("Serving on {}:{} with {} workers".format(host, server.sockets[0].getsockname()[1], pool.size))
+
+        if ready is not None:
+            ready(server.sockets[0].getsockname()[1])
+
+        loop.add_signal_handler(signal.SIGTERM, loop.stop)
+
+        if world is not None:
+            loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(_reload_pool(pool, world)))
+
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+
+        server.close()
+
+    finally:
+        pool.stop()
+        loop.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pac.cluster", description="Serves a world from a pool of worker processes.")
+    parser.add_argument("--world", required=True, help="module:function that builds the world and returns the PaCInterpreter")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: number of cores)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--store", default="sessions", help="directory with the session states")
+
+    args = parser.parse_args(argv)
+
+    serve(load_factory(args.world)(), args.workers, SessionStore(args.store), args.host, args.port, world=args.world)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    raise SystemExit(main())
@@ -0,0 +1,320 @@
+# coding=utf-8
+"""
+Compact binary format for game states (the dicts returned by PaCInterpreter.get_state()).
+
+Layout (integers are little-endian, varint = unsigned LEB128):
+
+    header      "PaCS", format version (u8)
+    game info   name and version: varint (length + 1, 0 for None) + utf-8 bytes
+    strings     varint count, varint byte length, utf-8 names separated by NUL
+    current     varint (string id + 1, 0 for None) of the current and previous room
+    rooms       varint count, id list (room names), count * u8 (entered), id list (item counts),
+                id list (items of all rooms, in order)
+    items       varint count, id list (item names), count * u8 (flags: used 1, picked up 2, crafted 4)
+    statics     id list of used static objects
+    inventory   id list
+    visits      id list
+
+An id list is: u8 width (1, 2 or 4 bytes), varint count, count packed unsigned integers.
+Lists are decoded with a single struct.unpack_from() straight from the buffer and the string table
+with a single split, so decoding does not loop over single bytes in Python.
+
+Decoding only reads from a memoryview of the input and never runs any code from it,
+so unlike pickle it is safe to use on saves from untrusted storage.
+"""
+
+import struct
+
+from .pac import PacException
+
+MAGIC = b"PaCS"
+VERSION = 1
+
+_header = struct.Struct("<4sB")
+
+# Width of an id list: struct format character
+_widths = {1: "B", 2: "H", 4: "I"}
+
+USED = 1
+PICKED_UP = 2
+CRAFTED = 4
+
+# flags byte: [used, picked up, crafted]
+_flags = [((f & USED) != 0, (f & PICKED_UP) != 0, (f & CRAFTED) != 0) for f in range(256)]
+
+
+class CodecError(PacException):
+    """
+    Raised when the data is not a valid encoded state.
+    """
+    pass
+
+
+def _varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+
+    out.append(value)
+
+
+def _id_list(out, values):
+    biggest = max(values) if values else 0
+
+    if biggest < 0x100:
+        width = 1
+    elif biggest < 0x10000:
+        width = 2
+    else:
+        width = 4
+
+    out.append(width)
+    _varint(out, len(values))
+    out += struct.pack("<{}{}".format(len(values), _widths[width]), *values)
+
+
+def _string(out, s):
+    if s is None:
+        out.append(0)
+        return
+
+    data = str(s).encode("utf-8")
+    _varint(out, len(data) + 1)
+    out += data
+
+
+class _Reader:
+    """
+    Reads values from a memoryview, keeping track of the position.
+    """
+    __slots__ = ("view", "pos")
+
+    def __init__(self, view, pos=0):
+        self.view = view
+        self.pos = pos
+
+    def varint(self):
+        view = self.view
+        pos = self.pos
+        result = 0
+        shift = 0
+
+        try:
+            while True:
+                byte = view[pos]
+                pos += 1
+                result |= (byte & 0x7f) << shift
+
+                if not byte & 0x80:
+                    break
+
+                shift += 7
+                if shift > 63:
+                    raise CodecError("varint too long")
+
+        except IndexError:
+            raise CodecError("truncated data")
+
+        self.pos = pos
+        return result
+
+    def take(self, length):
+        start = self.pos
+        end = start + length
+
+        if end > len(self.view):
+            raise CodecError("truncated data")
+
+        self.pos = end
+        return self.view[start:end]
+
+    def string(self):
+        length = self.varint()
+        if not length:
+            return None
+
+        try:
+            return str(self.take(length - 1), "utf-8")
+        except UnicodeDecodeError:
+            raise CodecError("invalid string")
+
+    def id_list(self):
+        width = self.take(1)[0]
+        if width not in _widths:
+            raise CodecError("invalid id list")
+
+        count = self.varint()
+        start = self.pos
+        self.take(count * width)
+
+        return struct.unpack_from("<{}{}".format(count, _widths[width]), self.view, start)
+
+
+def encode_state(state, game_info=None):
+    """
+    Encodes a state.
+    :param state: dict returned by PaCInterpreter.get_state()
+    :param game_info: dict with the game name and version (optional)
+    :return: bytes
+    """
+    strings = {}
+    setdefault = strings.setdefault
+
+    def sids(names):
+        return [setdefault(name, len(strings)) for name in names]
+
+    rooms = state.get("rooms", {})
+    items = state.get("items", {})
+
+    room_ids = sids(rooms.keys())
+    entered = bytes(1 if room[0] else 0 for room in rooms.values())
+    counts = [len(room[1]) for room in rooms.values()]
+    room_items = sids(name for room in rooms.values() for name in room[1])
+
+    item_ids = sids(items.keys())
+    flags = bytes((USED if used else 0) | (PICKED_UP if picked_up else 0) | (CRAFTED if crafted else 0)
+                  for used, picked_up, crafted in items.values())
+
+    statics = sids(state.get("statics", ()))
+    inventory = sids(state.get("inventory", ()))
+    visits = sids(state.get("visits", ()))
+
+    current, previous = (setdefault(name, len(strings)) + 1 if name is not None else 0
+                         for name in (state.get("current_room"), state.get("previous_room")))
+
+    table = "\0".join(strings)
+    if strings and table.count("\0") != len(strings) - 1:
+        raise CodecError("names can not contain NUL characters")
+
+    table = table.encode("utf-8")
+    game_info = game_info or {}
+
+    out = bytearray(_header.pack(MAGIC, VERSION))
+    _string(out, game_info.get("name"))
+    _string(out, game_info.get("version"))
+
+    _varint(out, len(strings))
+    _varint(out, len(table))
+    out += table
+
+    _varint(out, current)
+    _varint(out, previous)
+
+    _varint(out, len(room_ids))
+    _id_list(out, room_ids)
+    out += entered
+    _id_list(out, counts)
+    _id_list(out, room_items)
+
+    _varint(out, len(item_ids))
+    _id_list(out, item_ids)
+    out += flags
+
+    _id_list(out, statics)
+    _id_list(out, inventory)
+    _id_list(out, visits)
+
+    return bytes(out)
+
+
+def _read_header(data):
+    view = memoryview(data)
+
+    if len(view) < _header.size:
+        raise CodecError("truncated data")
+
+    magic, version = _header.unpack_from(view)
+    if magic != MAGIC:
+        raise CodecError("not an encoded state")
+
+    if version != VERSION:
+        raise CodecError("unsupported format version {}".format(version))
+
+    reader = _Reader(view, _header.size)
+    game_info = {"name": reader.string(), "version": reader.string()}
+
+    return reader, game_info
+
+
+def is_encoded(data):
+    """
+    :param data: bytes
+    :return: bool indicating if data starts like an encoded state
+    """
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def read_game_info(data):
+    """
+    Decodes only the game info (cheap, for checking saves).
+    :param data: bytes
+    :return: dict with name and version
+    """
+    return _read_header(data)[1]
+
+
+def decode_state(data):
+    """
+    Decodes a state encoded with encode_state().
+    :param data: bytes (or anything supporting the buffer protocol)
+    :return: tuple - (state dict, game info dict)
+    """
+    reader, game_info = _read_header(data)
+
+    # The length of the table is written even when it is empty
+    count = reader.varint()
+    size = reader.varint()
+    try:
+        strings = str(reader.take(size), "utf-8").split("\0") if count else []
+    except UnicodeDecodeError:
+        raise CodecError("invalid string")
+
+    if len(strings) != count:
+        raise CodecError("invalid string table")
+
+    name = strings.__getitem__
+
+    try:
+        current, previous = (name(value - 1) if value else None for value in (reader.varint(), reader.varint()))
+
+        count = reader.varint()
+        room_names = list(map(name, reader.id_list()))
+        entered = reader.take(count)
+        counts = reader.id_list()
+        room_items = list(map(name, reader.id_list()))
+
+        if len(room_names) != count or len(counts) != count or sum(counts) != len(room_items):
+            raise CodecError("invalid rooms")
+
+        rooms = {}
+        pos = 0
+        for room, was_entered, item_count in zip(room_names, entered, counts):
+            rooms[room] = [was_entered != 0, room_items[pos:pos + item_count]]
+            pos += item_count
+
+        count = reader.varint()
+        item_names = list(map(name, reader.id_list()))
+        flags = reader.take(count)
+
+        if len(item_names) != count:
+            raise CodecError("invalid items")
+
+        items = dict(zip(item_names, map(list, map(_flags.__getitem__, flags))))
+
+        state = {
+            "rooms": rooms,
+            "items": items,
+            "statics": list(map(name, reader.id_list())),
+            "inventory": list(map(name, reader.id_list())),
+            "visits": list(map(name, reader.id_list())),
+            "current_room": current,
+            "previous_room": previous,
+        }
+
+    except IndexError:
+        raise CodecError("invalid string id")
+
+    if reader.pos != len(reader.view):
+        raise CodecError("trailing data")
+
+    return state, game_info
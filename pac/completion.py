@@ -0,0 +1,311 @@
+# coding=utf-8
+"""
+Tab completion of commands.
+
+Verbs and the names the player can type next (items and objects in the room, exits, items in the inventory)
+are kept in prefix tries. The tries of the room and the inventory follow the item location index
+(pac.locations), so they change by one name when an item moves and are rebuilt from the room's contents
+(not the world) when the player walks into another room.
+
+    pac.complete("pick up ph")    # ["pick up phone"]
+"""
+
+from .pac import COMMANDS, ARGUMENT_VERBS, parse_command, strip_article, _name_keys
+
+# Separators of the two names of "use item with object" and "combine item with item"
+USE_SEPARATORS = (" with ", " on ")
+COMBINE_SEPARATORS = (" with ", " and ")
+
+# Verbs offered by completion (phrases of COMMANDS that are only there to understand the player are left out)
+VERBS = ("help", "ways", "items", "go back", "walk to ", "go to ", "pick up ", "use ", "combine ", "inventory",
+         "where", "stats", "slots", "load ", "undo", "redo", "save", "exit")
+
+
+class PrefixTrie:
+    """
+    Set of words with counts (the same name can be added by several objects) that lists the words with a prefix.
+    """
+    # Key of the count in a node, no character is None
+    END = None
+
+    def __init__(self, words=()):
+        self.root = {}
+        self.size = 0
+
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        node = self.root
+
+        for char in word:
+            child = node.get(char)
+
+            if child is None:
+                child = node[char] = {}
+
+            node = child
+
+        count = node.get(self.END, 0)
+        node[self.END] = count + 1
+
+        if not count:
+            self.size += 1
+
+    def remove(self, word):
+        """
+        Removes one count of the word, nothing happens if it is not in the trie.
+        :return: None
+        """
+        path = []
+        node = self.root
+
+        for char in word:
+            child = node.get(char)
+            if child is None:
+                return
+
+            path.append((node, char))
+            node = child
+
+        count = node.get(self.END)
+        if not count:
+            return
+
+        if count > 1:
+            node[self.END] = count - 1
+            return
+
+        del node[self.END]
+        self.size -= 1
+
+        # Drops the branch that only led to the word
+        for parent, char in reversed(path):
+            if parent[char]:
+                break
+
+            del parent[char]
+
+    def __contains__(self, word):
+        node = self._find(word)
+        return node is not None and self.END in node
+
+    def __len__(self):
+        return self.size
+
+    def _find(self, prefix):
+        node = self.root
+
+        for char in prefix:
+            node = node.get(char)
+
+            if node is None:
+                return None
+
+        return node
+
+    def complete(self, prefix, limit=None):
+        """
+        :param prefix: string
+        :param limit: maximum number of words
+        :return: sorted list of the words starting with prefix
+        """
+        node = self._find(prefix)
+        if node is None:
+            return []
+
+        words = []
+        stack = [(node, prefix)]
+
+        while stack:
+            node, word = stack.pop()
+
+            for char, child in node.items():
+                if char is None:
+                    words.append(word)
+                else:
+                    stack.append((child, word + char))
+
+        words.sort()
+        return words[:limit] if limit is not None else words
+
+    def clear(self):
+        self.root = {}
+        self.size = 0
+
+
+class Completer:
+    """
+    Completes commands of a player of a PaCInterpreter.
+    """
+    def __init__(self, pac, player=None):
+        """
+        :param pac: PaCInterpreter
+        :param player: pac.Player (pac.multiplayer.Participant), defaults to the interpreter's player
+        :return: None
+        """
+        self.pac = pac
+        self.player = player if player is not None else pac.player
+
+        self.verbs = PrefixTrie(VERBS)
+
+        # Names in the current room, of the exits and of the inventory
+        self.items = PrefixTrie()
+        self.statics = PrefixTrie()
+        self.exits = PrefixTrie()
+        self.inventory = PrefixTrie(key for item in self.player.inv for key in _name_keys(item))
+
+        self.room = None
+
+        # Only moves into and out of the inventory and the current room (see _enter()) are followed
+        pac.locations.watch(self.player.inv.owner, self._moved)
+
+    def close(self):
+        """
+        Stops following the world (the completer can not be used anymore).
+        :return: None
+        """
+        locations = self.pac.locations
+
+        locations.unwatch(self.player.inv.owner, self._moved)
+        if self.room is not None:
+            locations.unwatch(self.room, self._moved)
+
+    def _moved(self, item, old, new):
+        # Called by the item location index after an item moved
+        owner = self.player.inv.owner
+
+        for location, change in ((old, PrefixTrie.remove), (new, PrefixTrie.add)):
+            if location is None:
+                continue
+
+            if location is self.room:
+                trie = self.items
+            elif location is owner:
+                trie = self.inventory
+            else:
+                continue
+
+            for key in _name_keys(item):
+                change(trie, key)
+
+    def _enter(self, room):
+        # Rebuilds the tries of the room the player is in
+        locations = self.pac.locations
+
+        if self.room is not None:
+            locations.unwatch(self.room, self._moved)
+        if room is not None:
+            locations.watch(room, self._moved)
+
+        self.room = room
+
+        self.items.clear()
+        self.statics.clear()
+        self.exits.clear()
+
+        if room is None:
+            return
+
+        for item in room.items.values():
+            for key in _name_keys(item):
+                self.items.add(key)
+
+        for key in room.static_names:
+            self.statics.add(key)
+
+        for key in self.pac.exit_names(room):
+            self.exits.add(key)
+
+    def _names(self, verb, argument):
+        """
+        :return: tuple - (what the player typed before the name being completed, tries of the names)
+        """
+        if verb == "walk":
+            return "", (self.exits,)
+
+        elif verb == "pickup":
+            return "", (self.items,)
+
+        elif verb == "use":
+            for separator in USE_SEPARATORS:
+                before, found, _ = argument.rpartition(separator)
+
+                if found:
+                    return before + separator, (self.statics,)
+
+            return "", (self.inventory, self.statics)
+
+        elif verb == "combine":
+            for separator in COMBINE_SEPARATORS:
+                before, found, _ = argument.rpartition(separator)
+
+                if found:
+                    return before + separator, (self.inventory,)
+
+            return "", (self.inventory,)
+
+        return "", ()
+
+    def complete(self, line, limit=20):
+        """
+        :param line: what the player typed so far
+        :param limit: maximum number of completions
+        :return: sorted list of whole lines starting with it
+        """
+        room = self.player.current_room
+        if room is not self.room:
+            self._enter(room)
+
+        lowered = line.lower()
+        verb, _ = parse_command(line)
+
+        phrases = [phrase for phrase in _argument_phrases(verb) if lowered.startswith(phrase)]
+
+        # Still typing the verb
+        if not phrases:
+            return self.verbs.complete(lowered.lstrip(), limit)
+
+        argument = lowered[len(max(phrases, key=len)):]
+        head, tries = self._names(verb, argument)
+
+        # Names are normalized: lower case and without an article
+        name = strip_article(argument[len(head):].lstrip(" "))
+        start = line[:len(line) - len(name)]
+
+        names = set()
+        for trie in tries:
+            names.update(trie.complete(name))
+
+        return [start + name for name in sorted(names)[:limit]]
+
+    def readline_completer(self):
+        """
+        :return: function for readline.set_completer() (with readline.set_completer_delims(""))
+        """
+        matches = []
+
+        def complete(text, state):
+            if state == 0:
+                matches[:] = self.complete(text)
+
+            return matches[state] if state < len(matches) else None
+
+        return complete
+
+
+def _argument_phrases(verb):
+    # What can be typed before the argument of a verb ("walk to ", "go ", ...)
+    if verb not in ARGUMENT_VERBS:
+        return ()
+
+    phrases = _PHRASES.get(verb)
+
+    if phrases is None:
+        phrases = _PHRASES[verb] = tuple(prefix if prefix.endswith(" ") else prefix + " "
+                                         for prefixes, v in COMMANDS if v == verb for prefix in prefixes)
+
+    return phrases
+
+
+_PHRASES = {}
@@ -0,0 +1,129 @@
+# coding=utf-8
+"""
+State flags of a world's rooms, items and objects packed into byte vectors.
+
+Every Room, Item and StaticObject of a world gets a byte in the vector of its kind, its flags (entered, used,
+picked up, crafted) are bits of that byte. A copy of the vector is the flag state of the whole world in one
+bytes object, and comparing, diffing and querying ("which items were used") run over the buffer instead of
+over thousands of objects.
+"""
+
+import re
+
+# Runs of bytes that differ (non-zero after xor), see FlagVector.diff()
+_nonzero = re.compile(b"[^\x00]+")
+
+
+def _mask(bit):
+    # bytes.translate() table: 1 where the bit is set, 0 elsewhere
+    return bytes(1 if value & bit else 0 for value in range(256))
+
+
+class FlagVector:
+    """
+    One byte of flags per object of a kind, in the order the objects were added.
+    """
+    def __init__(self, bits):
+        """
+        :param bits: dict {flag name: bit}
+        :return: None
+        """
+        self.bits = dict(bits)
+        self._masks = {name: _mask(bit) for name, bit in self.bits.items()}
+
+        # Only changed in place, the objects hold on to it
+        self.data = bytearray()
+        self.objects = []
+
+    def add(self, obj):
+        """
+        Gives obj its byte, its current flags are moved into it.
+        :param obj: object with _Flag attributes named as in bits
+        :return: None
+        """
+        value = 0
+        for name, bit in self.bits.items():
+            if obj.__dict__.pop(name, False):
+                value |= bit
+
+        obj._index = len(self.data)
+        obj._flags = self.data
+
+        self.data.append(value)
+        self.objects.append(obj)
+
+    def __len__(self):
+        return len(self.data)
+
+    def snapshot(self):
+        """
+        :return: bytes, a copy of the flags of all objects
+        """
+        return bytes(self.data)
+
+    def diff(self, snapshot):
+        """
+        :param snapshot: bytes returned by snapshot() (of this vector, objects added since count as all zeros)
+        :return: list of the indexes of the objects whose flags differ from the snapshot
+        """
+        data = self.data
+        size = len(data)
+
+        if len(snapshot) < size:
+            snapshot = bytes(snapshot) + bytes(size - len(snapshot))
+
+        changed = int.from_bytes(data, "little") ^ int.from_bytes(snapshot[:size], "little")
+        if not changed:
+            return []
+
+        indexes = []
+        for run in _nonzero.finditer(changed.to_bytes(size, "little")):
+            start = run.start()
+
+            for offset, value in enumerate(run.group()):
+                if value:
+                    indexes.append(start + offset)
+
+        return indexes
+
+    def restore(self, snapshot):
+        """
+        Sets the flags of the objects that differ from the snapshot through their attributes
+        (so the changes are recorded like any other), takes time proportional to the differences.
+        :param snapshot: bytes returned by snapshot()
+        :return: list of the objects that changed
+        """
+        changed = []
+        size = len(snapshot)
+
+        for index in self.diff(snapshot):
+            obj = self.objects[index]
+            value = snapshot[index] if index < size else 0
+
+            for name, bit in self.bits.items():
+                setattr(obj, name, bool(value & bit))
+
+            changed.append(obj)
+
+        return changed
+
+    def select(self, name):
+        """
+        :param name: flag name
+        :return: list of the objects with the flag set
+        """
+        flagged = self.data.translate(self._masks[name])
+        objects = self.objects
+
+        selected = []
+        for run in _nonzero.finditer(flagged):
+            selected.extend(objects[run.start():run.end()])
+
+        return selected
+
+    def count(self, name):
+        """
+        :param name: flag name
+        :return: number of objects with the flag set
+        """
+        return self.data.translate(self._masks[name]).count(1)
@@ -0,0 +1,123 @@
+# coding=utf-8
+"""
+Typo-tolerant name matching with trigrams.
+
+Names are compared by the Dice coefficient of their trigram sets. Matching against the few names in
+a room (its items, objects and exits) only intersects small sets, which are cached.
+"""
+
+from collections import OrderedDict
+
+
+def trigrams(name):
+    """
+    :param name: normalized name
+    :return: frozenset of the trigrams of the name (padded, so short names have some as well)
+    """
+    padded = "  {} ".format(name)
+    return frozenset(padded[c:c + 3] for c in range(len(padded) - 2))
+
+
+class FuzzyMatcher:
+    """
+    Finds the names closest to a mistyped one.
+    """
+    def __init__(self, accept=0.5, suggest=0.3, cache_size=4096, grams_cache_size=16384):
+        """
+        :param accept: minimum similarity (0 - 1) for a name to be taken instead of the typed one
+        :param suggest: minimum similarity for a name to be suggested ("Did you mean ...?")
+        :param cache_size: number of cached rank() results
+        :param grams_cache_size: number of names whose trigram sets are kept
+        :return: None
+        """
+        self.accept = accept
+        self.suggest_threshold = suggest
+
+        # Trigram sets of recently compared names (those of a room are compared over and over)
+        self.grams_cache_size = grams_cache_size
+        self._grams_cache = OrderedDict()
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def _grams(self, name):
+        cache = self._grams_cache
+        grams = cache.get(name)
+
+        if grams is None:
+            grams = cache[name] = trigrams(name)
+
+            if len(cache) > self.grams_cache_size:
+                try:
+                    cache.popitem(last=False)
+                except KeyError:
+                    pass
+
+        return grams
+
+    def similarity(self, first, second):
+        """
+        :return: Dice coefficient of the trigrams of two normalized names (1 is the same name)
+        """
+        a = self._grams(first)
+        b = self._grams(second)
+
+        return 2.0 * len(a & b) / (len(a) + len(b))
+
+    def rank(self, name, candidates):
+        """
+        Ranks the candidates by similarity to name (cached).
+        :param name: normalized name
+        :param candidates: iterable of normalized names
+        :return: list of (similarity, candidate), most similar first, only those above the suggest threshold
+        """
+        key = (name, tuple(candidates))
+
+        ranked = self._cache.get(key)
+        if ranked is not None:
+            try:
+                self._cache.move_to_end(key)
+            except KeyError:
+                # Dropped by another thread (pac.multiplayer) in the meantime
+                pass
+
+            return ranked
+
+        grams = self._grams(name)
+        size = len(grams)
+
+        ranked = []
+        for candidate in key[1]:
+            other = self._grams(candidate)
+            score = 2.0 * len(grams & other) / (size + len(other))
+
+            if score >= self.suggest_threshold:
+                ranked.append((score, candidate))
+
+        ranked.sort(key=lambda pair: (-pair[0], pair[1]))
+
+        self._cache[key] = ranked
+        if len(self._cache) > self.cache_size:
+            try:
+                self._cache.popitem(last=False)
+            except KeyError:
+                pass
+
+        return ranked
+
+    def match(self, name, candidates):
+        """
+        :param name: normalized name
+        :param candidates: iterable of normalized names
+        :return: tuple - (accepted candidate or None, best candidate to suggest or None)
+        """
+        ranked = self.rank(name, candidates)
+
+        if not ranked:
+            return None, None
+
+        score, best = ranked[0]
+        if score >= self.accept:
+            return best, None
+
+        return None, best
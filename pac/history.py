@@ -0,0 +1,223 @@
+# coding=utf-8
+"""
+Undo/redo with checkpoints stored as reversible deltas.
+
+While a History is enabled, the first time a room, item or object changes after a checkpoint its
+previous state (its "image") is recorded. A checkpoint therefore costs as much as the changes made
+since the last one, never a copy of the world. The inventory, current and previous room are copied
+(they are small) and visits, which only grow while playing, are recorded as a length.
+"""
+
+from collections import deque
+
+from .pac import Room, Item
+
+
+def _image(obj):
+    """
+    :return: state of a Room, Item or StaticObject that can be applied with _apply()
+    """
+    if isinstance(obj, Room):
+        return obj.entered, dict(obj.items), dict(obj.item_descriptions)
+
+    elif isinstance(obj, Item):
+        return obj.used, obj.picked_up, obj.crafted, obj.changes.locations.locate(obj)
+
+    return obj.used
+
+
+def _apply(obj, image):
+    if isinstance(obj, Room):
+        obj.entered, items, descriptions = image
+
+        obj.clear_items()
+        obj.items.update(items)
+        obj.item_descriptions.update(descriptions)
+        obj._index_items()
+
+    elif isinstance(obj, Item):
+        obj.used, obj.picked_up, obj.crafted, location = image
+
+        locations = obj.changes.locations
+        if location is not None:
+            locations.put(obj, location)
+        else:
+            locations.take(obj, locations.locate(obj))
+
+    else:
+        obj.used = image
+
+
+class Step:
+    """
+    The state of what changed between two checkpoints, applying it moves the world back (or forward).
+    """
+    __slots__ = ("objects", "player", "visits")
+
+    def __init__(self, objects, player, visits):
+        """
+        :param objects: dict {Room/Item/StaticObject: image}
+        :param player: tuple - (inventory, current room, previous room)
+        :param visits: tuple - (length, rooms): visits are cut to length and the rooms are appended
+        """
+        self.objects = objects
+        self.player = player
+        self.visits = visits
+
+    def apply(self, pac):
+        """
+        Applies the step.
+        :return: Step that reverses this one
+        """
+        length, rooms = self.visits
+        reverse = Step({obj: _image(obj) for obj in self.objects},
+                       (tuple(pac.inv), pac.current_room, pac.previous_room),
+                       (length, pac.visits[length:]))
+
+        for obj, image in self.objects.items():
+            _apply(obj, image)
+
+        inv, pac.current_room, pac.previous_room = self.player
+        pac.inv[:] = inv
+
+        del pac.visits[length:]
+        pac.visits.extend(rooms)
+
+        return reverse
+
+
+class History:
+    """
+    Checkpoints of a PaCInterpreter that can be undone and redone, at most depth of them are kept.
+    """
+    def __init__(self, pac, depth=100):
+        """
+        :param pac: PaCInterpreter
+        :param depth: number of checkpoints that can be undone (the oldest ones are dropped)
+        :return: None
+        """
+        self.pac = pac
+        self.depth = max(int(depth), 1)
+
+        self.undo_steps = deque(maxlen=self.depth)
+        self.redo_steps = []
+
+        self._mark()
+
+    def _mark(self):
+        # Starts recording the changes since this point
+        pac = self.pac
+
+        self.objects = {}
+        self.player = (tuple(pac.inv), pac.current_room, pac.previous_room)
+        self.visits = len(pac.visits)
+        self.old_visits = None  # Copy of visits if they were replaced (set_state)
+
+    def touch(self, obj):
+        """
+        Called (by the world objects) before obj changes.
+        :return: None
+        """
+        if obj not in self.objects:
+            self.objects[obj] = _image(obj)
+
+    def touch_visits(self):
+        """
+        Called before visits are replaced instead of appended to.
+        :return: None
+        """
+        if self.old_visits is None:
+            self.old_visits = list(self.pac.visits)
+
+    def _close(self):
+        """
+        :return: Step back to the last checkpoint, None if nothing changed since
+        """
+        pac = self.pac
+
+        if self.old_visits is not None:
+            visits = (0, self.old_visits)
+        elif len(pac.visits) != self.visits:
+            visits = (self.visits, [])
+        else:
+            visits = None
+
+        player = (tuple(pac.inv), pac.current_room, pac.previous_room)
+
+        if not self.objects and visits is None and player == self.player:
+            return None
+
+        return Step(self.objects, self.player, visits or (self.visits, []))
+
+    def checkpoint(self):
+        """
+        Records a checkpoint that undo() goes back to (execute() does this before every command).
+        :return: bool indicating if anything changed since the last checkpoint
+        """
+        step = self._close()
+
+        if step is not None:
+            self.undo_steps.append(step)
+            self.redo_steps.clear()
+
+        self._mark()
+        return step is not None
+
+    def _apply(self, step):
+        # Applying a step must not record itself
+        journal = self.pac.changed.journal
+        self.pac.changed.journal = None
+
+        try:
+            return step.apply(self.pac)
+        finally:
+            self.pac.changed.journal = journal
+
+    def _move(self, source, target):
+        self.checkpoint()
+
+        if not source:
+            return False
+
+        target.append(self._apply(source.pop()))
+
+        self._mark()
+        return True
+
+    def undo(self):
+        """
+        Goes back to the previous checkpoint.
+        :return: bool indicating if there was anything to undo
+        """
+        return self._move(self.undo_steps, self.redo_steps)
+
+    def redo(self):
+        """
+        Reapplies the last undone checkpoint. Any change after undo() drops what could be redone.
+        :return: bool indicating if there was anything to redo
+        """
+        return self._move(self.redo_steps, self.undo_steps)
+
+    def changes(self):
+        """
+        :return: list of the rooms, items and objects that are different than at the last checkpoint
+        """
+        return [obj for obj, image in self.objects.items() if _image(obj) != image]
+
+    def rewind(self):
+        """
+        Goes back to the last checkpoint, the changes made since are dropped (they can not be redone).
+        :return: bool indicating if anything changed since the checkpoint
+        """
+        step = self._close()
+
+        if step is not None:
+            self._apply(step)
+
+        self._mark()
+        return step is not None
+
+    def clear(self):
+        self.undo_steps.clear()
+        self.redo_steps.clear()
+        self._mark()
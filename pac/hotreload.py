@@ -0,0 +1,428 @@
+# coding=utf-8
+"""
+Reloading the world's definition while it is being played.
+
+The new definition is built by the same kind of function that built the running world (see pac.server.load_factory)
+and compared with it by names. The differences are collected into a WorldPatch: changed texts, requirements,
+blueprints and aliases, new rooms, items and objects, new links and placements. Applying the patch changes the
+running world in place, so references, the state of the game (entered, used, what is where) and the states of
+sessions stay valid. Comparing takes as long as walking through both worlds and can run while commands are
+executed, applying takes as long as the patch is big (commands have to wait for it).
+
+Rooms, items, objects and links that are not in the new definition are kept: saves and sessions may refer to them.
+Items that already exist stay where the game put them, new items are put into their rooms (a session that
+changed the room before keeps its own list of what is in it). Event handlers of the new definition are not
+used, they are code.
+
+    patch = reload_world(pac, build_my_world)
+"""
+
+import logging
+
+from .pac import PaCInterpreter, EventDispatcher, Singleton, InvalidParameters
+
+log = logging.getLogger(__name__)
+
+# Text attributes (see pac.strings.Text)
+ROOM_TEXTS = ("desc", "on_first_enter")
+ITEM_TEXTS = ("desc", "on_use", "on_pickup", "crafting_description", "on_failed_use", "on_failed_pickup")
+STATIC_TEXTS = ("display", "on_use", "on_failed_use")
+
+
+def build_world(factory):
+    """
+    Builds a world next to the running one (the interpreter and event dispatcher are Singletons).
+    :param factory: function that builds the world and returns the PaCInterpreter
+    :return: PaCInterpreter
+    """
+    saved = {cls: Singleton._instances.pop(cls, None) for cls in (PaCInterpreter, EventDispatcher)}
+
+    try:
+        world = factory()
+    finally:
+        for cls, instance in saved.items():
+            if instance is not None:
+                Singleton._instances[cls] = instance
+            else:
+                Singleton._instances.pop(cls, None)
+
+    if not isinstance(world, PaCInterpreter):
+        raise InvalidParameters("the world function must return a PaCInterpreter")
+
+    return world
+
+
+def _music(obj):
+    return getattr(obj.music, "path", None) if obj.music is not None else None
+
+
+def _room_requirements(room):
+    return ([(item.name, on_deny) for item, on_deny in room.requirements["items"]],
+            [(other.name, on_deny) for other, on_deny in room.requirements["visited"]])
+
+
+class WorldPatch:
+    """
+    Differences between a running world and a new definition of it, by names.
+    """
+    def __init__(self):
+        # Rooms, Items and StaticObjects of the new world that the running one does not have
+        self.rooms = []
+        self.items = []
+        self.statics = []
+
+        # (kind, name, attribute, value): kind is "room", "item" or "static", value is what the new world has
+        # (texts as string ids, objects as names)
+        self.values = []
+
+        self.links = []               # (room name, linked room name)
+        self.placements = []          # (room name, item name, description)
+        self.static_placements = []   # (room name, object name, description)
+        self.blueprints = []          # (item name, item name, result name), new or replacing the one of the pair
+        self.aliases = []             # (kind, name, list of aliases)
+
+        self.starting_room = None
+        self.starting_message = None
+
+        # Names only the running world has (kept)
+        self.removed = []
+
+    def __len__(self):
+        return (len(self.rooms) + len(self.items) + len(self.statics) + len(self.values) + len(self.links) +
+                len(self.placements) + len(self.static_placements) + len(self.blueprints) + len(self.aliases) +
+                (self.starting_room is not None) + (self.starting_message is not None))
+
+    def touched_rooms(self):
+        """
+        :return: set of the names of rooms of the running world the patch changes
+        """
+        new = {room.name for room in self.rooms}
+
+        touched = {name for kind, name, _, _ in self.values if kind == "room"}
+        touched.update(name for name, _ in self.links)
+        touched.update(name for name, _, _ in self.placements)
+        touched.update(name for name, _, _ in self.static_placements)
+        touched.update(name for kind, name, _ in self.aliases if kind == "room")
+
+        return touched - new
+
+    def summary(self):
+        """
+        :return: dict with the number of changes of every kind
+        """
+        return {
+            "rooms": len(self.rooms), "items": len(self.items), "statics": len(self.statics),
+            "values": len(self.values), "links": len(self.links),
+            "placements": len(self.placements) + len(self.static_placements),
+            "blueprints": len(self.blueprints), "aliases": len(self.aliases), "removed": len(self.removed),
+        }
+
+    # Applying
+
+    def apply(self, pac):
+        """
+        Changes the running world (between commands, see PaCInterpreter.execute()).
+        What the patch adds is part of the world and not of the game: it is not recorded for undo and
+        does not count as changed (pac.changed), so states of sessions and saves made before apply it as well.
+        :param pac: the running PaCInterpreter
+        :return: None
+        """
+        changes = pac.changed
+        journal = changes.journal
+        changes.journal = None
+
+        try:
+            changed = self._apply(pac)
+        finally:
+            changes.journal = journal
+
+        # Rooms that only changed by getting new items are as they start
+        for room in changed:
+            changes.pop(room, None)
+
+        # New exits, the room is looked at again on the next completion
+        if pac.completer is not None:
+            pac.completer.room = None
+
+    def _apply(self, pac):
+        # Returns the rooms that were not changed before and got items
+        kinds = {"room": pac.rooms, "item": pac.items, "static": pac.statics}
+
+        # New objects first, everything below can refer to them. Texts are copied as string ids.
+        for new in self.rooms:
+            room = pac.create_room(new.name, "-")
+            room.__dict__.update((name, new.__dict__[name]) for name in ROOM_TEXTS)
+            room.music = new.music
+
+        for new in self.items:
+            item = pac.create_item(new.name, "-")
+            item.__dict__.update((name, new.__dict__[name]) for name in ITEM_TEXTS)
+            item.is_craftable = new.is_craftable
+
+        for new in self.statics:
+            obj = pac.create_static_item(new.name, "-")
+            obj.__dict__.update((name, new.__dict__[name]) for name in STATIC_TEXTS)
+            obj.music = new.music
+
+        # Before placing, so the rooms index the new items by their aliases as well
+        for kind, name, aliases in self.aliases:
+            pac.add_alias(kinds[kind][name], *aliases)
+
+        for kind, name, attribute, value in self.values:
+            obj = kinds[kind][name]
+
+            if attribute in ("items", "visited"):
+                objects = pac.items if attribute == "items" else pac.rooms
+                obj.requirements[attribute] = [(objects[other], on_deny) for other, on_deny in value]
+
+            elif attribute in ("pickup_requires", "use_requires", "item_requirements"):
+                setattr(obj, attribute, [pac.items[other] for other in value])
+
+            elif attribute == "item_blueprints":
+                obj.item_blueprints = dict(value)
+
+            elif attribute == "item_description":
+                # Shown while the item is in the room
+                item_name, description = value
+                obj.placements[item_name] = description
+
+                if item_name in obj.item_descriptions:
+                    obj.item_descriptions[item_name] = description
+
+            elif attribute == "static_description":
+                obj.static_obj_descriptions[value[0]] = value[1]
+
+            elif attribute in ("music", "is_craftable"):
+                setattr(obj, attribute, value)
+
+            else:
+                obj.__dict__[attribute] = value
+
+        for name, other in self.links:
+            pac.link_room(pac.rooms[name], pac.rooms[other])
+
+        for name, other, description in self.static_placements:
+            pac.rooms[name].put_static_obj(pac.statics[other], description)
+
+        changed = []
+        initial = pac.initial_state["rooms"] if pac.initial_state is not None else {}
+
+        for name, item_name, description in self.placements:
+            room = pac.rooms[name]
+
+            if room not in pac.changed:
+                changed.append(room)
+
+            room.put_item(pac.items[item_name], description)
+
+            # reset() puts back the items of the rooms in the initial state
+            if name in initial:
+                initial[name][1].append(item_name)
+
+        # A changed result replaces the blueprint of the pair in place, combine() uses the first one it finds
+        positions = {}
+        for c, (first, second, _) in enumerate(pac.blueprints):
+            positions.setdefault(frozenset((first.name, second.name)), c)
+
+        for first, second, result in self.blueprints:
+            blueprint = (pac.items[first], pac.items[second], pac.items[result])
+            position = positions.get(frozenset((first, second)))
+
+            if position is None:
+                positions[frozenset((first, second))] = len(pac.blueprints)
+                pac.create_blueprint(*blueprint)
+            else:
+                pac.blueprints[position] = blueprint
+
+        if self.starting_room is not None:
+            if pac.starting_room is not None:
+                pac.starting_room.is_default = False
+
+            pac.starting_room = pac.rooms[self.starting_room]
+            pac.starting_room.is_default = True
+
+        if self.starting_message is not None:
+            pac.starting_message = self.starting_message
+
+        return changed
+
+
+def _diff_texts(patch, kind, running, new, names):
+    # Texts are string ids (the same string has the same id) or Formats
+    for name in names:
+        value = new.__dict__.get(name)
+
+        if running.__dict__.get(name) != value:
+            patch.values.append((kind, running.name, name, value))
+
+
+def _diff_aliases(patch, kind, running, new):
+    known = running.aliases if running is not None else ()
+    added = [alias for alias in new.aliases if alias not in known]
+
+    if added:
+        patch.aliases.append((kind, new.name, added))
+
+
+def _names(objects):
+    return [obj.name for obj in objects]
+
+
+def _diff_items(patch, running, new):
+    for name, item in new.items.items():
+        old = running.items.get(name)
+
+        if old is None:
+            patch.items.append(item)
+        else:
+            _diff_texts(patch, "item", old, item, ITEM_TEXTS)
+
+            if old.is_craftable != item.is_craftable:
+                patch.values.append(("item", name, "is_craftable", item.is_craftable))
+
+        _diff_aliases(patch, "item", old, item)
+
+        for attribute in ("pickup_requires", "use_requires"):
+            names = _names(getattr(item, attribute))
+
+            if (_names(getattr(old, attribute)) if old is not None else []) != names:
+                patch.values.append(("item", name, attribute, names))
+
+
+def _diff_statics(patch, running, new):
+    for name, obj in new.statics.items():
+        old = running.statics.get(name)
+
+        if old is None:
+            patch.statics.append(obj)
+        else:
+            _diff_texts(patch, "static", old, obj, STATIC_TEXTS)
+
+            if _music(old) != _music(obj):
+                patch.values.append(("static", name, "music", obj.music))
+
+        _diff_aliases(patch, "static", old, obj)
+
+        names = _names(obj.item_requirements)
+        if (_names(old.item_requirements) if old is not None else []) != names:
+            patch.values.append(("static", name, "item_requirements", names))
+
+        if (old.item_blueprints if old is not None else {}) != obj.item_blueprints:
+            patch.values.append(("static", name, "item_blueprints", dict(obj.item_blueprints)))
+
+
+def _diff_rooms(patch, running, new):
+    for name, room in new.rooms.items():
+        old = running.rooms.get(name)
+
+        if old is None:
+            patch.rooms.append(room)
+        else:
+            _diff_texts(patch, "room", old, room, ROOM_TEXTS)
+
+            if _music(old) != _music(room):
+                patch.values.append(("room", name, "music", room.music))
+
+        _diff_aliases(patch, "room", old, room)
+
+        requirements = _room_requirements(old) if old is not None else ([], [])
+        for attribute, value, known in zip(("items", "visited"), _room_requirements(room), requirements):
+            if value != known:
+                patch.values.append(("room", name, attribute, value))
+
+        placements = old.placements if old is not None else {}
+        for item_name, description in room.placements.items():
+            known = placements.get(item_name)
+
+            if known is None:
+                # Only new items are put into rooms, the running game decides where the others are
+                if item_name not in running.items:
+                    patch.placements.append((name, item_name, description))
+
+            elif known != description:
+                patch.values.append(("room", name, "item_description", (item_name, description)))
+
+        descriptions = old.static_obj_descriptions if old is not None else {}
+        for static_name, description in room.static_obj_descriptions.items():
+            known = descriptions.get(static_name)
+
+            if known is None:
+                patch.static_placements.append((name, static_name, description))
+
+            elif known != description:
+                patch.values.append(("room", name, "static_description", (static_name, description)))
+
+
+def _blueprint_results(pac):
+    """
+    :return: dict - {frozenset of the names of the two items: (item name, item name, result name)} of the first
+             blueprint of every pair
+    """
+    blueprints = {}
+
+    for a, b, c in pac.blueprints:
+        blueprints.setdefault(frozenset((a.name, b.name)), (a.name, b.name, c.name))
+
+    return blueprints
+
+
+def diff_worlds(running, new):
+    """
+    Compares a new definition of a world with the running one.
+    Takes time proportional to the size of the world, the running one is only read.
+    :param running: PaCInterpreter being played
+    :param new: PaCInterpreter built from the new definition (see build_world())
+    :return: WorldPatch
+    """
+    if not isinstance(running, PaCInterpreter) or not isinstance(new, PaCInterpreter):
+        raise InvalidParameters
+
+    patch = WorldPatch()
+
+    for objects, others in ((running.rooms, new.rooms), (running.items, new.items), (running.statics, new.statics)):
+        patch.removed.extend(name for name in objects if name not in others)
+
+    _diff_items(patch, running, new)
+    _diff_statics(patch, running, new)
+    _diff_rooms(patch, running, new)
+
+    for name, linked in new.links.items():
+        existing = set(running.links.get(name, ()))
+
+        for other in linked:
+            if other not in existing:
+                patch.links.append((name, other))
+                existing.add(other)
+
+    # Blueprints are compared by their pair of items (in any order), only the first one of a pair is ever used
+    existing = _blueprint_results(running)
+    for pair, blueprint in _blueprint_results(new).items():
+        old = existing.get(pair)
+
+        if old is None or old[2] != blueprint[2]:
+            patch.blueprints.append(blueprint)
+
+    if new.starting_room is not None and (running.starting_room is None or
+                                          running.starting_room.name != new.starting_room.name):
+        patch.starting_room = new.starting_room.name
+
+    if new.starting_message != running.starting_message:
+        patch.starting_message = new.starting_message
+
+    return patch
+
+
+def reload_world(pac, factory):
+    """
+    Builds the new definition, compares it with the running world and applies the differences.
+    Must be called between commands (pac.server.CommandService.reload() and
+    pac.multiplayer.SharedWorld.reload() wait for them).
+    :param pac: running PaCInterpreter
+    :param factory: function that builds the world and returns the PaCInterpreter
+    :return: the applied WorldPatch
+    """
+    patch = diff_worlds(pac, build_world(factory))
+    patch.apply(pac)
+
+    log.info("Reloaded the world: {}".format(patch.summary()))
+    return patch
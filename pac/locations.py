@@ -0,0 +1,257 @@
+# coding=utf-8
+"""
+Reverse index of where every item is: in a room, in the inventory or consumed (used up in a room or combined
+into another item), plus the number of items in every location and the set of crafted items.
+
+Rooms and the inventory keep the index up to date when their contents change, so "where is this item",
+"how many items are in this room" and "which rooms hold anything" are answered without scanning the world.
+"""
+
+INVENTORY = "inventory"
+CONSUMED = "consumed"
+
+
+class ItemLocations:
+    """
+    Item: location index. A location is a Room, INVENTORY or CONSUMED, items that are nowhere
+    (like the result of a combination that was not made yet) are not in the index.
+    """
+    def __init__(self, changes=None):
+        """
+        :param changes: ChangeSet of the world, its journal (undo history) is told about location changes
+        :return: None
+        """
+        self.changes = changes
+
+        # Keys are never deleted (None and 0 instead): a dict that only changes values is not resized,
+        # so forked processes sharing a world do not copy it (see PaCInterpreter.finalize())
+        self.where = {}    # Item: location (None if nowhere)
+        self.counts = {}   # location: number of items
+        self.crafted = set()
+
+        # Set by worlds changed from several threads (pac.multiplayer), counts are shared between rooms
+        self.lock = None
+
+        # Functions called with (item, old location, new location) after any item moved
+        self.listeners = []
+
+        # location: tuple of functions called like listeners, only when an item moved into or out of the location
+        # (see pac.completion). Tuples are replaced, not changed, so they are called without holding the lock.
+        self.watchers = {}
+
+    def _touch(self, item):
+        if self.changes is not None and self.changes.journal is not None:
+            self.changes.journal.touch(item)
+
+    def watch(self, location, listener):
+        """
+        Calls listener with (item, old location, new location) whenever an item moves into or out of location.
+        :return: None
+        """
+        if self.lock is not None:
+            with self.lock:
+                return self._watch(location, listener)
+
+        return self._watch(location, listener)
+
+    def _watch(self, location, listener):
+        self.watchers[location] = self.watchers.get(location, ()) + (listener,)
+
+    def unwatch(self, location, listener):
+        """
+        Stops calling listener for location (nothing happens if it was not watching it).
+        :return: None
+        """
+        if self.lock is not None:
+            with self.lock:
+                return self._unwatch(location, listener)
+
+        return self._unwatch(location, listener)
+
+    def _unwatch(self, location, listener):
+        watchers = self.watchers.get(location)
+
+        if watchers and listener in watchers:
+            # Like where and counts, the key stays
+            self.watchers[location] = tuple(w for w in watchers if w != listener)
+
+    def _notify(self, item, old, new):
+        # Called after the lock is released: listeners of other players never wait for each other
+        for listener in self.listeners:
+            listener(item, old, new)
+
+        watchers = self.watchers
+        old_watchers = watchers.get(old, ()) if old is not None else ()
+
+        for listener in old_watchers:
+            listener(item, old, new)
+
+        if new is not None:
+            for listener in watchers.get(new, ()):
+                if listener not in old_watchers:
+                    listener(item, old, new)
+
+    def put(self, item, location):
+        """
+        Records that item is now in location.
+        :return: None
+        """
+        if self.lock is not None:
+            with self.lock:
+                old = self._put(item, location)
+        else:
+            old = self._put(item, location)
+
+        if old is not location:
+            self._notify(item, old, location)
+
+    def _put(self, item, location):
+        # Returns the old location (location itself if the item did not move)
+        old = self.where.get(item)
+        if old is location:
+            return old
+
+        self._touch(item)
+
+        if old is not None:
+            self.counts[old] -= 1
+
+        self.where[item] = location
+        self.counts[location] = self.counts.get(location, 0) + 1
+
+        return old
+
+    def take(self, item, location):
+        """
+        Records that item is not in location anymore (nothing happens if it was somewhere else).
+        :return: None
+        """
+        if self.lock is not None:
+            with self.lock:
+                taken = self._take(item, location)
+        else:
+            taken = self._take(item, location)
+
+        if taken:
+            self._notify(item, location, None)
+
+    def _take(self, item, location):
+        if location is None or self.where.get(item) is not location:
+            return False
+
+        self._touch(item)
+
+        self.where[item] = None
+        self.counts[location] -= 1
+
+        return True
+
+    def set_crafted(self, item, crafted):
+        if crafted:
+            self.crafted.add(item)
+        else:
+            self.crafted.discard(item)
+
+    def locate(self, item):
+        """
+        :param item: Item
+        :return: Room, INVENTORY (or the player of a shared world), CONSUMED or None if the item is nowhere
+        """
+        return self.where.get(item)
+
+    def count(self, location):
+        """
+        :param location: Room, INVENTORY or CONSUMED
+        :return: number of items in the location
+        """
+        return self.counts.get(location, 0)
+
+    def occupied(self):
+        """
+        :return: list of the locations (rooms, INVENTORY, CONSUMED) holding at least one item
+        """
+        return [location for location, count in self.counts.items() if count]
+
+    def clear(self):
+        self.where.clear()
+        self.counts.clear()
+        self.crafted.clear()
+
+
+class Inventory(list):
+    """
+    The player's inventory: a list of Items that keeps the ItemLocations index up to date however it is changed.
+    """
+    def __init__(self, locations, items=(), owner=INVENTORY):
+        """
+        :param locations: ItemLocations
+        :param items: initial items
+        :param owner: location of the items (every player of a shared world has their own)
+        :return: None
+        """
+        list.__init__(self)
+        self.locations = locations
+        self.owner = owner
+
+        self.extend(items)
+
+    def _added(self, items):
+        for item in items:
+            self.locations.put(item, self.owner)
+
+    def _removed(self, items):
+        for item in items:
+            # The same item can be in the inventory more than once
+            if item not in self:
+                self.locations.take(item, self.owner)
+
+    def append(self, item):
+        list.append(self, item)
+        self.locations.put(item, self.owner)
+
+    def extend(self, items):
+        items = list(items)
+        list.extend(self, items)
+        self._added(items)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def insert(self, index, item):
+        list.insert(self, index, item)
+        self.locations.put(item, self.owner)
+
+    def remove(self, item):
+        list.remove(self, item)
+        self._removed([item])
+
+    def pop(self, index=-1):
+        item = list.pop(self, index)
+        self._removed([item])
+
+        return item
+
+    def clear(self):
+        old = list(self)
+        list.clear(self)
+        self._removed(old)
+
+    def __setitem__(self, index, value):
+        old = self[index] if isinstance(index, slice) else [self[index]]
+        new = list(value) if isinstance(index, slice) else [value]
+
+        list.__setitem__(self, index, new if isinstance(index, slice) else value)
+
+        self._removed(old)
+        self._added(new)
+
+    def __delitem__(self, index):
+        old = self[index] if isinstance(index, slice) else [self[index]]
+        list.__delitem__(self, index)
+
+        self._removed(old)
+
+    def __reduce__(self):
+        # Pickles (and copies) as a plain list
+        return list, (list(self),)
@@ -0,0 +1,263 @@
+# coding=utf-8
+"""
+Latency histograms and counters for commands and interpreter actions.
+
+Instrumentation wraps the methods of a PaCInterpreter (and its EventDispatcher) instance,
+so an interpreter without metrics enabled runs exactly the same code as before.
+"""
+
+import os
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+# Upper bounds of the histogram buckets in seconds: 1us, 2us, 4us, ... ~8.4s
+BUCKETS = tuple(1e-6 * 2 ** c for c in range(24))
+
+# Interpreter methods that are timed as actions: {method name: action name}
+ACTIONS = {
+    "walk": "walk",
+    "pick_up_item": "pick_up_item",
+    "use_item": "use_item",
+    "use_static_object": "use_static_object",
+    "combine": "combine",
+    "_save_game": "save",
+    "_load_game": "load",
+    "_start_music_thread": "music",
+}
+
+
+class Histogram:
+    """
+    A fixed-bucket latency histogram.
+    """
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # Last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """
+        Estimates a quantile (upper bound of the bucket it falls into).
+        :param q: float between 0 and 1
+        :return: seconds (float), None if empty
+        """
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        total = 0
+        for c, n in enumerate(self.counts):
+            total += n
+            if total >= rank and n:
+                return BUCKETS[c] if c < len(BUCKETS) else float("inf")
+
+        return float("inf")
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": list(self.counts),
+        }
+
+
+class Metrics:
+    """
+    Collects per-verb command latencies and counters and per-action latencies.
+    """
+    def __init__(self):
+        self.commands = {}  # verb: Histogram
+        self.actions = {}   # action: Histogram
+
+        self.results = {}   # (verb, ok): count
+        self.errors = {}    # (verb, error): count
+
+        # Music is started from other threads and players of a SharedWorld execute commands in parallel
+        self.lock = threading.Lock()
+
+    def observe_command(self, verb, seconds, ok, error=None):
+        verb = verb or "unknown"
+
+        with self.lock:
+            histogram = self.commands.get(verb)
+            if histogram is None:
+                histogram = self.commands[verb] = Histogram()
+            histogram.observe(seconds)
+
+            key = (verb, bool(ok))
+            self.results[key] = self.results.get(key, 0) + 1
+
+            if error:
+                key = (verb, error)
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def observe_action(self, action, seconds):
+        with self.lock:
+            histogram = self.actions.get(action)
+            if histogram is None:
+                histogram = self.actions[action] = Histogram()
+            histogram.observe(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.commands = {}
+            self.actions = {}
+            self.results = {}
+            self.errors = {}
+
+    # Instrumentation
+
+    def _timed(self, name, fn):
+        observe = self.observe_action
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, perf_counter() - started)
+
+        return wrapper
+
+    def instrument(self, pac):
+        """
+        Starts collecting metrics for the interpreter (and its EventDispatcher).
+        :param pac: PaCInterpreter
+        :return: None
+        """
+        for method, name in ACTIONS.items():
+            setattr(pac, method, self._timed(name, getattr(pac, method)))
+
+        execute = pac._execute
+        observe_command = self.observe_command
+
+        @wraps(execute)
+        def timed_execute(verb, argument, command):
+            started = perf_counter()
+            result = execute(verb, argument, command)
+            observe_command(verb, perf_counter() - started, result.ok, result.error)
+
+            return result
+
+        pac._execute = timed_execute
+
+        dispatch = pac.events.dispatch_event
+        observe = self.observe_action
+
+        @wraps(dispatch)
+        def timed_dispatch(event_type, **kwargs):
+            started = perf_counter()
+            try:
+                return dispatch(event_type, **kwargs)
+            finally:
+                observe("dispatch:" + event_type, perf_counter() - started)
+
+        pac.events.dispatch_event = timed_dispatch
+
+    @staticmethod
+    def uninstrument(pac):
+        """
+        Removes the instrumentation, the interpreter runs its original methods again.
+        :param pac: PaCInterpreter
+        :return: None
+        """
+        for name in tuple(ACTIONS) + ("_execute",):
+            pac.__dict__.pop(name, None)
+
+        if pac.events:
+            pac.events.__dict__.pop("dispatch_event", None)
+
+    # Exporting
+
+    def snapshot(self):
+        """
+        :return: dict with all metrics (JSON-serializable)
+        """
+        with self.lock:
+            return {
+                "commands": {verb: h.to_dict() for verb, h in self.commands.items()},
+                "actions": {name: h.to_dict() for name, h in self.actions.items()},
+                "results": {"{}:{}".format(verb, "ok" if ok else "failed"): n for (verb, ok), n in self.results.items()},
+                "errors": {"{}:{}".format(verb, error): n for (verb, error), n in self.errors.items()},
+            }
+
+    def summary(self):
+        """
+        :return: human readable summary (used by the 'stats' command)
+        """
+        lines = []
+
+        with self.lock:
+            for title, histograms in (("Commands", self.commands), ("Actions", self.actions)):
+                if not histograms:
+                    continue
+
+                lines.append(title + ":")
+                for name, h in sorted(histograms.items()):
+                    lines.append("  {}: {} calls, mean {:.1f}us, p99 < {:.0f}us".format(
+                        name, h.count, h.sum / h.count * 1e6, h.quantile(0.99) * 1e6))
+
+        return "\n".join(lines) if lines else "No commands yet."
+
+    def to_prometheus(self, prefix="pac"):
+        """
+        :param prefix: metric name prefix
+        :return: metrics in the Prometheus text exposition format
+        """
+        lines = []
+
+        def histogram_family(name, label, histograms, description):
+            lines.append("# HELP {}_{}_seconds {}".format(prefix, name, description))
+            lines.append("# TYPE {}_{}_seconds histogram".format(prefix, name))
+
+            for key, h in sorted(histograms.items()):
+                total = 0
+                for c, n in enumerate(h.counts):
+                    total += n
+                    le = repr(BUCKETS[c]) if c < len(BUCKETS) else "+Inf"
+                    lines.append('{}_{}_seconds_bucket{{{}="{}",le="{}"}} {}'.format(prefix, name, label, key, le, total))
+
+                lines.append('{}_{}_seconds_sum{{{}="{}"}} {!r}'.format(prefix, name, label, key, h.sum))
+                lines.append('{}_{}_seconds_count{{{}="{}"}} {}'.format(prefix, name, label, key, h.count))
+
+        with self.lock:
+            histogram_family("command", "verb", self.commands, "Latency of commands by verb.")
+            histogram_family("action", "action", self.actions, "Latency of interpreter actions.")
+
+            lines.append("# HELP {}_commands_total Commands by verb and result.".format(prefix))
+            lines.append("# TYPE {}_commands_total counter".format(prefix))
+            for (verb, ok), n in sorted(self.results.items()):
+                lines.append('{}_commands_total{{verb="{}",result="{}"}} {}'.format(prefix, verb, "ok" if ok else "failed", n))
+
+            lines.append("# HELP {}_command_errors_total Failed commands by verb and error.".format(prefix))
+            lines.append("# TYPE {}_command_errors_total counter".format(prefix))
+            for (verb, error), n in sorted(self.errors.items()):
+                lines.append('{}_command_errors_total{{verb="{}",error="{}"}} {}'.format(prefix, verb, error, n))
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path, prefix="pac"):
+        """
+        Writes the Prometheus text format to a file (atomically, so a scraper never sees half a file).
+        :param path: file path (e.g. for the node_exporter textfile collector)
+        :return: None
+        """
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+
+        with open(tmp, "w") as file:
+            file.write(self.to_prometheus(prefix))
+
+        os.replace(tmp, path)
@@ -0,0 +1,354 @@
+# coding=utf-8
+"""
+Several players in one world.
+
+Every player (Participant) has their own room, inventory and visits, the rooms and items are shared:
+an item picked up by one player is gone for everyone and players in a room hear who comes and goes.
+
+    world = SharedWorld(pac)
+    world.join("alice")
+    world.join("bob", listener=print)
+    world.execute("alice", "pick up the phone")
+
+Commands of different players run at the same time. A command holds the lock of its player and of the room
+the player is in (what a command changes is in that room, the player's inventory or a flag of the room being
+walked into), so there is no lock for the whole world. Events are only sent to the players in the rooms
+a command touched, after the locks are released.
+"""
+
+import threading
+from collections import deque
+from contextlib import ExitStack
+
+from .pac import PaCInterpreter, Player, CommandResult, InvalidParameters, AlreadyExists, parse_command, with_article
+from .pac import PICKUP, USE_ITEM, USE_OBJECT, ENTER, EventDispatcher
+from .completion import Completer
+from .hotreload import build_world, diff_worlds
+
+# Events sent to players (besides ENTER)
+LEAVE = "leave"
+JOIN = "join"
+QUIT = "quit"
+
+# Verbs that act on the whole game, not one player
+SHARED_UNSUPPORTED = {
+    "save": "The world is shared, it can not be saved by a player.",
+    "load": "The world is shared, it can not be loaded by a player.",
+    "slots": "The world is shared, it can not be saved by a player.",
+    "undo": "Undo is disabled.",
+    "redo": "Undo is disabled.",
+    "settings": "There are no settings.",
+    "exit": "Use SharedWorld.leave() to leave the world.",
+}
+
+# How many events a player keeps until they are read with Participant.events()
+INBOX_SIZE = 256
+
+
+class Participant(Player):
+    """
+    A player of a SharedWorld.
+    """
+    def __init__(self, name, locations, listener=None):
+        """
+        :param name: player name (unique in the world)
+        :param locations: ItemLocations of the world
+        :param listener: function called with every event (dict) sent to the player, from the thread of the command
+        :return: None
+        """
+        Player.__init__(self, name, locations)
+
+        self.listener = listener
+        self.inbox = deque(maxlen=INBOX_SIZE)
+
+        # Commands of a player run one at a time
+        self.lock = threading.Lock()
+
+        # pac.completion.Completer, see SharedWorld.complete()
+        self.completer = None
+
+    def notify(self, event):
+        """
+        Sends an event to the player.
+        :param event: dict with at least "event" and "player" (who caused it)
+        :return: None
+        """
+        if self.listener is not None:
+            self.listener(event)
+        else:
+            self.inbox.append(event)
+
+    def events(self):
+        """
+        :return: list of the events received since the last call (players without a listener)
+        """
+        events = []
+        inbox = self.inbox
+
+        while inbox:
+            events.append(inbox.popleft())
+
+        return events
+
+    def __repr__(self):
+        return "<Participant {}>".format(self.name)
+
+
+class _Outbox(threading.local):
+    # Events of the command running in a thread: list of (Room, event)
+    events = None
+
+
+class SharedWorld:
+    """
+    Executes commands of many players in one world.
+    """
+    def __init__(self, pac):
+        """
+        :param pac: PaCInterpreter with the world built (its undo history is disabled)
+        :return: None
+        """
+        if not isinstance(pac, PaCInterpreter):
+            raise InvalidParameters
+
+        self.pac = pac
+
+        if not pac.current_room:
+            pac.begin()
+
+        # Checkpoints are for one player
+        pac.disable_history()
+
+        # Counts of items in a location are shared by all rooms
+        pac.locations.lock = threading.Lock()
+
+        self.players = {}
+        self._players_lock = threading.Lock()
+
+        # Room: lock and Room: set of Participants in it
+        self.locks = {room: threading.RLock() for room in pac.rooms.values()}
+        self.occupants = {room: set() for room in pac.rooms.values()}
+
+        self._outbox = _Outbox()
+
+        if not pac.events:
+            pac.events = EventDispatcher()
+
+        pac.events._register_event(PICKUP, self._on_pickup)
+        pac.events._register_event(USE_ITEM, self._on_item_use)
+        pac.events._register_event(USE_OBJECT, self._on_object_use)
+
+    # Events of the game, collected for the players in the room
+
+    def _queue(self, event_type, **details):
+        player = self.pac._player()
+        outbox = self._outbox.events
+
+        if outbox is None or not isinstance(player, Participant):
+            return
+
+        details["event"] = event_type
+        details["player"] = player.name
+
+        outbox.append((player.current_room, details))
+
+    def _on_pickup(self, item, desc):
+        self._queue(PICKUP, item=item.name)
+
+    def _on_item_use(self, item, desc):
+        self._queue(USE_ITEM, item=item.name)
+
+    def _on_object_use(self, object, desc):
+        self._queue(USE_OBJECT, object=object.name)
+
+    def _lock(self, room):
+        lock = self.locks.get(room)
+
+        if lock is None:
+            # A room added after the world was shared
+            lock = self.locks.setdefault(room, threading.RLock())
+            self.occupants.setdefault(room, set())
+
+        return lock
+
+    def _send(self, events):
+        # Sends (Room, event) to everyone in the room except the player who caused it
+        for room, event in events:
+            with self._lock(room):
+                receivers = [player for player in self.occupants[room] if player.name != event["player"]]
+
+            for player in receivers:
+                player.notify(event)
+
+    # Players
+
+    def join(self, name, listener=None):
+        """
+        Puts a new player into the starting room.
+        :param name: player name
+        :param listener: see Participant
+        :return: Participant
+        """
+        name = str(name)
+        player = Participant(name, self.pac.locations, listener)
+
+        with self._players_lock:
+            if name in self.players:
+                raise AlreadyExists("player {} is already in the world".format(name))
+
+            self.players[name] = player
+
+        room = self.pac.starting_room
+        player.current_room = room
+        player.visits.append(room)
+
+        with self._lock(room):
+            self.occupants[room].add(player)
+
+        self._send([(room, {"event": JOIN, "player": name, "room": room.name})])
+
+        return player
+
+    def leave(self, name):
+        """
+        Removes a player from the world, what they carried is left in their room.
+        :param name: player name
+        :return: None
+        """
+        player = self.get_player(name)
+
+        with player.lock:
+            room = player.current_room
+
+            with self._lock(room):
+                self.occupants[room].discard(player)
+
+                for item in list(player.inv):
+                    player.inv.remove(item)
+                    room.put_item(item, "{} is lying here.".format(with_article(item.name)).capitalize())
+
+            with self._players_lock:
+                self.players.pop(player.name, None)
+
+            if player.completer is not None:
+                player.completer.close()
+
+        if self.pac.analytics is not None:
+            self.pac.analytics.end_session(player.name)
+
+        self._send([(room, {"event": QUIT, "player": player.name, "room": room.name})])
+
+    def get_player(self, name):
+        """
+        :param name: player name
+        :return: Participant
+        :raise InvalidParameters: if there is no such player
+        """
+        player = self.players.get(name)
+
+        if player is None:
+            raise InvalidParameters("no player named {}".format(name))
+
+        return player
+
+    def in_room(self, room):
+        """
+        :param room: Room
+        :return: list of the names of the players in the room
+        """
+        with self._lock(room):
+            return sorted(player.name for player in self.occupants[room])
+
+    # Commands
+
+    def reload(self, factory):
+        """
+        Applies a new definition of the world (see pac.hotreload), players stay where they are.
+        The new world is built and compared while commands run. Applying it holds the locks of the rooms it
+        changes, taken in the order of their names (a command never waits for a second room lock while
+        holding one, so this can not deadlock), everything else it changes is swapped one attribute at a time.
+        :param factory: function that builds the world and returns the PaCInterpreter
+        :return: pac.hotreload.WorldPatch
+        """
+        patch = diff_worlds(self.pac, build_world(factory))
+        rooms = [self.pac.rooms[name] for name in sorted(patch.touched_rooms())]
+
+        with ExitStack() as stack:
+            for room in rooms:
+                stack.enter_context(self._lock(room))
+
+            patch.apply(self.pac)
+
+        # New exits, rebuilt on the next completion
+        for player in list(self.players.values()):
+            if player.completer is not None:
+                player.completer.room = None
+
+        return patch
+
+    def complete(self, name, line, limit=20):
+        """
+        Completes a partly typed command of a player (see PaCInterpreter.complete()).
+        :param name: player name
+        :param line: what the player typed so far
+        :return: list of whole commands
+        """
+        player = self.get_player(name)
+
+        # The completer follows items moving in the player's room and inventory, both are locked
+        with player.lock, self._lock(player.current_room):
+            if player.completer is None:
+                player.completer = Completer(self.pac, player)
+
+            return player.completer.complete(str(line), limit)
+
+    def execute(self, name, command):
+        """
+        Executes a command of a player.
+        :param name: player name
+        :param command: command string
+        :return: CommandResult
+        """
+        player = self.get_player(name)
+        command = str(command)
+
+        verb, argument = parse_command(command)
+
+        if verb in SHARED_UNSUPPORTED:
+            return CommandResult(command, verb, argument, False, SHARED_UNSUPPORTED[verb], "unsupported",
+                                 room=player.current_room.name)
+
+        pac = self.pac
+
+        # Like PaCInterpreter.execute(), outside of the room locks (callbacks are not commands of a player)
+        if pac.timers.pending:
+            pac.timers.advance()
+
+        events = self._outbox.events = []
+
+        try:
+            with player.lock:
+                room = player.current_room
+
+                with self._lock(room), pac.as_player(player):
+                    result = pac._execute(verb, argument, command)
+
+                    if result.moved:
+                        self.occupants[room].discard(player)
+
+                # Never holds two room locks (players walking the other way would wait for each other)
+                if result.moved:
+                    new = player.current_room
+
+                    with self._lock(new):
+                        self.occupants[new].add(player)
+
+                    events.append((room, {"event": LEAVE, "player": name, "room": room.name, "to": new.name}))
+                    events.append((new, {"event": ENTER, "player": name, "room": new.name, "from": room.name}))
+
+        finally:
+            self._outbox.events = None
+
+        self._send(events)
+
+        return result
@@ -4,12 +4,25 @@ PaC Adventure Creator
 A library for creating a text-based interactive story.
 """
 
+import gc
+import hashlib
+import json
 import logging
 import pickle
+import re
 import threading
 import time
 import os
 import textwrap
+from contextlib import contextmanager
+
+from .flags import FlagVector
+from .fuzzy import FuzzyMatcher
+from .locations import ItemLocations, Inventory, INVENTORY, CONSUMED
+from .metrics import Metrics
+from .strings import STRINGS, Format, Text
+from .timers import TimerWheel
+from . import trace
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
@@ -21,6 +34,12 @@ except ImportError:
     mixer = None
     logging.warn("pygame is not installed, music will NOT work.")
 
+# Tab completion in the TextInterface (not available on Windows)
+try:
+    import readline
+except ImportError:
+    readline = None
+
 __author__ = "DefaltSimon"
 __version__ = "0.4.2"
 
@@ -33,6 +52,11 @@ COMBINE = "combine"
 START = "start"
 ENTER = "enter"
 MUSIC_CHANGE = "music"
+TIMER = "timer"
+
+# Default messages (see pac.strings)
+PICKUP_TEMPLATE = STRINGS.add("You picked up {}")
+CRAFTED_TEMPLATE = STRINGS.add("By combining you created a {}")
 
 # Total length of the room name header
 PADDING = 65
@@ -121,6 +145,13 @@ class Singleton(type):
             cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
 
+    def reset_instance(cls):
+        """
+        Forgets the instance, so the next call creates a new one (for building several worlds in one process).
+        :return: None
+        """
+        cls._instances.pop(cls, None)
+
 
 # Music player
 
@@ -174,6 +205,105 @@ class Music:
 
         return
 
+# Change tracking
+
+
+class ChangeSet(dict):
+    """
+    Rooms, items and objects of a world that have changed, a dict used as an ordered set.
+    If journal is set (pac.history.History), it is told about every change before it happens.
+    Rooms keep the world's item locations (pac.locations.ItemLocations) up to date through it.
+    """
+    journal = None
+    locations = None
+
+
+class _Flag(object):
+    """
+    A state attribute (entered, used, ...) that registers its object as changed when it is set.
+    Objects of a world keep it as a bit of their byte in a pac.flags.FlagVector, others in their __dict__.
+    """
+    def __init__(self, name, bit=1):
+        self.name = name
+        self.bit = bit
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+
+        flags = obj._flags
+        if flags is None:
+            return obj.__dict__[self.name]
+
+        return flags[obj._index] & self.bit != 0
+
+    def __set__(self, obj, value):
+        changes = obj.changes
+
+        if changes is not None:
+            if changes.journal is not None:
+                changes.journal.touch(obj)
+
+            changes[obj] = None
+
+        flags = obj._flags
+        if flags is None:
+            obj.__dict__[self.name] = value
+        elif value:
+            flags[obj._index] |= self.bit
+        else:
+            flags[obj._index] &= ~self.bit
+
+
+class _CraftedFlag(_Flag):
+    """
+    Item.crafted, also kept in the world's set of crafted items.
+    """
+    def __set__(self, obj, value):
+        _Flag.__set__(self, obj, value)
+
+        if obj.changes is not None and obj.changes.locations is not None:
+            obj.changes.locations.set_crafted(obj, value)
+
+# Name resolution
+
+
+def normalize_name(name):
+    """
+    Normalizes a name the way the player might type it: lower case, single spaces and no leading article.
+    :param name: string
+    :return: normalized string
+    """
+    words = str(name).lower().split()
+
+    if words and words[0] in ("a", "an", "the"):
+        del words[0]
+
+    return " ".join(words)
+
+
+def _name_keys(obj):
+    """
+    :return: normalized name and aliases of a Room, Item or StaticObject (cached on the object)
+    """
+    keys = obj.__dict__.get("_name_keys")
+
+    if keys is None:
+        keys = obj._name_keys = [normalize_name(obj.name)] + [normalize_name(alias) for alias in getattr(obj, "aliases", ())]
+
+    return keys
+
+
+def _index_names(index, obj):
+    for key in _name_keys(obj):
+        index[key] = obj
+
+
+def _unindex_names(index, obj):
+    for key in _name_keys(obj):
+        if index.get(key) is obj:
+            del index[key]
+
 # Room Object
 
 
@@ -181,6 +311,18 @@ class Room(object):
     """
     Represents a room that the player can move into and interact with its objects, etc...
     """
+    entered = _Flag("entered")
+
+    desc = Text("desc")
+    on_first_enter = Text("on_first_enter")
+
+    # PaCInterpreter.changed of the world the room belongs to
+    changes = None
+
+    # Byte vector and index of the flags once the room is in a world (see pac.flags)
+    _flags = None
+    _index = None
+
     def __init__(self, name, desc, enter_description=None, starting=False):
         self.name = str(name)
 
@@ -190,9 +332,19 @@ class Room(object):
         self.is_default = bool(starting)
         self.entered = False
 
+        # Other names the room can be called by (see PaCInterpreter.add_alias)
+        self.aliases = []
+
         self.items = {}
         self.item_descriptions = {}
 
+        # Normalized names and aliases of the items and objects in the room: object (see find_item())
+        self.item_names = {}
+        self.static_names = {}
+
+        # Descriptions of every item ever put into the room (kept after picking up, for restoring saves)
+        self.placements = {}
+
         self.statics = {}
         self.static_obj_descriptions = {}
 
@@ -219,9 +371,17 @@ class Room(object):
         if not isinstance(item, Item):
             raise InvalidParameters
 
+        self._changed()
+
         self.items[item.name] = item
+        _index_names(self.item_names, item)
+
+        locations = self._locations()
+        if locations is not None:
+            locations.put(item, self)
 
-        self.item_descriptions[item.name] = str(description)
+        self.item_descriptions[item.name] = STRINGS.intern(description)
+        self.placements[item.name] = self.item_descriptions[item.name]
 
     def put_static_obj(self, obj, description):
         """
@@ -234,19 +394,27 @@ class Room(object):
             raise InvalidParameters
 
         self.statics[obj.name] = obj
+        _index_names(self.static_names, obj)
 
-        self.static_obj_descriptions[obj.name] = str(description)
+        self.static_obj_descriptions[obj.name] = STRINGS.intern(description)
 
     def enter(self):
         """
         :return: Room description, includes 'first enter description' if it is the first time entering the room. Also includes any items found in the room.
         """
 
+        item_descriptions = self.item_descriptions.values()
+        static_descriptions = self.static_obj_descriptions.values()
+
+        if STRINGS.locale is not None:
+            item_descriptions = [STRINGS.translate(d) for d in item_descriptions]
+            static_descriptions = [STRINGS.translate(d) for d in static_descriptions]
+
         # Build item descriptions if they exists (if there are any items in the room)
-        items = ("\n" if self.item_descriptions.values() else "") + "\n".join(self.item_descriptions.values())
+        items = ("\n" if item_descriptions else "") + "\n".join(item_descriptions)
 
         # Builds static objects descriptions if they exist in the room
-        statics = (" " if self.static_obj_descriptions.values() else "") + " ".join(self.static_obj_descriptions.values())
+        statics = (" " if static_descriptions else "") + " ".join(static_descriptions)
 
         if not self.entered:
             self.entered = True
@@ -259,6 +427,50 @@ class Room(object):
         else:
             return self.desc + statics + items
 
+    def find_item(self, name):
+        """
+        :param name: item name or alias, as typed by the player
+        :return: Item in the room, None if there is no such item here
+        """
+        return self.item_names.get(normalize_name(name))
+
+    def find_static_obj(self, name):
+        """
+        :param name: object name or alias, as typed by the player
+        :return: StaticObject in the room, None if there is no such object here
+        """
+        return self.static_names.get(normalize_name(name))
+
+    def clear_items(self):
+        """
+        Removes all items from the room (without picking them up).
+        :return: None
+        """
+        self._changed()
+
+        locations = self._locations()
+        if locations is not None:
+            for item in self.items.values():
+                locations.take(item, self)
+
+        self.items.clear()
+        self.item_descriptions.clear()
+        self.item_names.clear()
+
+    def _index_items(self):
+        # Rebuilds item_names (and the item locations) after items was replaced
+        self.item_names.clear()
+        locations = self._locations()
+
+        for item in self.items.values():
+            _index_names(self.item_names, item)
+
+            if locations is not None:
+                locations.put(item, self)
+
+    def _locations(self):
+        return self.changes.locations if self.changes is not None else None
+
     def get_items(self):
         """
         :return: A list of items in the room
@@ -283,9 +495,17 @@ class Room(object):
         else:
             item = self.items[item]
 
+        self._changed()
+
         desc = item.use()
         self.items.pop(item.name)
         self.item_descriptions.pop(item.name)
+        _unindex_names(self.item_names, item)
+
+        # Used up
+        locations = self._locations()
+        if locations is not None:
+            locations.put(item, CONSUMED)
 
         return desc
 
@@ -304,16 +524,33 @@ class Room(object):
 
         else:
             try:
-                item = self.items[item.name]
+                item = self.items[item]
             except KeyError:
                 return False
 
+        self._changed()
+
         desc = item.pick_up()
         self.items.pop(item.name)
         self.item_descriptions.pop(item.name)
+        _unindex_names(self.item_names, item)
+
+        locations = self._locations()
+        if locations is not None:
+            locations.take(item, self)
 
         return desc
 
+    def _changed(self):
+        # Called before the contents change
+        changes = self.changes
+
+        if changes is not None:
+            if changes.journal is not None:
+                changes.journal.touch(self)
+
+            changes[self] = None
+
     def add_visit_requirement(self, room, on_deny):
         """
         Adds a room visit requirement to the room.
@@ -403,6 +640,22 @@ class Item(object):
     """
     An item that the player can pick up, use, combine, etc.
     """
+    used = _Flag("used", 1)
+    picked_up = _Flag("picked_up", 2)
+    crafted = _CraftedFlag("crafted", 4)
+
+    desc = Text("desc")
+    on_use = Text("on_use")
+    on_pickup = Text("on_pickup")
+    crafting_description = Text("crafting_description")
+    on_failed_use = Text("on_failed_use")
+    on_failed_pickup = Text("on_failed_pickup")
+
+    changes = None
+
+    _flags = None
+    _index = None
+
     def __init__(self, name, desc, on_use, on_failed_use, on_failed_pickup, on_pickup=None, is_craftable=False, crafting_description=None):
         self.name = str(name)
         self.desc = str(desc)
@@ -423,6 +676,8 @@ class Item(object):
         self.pickup_requires = []
         self.use_requires = []
 
+        self.aliases = []
+
     def description(self):
         """
         :return: Item description string
@@ -521,6 +776,17 @@ class Item(object):
 
 
 class StaticObject(object):
+    used = _Flag("used")
+
+    display = Text("display")
+    on_use = Text("on_use")
+    on_failed_use = Text("on_failed_use")
+
+    changes = None
+
+    _flags = None
+    _index = None
+
     def __init__(self, name, display, on_use, on_failed_use):
         self.name = str(name)
         self.display = str(display)
@@ -533,6 +799,8 @@ class StaticObject(object):
         self.item_requirements = []
         self.item_blueprints = {}
 
+        self.aliases = []
+
         self.music = None
 
     def was_used(self):
@@ -646,7 +914,8 @@ class EventDispatcher(metaclass=Singleton):
                 "start": [],
                 "combine": [],
                 "enter": [],
-                "music": []
+                "music": [],
+                "timer": []
             }
 
         def _register_event(self, event_type, fn):
@@ -704,11 +973,21 @@ class EventDispatcher(metaclass=Singleton):
             self._register_event(MUSIC_CHANGE, fn)
             return fn
 
+        def on_timer(self, fn):
+            # Called with name and the details of timers scheduled with PaCInterpreter.schedule()
+            self._register_event(TIMER, fn)
+            return fn
+
 
 class SaveGame:
     """
     A module that allows you to save the game.
+    Besides the default save, any number of named slots can be saved. Slots are described in an index
+    (save/name_of_the_game/index.json) so listing, sorting and pruning them never reads the saves.
     """
+    # Slot index entry fields that list_slots() can sort by
+    SLOT_FIELDS = ("slot", "time", "room", "play_time", "size")
+
     def __init__(self, name, version):
         """
         Initializes the SaveGame.
@@ -718,58 +997,386 @@ class SaveGame:
         self.game_name = str(name)
         self.game_version = str(version)
 
-    def save(self, data):
+        # Cached slot index and the (mtime, size) of the file it was read from
+        self._index = None
+        self._index_stat = None
+
+        # Cached sorted index entries: {(field, reverse): list}
+        self._sorted = {}
+
+    def _path(self, slot=None):
+        if slot is None:
+            return "save/{}.save".format(self.game_name.replace(" ", "_"))
+
+        # Slot names can be anything, the hash keeps file names unique
+        slot = str(slot)
+        safe = re.sub(r"[^\w.-]", "_", slot)[:40]
+
+        return os.path.join(self._slot_dir(), "{}-{}.save".format(safe, hashlib.sha1(slot.encode("utf-8")).hexdigest()[:8]))
+
+    def _slot_dir(self):
+        return "save/{}".format(self.game_name.replace(" ", "_"))
+
+    def _index_path(self):
+        return os.path.join(self._slot_dir(), "index.json")
+
+    def _read_index(self):
         """
-        Saves the current state to save/name_divided_by_.save.
-        :param data: a tuple or list - current room, previous room, inventory (list)
-        :return: None
+        :return: dict {slot: entry}, only read from the disk if the file changed
         """
-        path = "save/{}.save".format(str(self.game_name).replace(" ", "_"))
+        try:
+            stat = os.stat(self._index_path())
+        except OSError:
+            return {}
+
+        if (stat.st_mtime_ns, stat.st_size) != self._index_stat:
+            with open(self._index_path(), "r") as file:
+                self._index = json.load(file)
+
+            self._index_stat = (stat.st_mtime_ns, stat.st_size)
+            self._sorted = {}
+
+        return self._index
+
+    def _write_index(self, index):
+        path = self._index_path()
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+
+        with open(tmp, "w") as file:
+            json.dump(index, file, separators=(",", ":"))
+
+        os.replace(tmp, path)
 
-        if not os.path.isdir("save"):
-            os.makedirs("save")
+        stat = os.stat(path)
+        self._index = index
+        self._index_stat = (stat.st_mtime_ns, stat.st_size)
+        self._sorted = {}
+
+    def save(self, data, slot=None):
+        """
+        Saves the current state to save/name_divided_by_.save or into a slot.
+        :param data: dict - state (PaCInterpreter.get_state()), game_info (name and version) and play_time (optional)
+        :param slot: slot name, None for the default save
+        :return: None
+        """
+        directory = "save" if slot is None else self._slot_dir()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
 
         log.debug("Saving game...")
 
-        pickle.dump(data, open(path, "wb"), pickle.HIGHEST_PROTOCOL)
+        state = data.get("state")
+        encoded = codec.encode_state(state, data.get("game_info"))
+
+        with open(self._path(slot), "wb") as file:
+            file.write(encoded)
+
+        if slot is None:
+            return
+
+        index = dict(self._read_index())
+        index[str(slot)] = {
+            "slot": str(slot),
+            "time": time.time(),
+            "room": state.get("current_room"),
+            "play_time": data.get("play_time", 0.0),
+            "size": len(encoded),
+            "version": self.game_version,
+        }
+
+        self._write_index(index)
+
+    @staticmethod
+    def _read(path):
+        """
+        Reads a save file. Saves made before 0.5 (pickled) are not read, see migrate().
+        :return: dict - state and game_info
+        :raise codec.CodecError: if the file is not a valid save
+        """
+        with open(path, "rb") as file:
+            raw = file.read()
+
+        if not codec.is_encoded(raw):
+            raise codec.CodecError("{} is not a save of this version (convert old saves with SaveGame.migrate())".format(path))
 
-    def load(self):
+        state, game_info = codec.decode_state(raw)
+        return {"state": state, "game_info": game_info}
+
+    def migrate(self):
         """
-        Loads the save if it exists.
-        :return: a tuple in order: current room, previous room, inventory (list)
+        Converts the default save made before 0.5 (pickled) into the current format, in place.
+        Unpickling runs code stored in the file: only migrate saves you trust, loading never does it.
+        :return: bool indicating if the save was converted (False if there is none or it is already converted)
         """
-        path = "save/{}.save".format(self.game_name.replace(" ", "_"))
+        path = self._path()
 
         if not os.path.isfile(path):
-            return None
+            return False
 
         with open(path, "rb") as file:
-            data = pickle.load(file)
+            raw = file.read()
+
+        if codec.is_encoded(raw):
+            return False
+
+        data = pickle.loads(raw)
+        self.save({"state": PaCInterpreter._convert_old_state(data.get("state")), "game_info": data.get("game_info")})
+
+        log.info("Converted the save {}.".format(path))
+        return True
+
+    def load(self, slot=None):
+        """
+        Loads the save (or slot) if it exists.
+        :param slot: slot name, None for the default save
+        :return: dict - state and game_info (and the slot's index entry as slot_info), None if there is no save for this version
+        """
+        path = self._path(slot)
+
+        if not os.path.isfile(path):
+            return None
+
+        data = self._read(path)
 
         if not str(data.get("game_info").get("version")) == self.game_version:
             return None
 
+        if slot is not None:
+            data["slot_info"] = self.get_slot(slot)
+
         return data
 
-    def has_valid_save(self):
+    def has_valid_save(self, slot=None):
         """
         Indicates if a valid save is present.
+        :param slot: slot name, None for the default save (slots are checked in the index)
         :return: bool
         """
-        path = "save/{}.save".format(self.game_name.replace(" ", "_"))
+        if slot is not None:
+            entry = self.get_slot(slot)
+            return bool(entry and entry.get("version") == self.game_version)
+
+        path = self._path()
 
-        if os.path.isfile(path):
-            with open(path, "rb") as file:
-                d = pickle.load(file)
+        if not os.path.isfile(path):
+            return False
 
-                a = bool(d.get("game_info").get("version") == self.game_version)
-                b = bool(d.get("game_info").get("name") == self.game_name)
+        with open(path, "rb") as file:
+            raw = file.read()
 
-                return bool(a is True and b is True)
+        if not codec.is_encoded(raw):
+            log.warn("Save {} is corrupt or was made before 0.5 (see SaveGame.migrate()).".format(path))
+            return False
 
-        else:
+        try:
+            info = codec.read_game_info(raw)
+        except codec.CodecError:
+            log.warn("Save {} is corrupt.".format(path))
             return False
 
+        a = bool(str(info.get("version")) == self.game_version)
+        b = bool(str(info.get("name")) == self.game_name)
+
+        return bool(a is True and b is True)
+
+    def get_slot(self, slot):
+        """
+        :param slot: slot name
+        :return: dict - index entry of the slot (slot, time, room, play_time, size, version), None if it does not exist
+        """
+        entry = self._read_index().get(str(slot))
+        return dict(entry) if entry else None
+
+    def list_slots(self, sort="time", reverse=True, limit=None):
+        """
+        Lists the saved slots (only reads the index, the sorted order is cached until the index changes).
+        :param sort: field to sort by, one of SLOT_FIELDS
+        :param reverse: bool, defaults to newest (biggest) first
+        :param limit: maximum number of slots returned (optional)
+        :return: list of index entries (dicts)
+        """
+        if sort not in self.SLOT_FIELDS:
+            raise InvalidParameters
+
+        index = self._read_index()
+
+        entries = self._sorted.get((sort, reverse))
+        if entries is None:
+            entries = sorted(index.values(), key=lambda entry: (entry.get(sort) is not None, entry.get(sort) or 0), reverse=reverse)
+            self._sorted[(sort, reverse)] = entries
+
+        return [dict(entry) for entry in entries[:limit]]
+
+    def delete_slot(self, slot):
+        """
+        Deletes a slot.
+        :param slot: slot name
+        :return: bool indicating if the slot existed
+        """
+        return bool(self._delete_slots([slot]))
+
+    def prune(self, keep):
+        """
+        Deletes all but the newest slots.
+        :param keep: number of slots to keep
+        :return: list of deleted slot names
+        """
+        old = [entry["slot"] for entry in self.list_slots("time")[max(int(keep), 0):]]
+        return self._delete_slots(old)
+
+    def _delete_slots(self, slots):
+        index = dict(self._read_index())
+
+        deleted = []
+        for slot in slots:
+            if index.pop(str(slot), None) is None:
+                continue
+
+            try:
+                os.remove(self._path(slot))
+            except OSError:
+                pass
+
+            deleted.append(str(slot))
+
+        if deleted:
+            self._write_index(index)
+
+        return deleted
+
+# Command parsing
+
+
+# Ordered (prefix, verb) pairs, the first matching prefix wins
+COMMANDS = [
+    (("help", "what to do"), "help"),
+    (("ways", "path", "paths", "way"), "ways"),
+    (("settings", "preferences"), "settings"),
+    (("items", "objects", "items in the room", "what items are in the room"), "items"),
+    (("go back",), "back"),
+    (("walk down ", "walk to ", "walk ", "go to ", "go down ", "go "), "walk"),
+    (("pick up",), "pickup"),
+    (("use",), "use"),
+    (("combine",), "combine"),
+    (("inventory", "inv"), "inventory"),
+    (("where am i", "where", "room"), "where"),
+    (("stats",), "stats"),
+    (("slots", "saves"), "slots"),
+    (("load",), "load"),
+    (("undo",), "undo"),
+    (("redo",), "redo"),
+    (("save", "save game", "do a save", "gamesave"), "save"),
+    (("exit", "quit", "q"), "exit"),
+]
+
+# Commands listed by 'help'
+HELP = ["go", "pick up", "use", "inv", "where", "combine", "save", "settings", "exit"]
+
+# Verbs that take the rest of the command as an argument
+ARGUMENT_VERBS = ("walk", "pickup", "use", "combine", "save", "load")
+
+
+def strip_article(s):
+    """
+    Resolves a/an/the at the start of the string.
+    :param s: string
+    :return: string without the article
+    """
+    for article in ("a ", "an ", "the "):
+        if s.startswith(article):
+            return s[len(article):]
+
+    return s
+
+
+def parse_command(command):
+    """
+    Parses the player's input.
+    :param command: string typed by the player
+    :return: tuple - (verb or None if not recognised, argument string)
+    """
+    command = str(command).strip()
+    lowered = command.lower()
+
+    for prefixes, verb in COMMANDS:
+        for prefix in prefixes:
+            if lowered.startswith(prefix):
+                if verb not in ARGUMENT_VERBS:
+                    return verb, ""
+
+                return verb, strip_article(command[len(prefix):].strip(" "))
+
+    return None, ""
+
+
+def did_you_mean(name):
+    """
+    :param name: suggested name or None
+    :return: " Did you mean ...?" or an empty string
+    """
+    return " Did you mean {}?".format(name) if name else ""
+
+
+def with_article(name):
+    """
+    Just for the correct grammar jk
+    :param name: item name
+    :return: string with a/an prepended
+    """
+    if str(name).startswith(("a", "e", "i", "o", "u")):
+        return "an " + name
+
+    return "a " + name
+
+
+class CommandResult:
+    """
+    The outcome of a command executed with PaCInterpreter.execute().
+    """
+    def __init__(self, command, verb, argument="", ok=True, message=None, error=None, moved=False, room=None):
+        """
+        :param command: the command as typed
+        :param verb: parsed verb (None if the command was not recognised)
+        :param argument: parsed argument (room or item names)
+        :param ok: bool indicating if the action succeeded
+        :param message: string to show to the player (None if there is nothing to show)
+        :param error: short error code when not ok ("unknown-command", "not-linked", "requirements", ...)
+        :param moved: bool indicating if the player moved to a different room
+        :param room: name of the room the player is in after the command
+        :return: None
+        """
+        self.command = command
+        self.verb = verb
+        self.argument = argument
+
+        self.ok = bool(ok)
+        self.message = message
+        self.error = error
+
+        self.moved = bool(moved)
+        self.room = room
+
+    def to_dict(self):
+        """
+        :return: dict representation of the result (JSON-serializable)
+        """
+        return {
+            "command": self.command,
+            "verb": self.verb,
+            "argument": self.argument,
+            "ok": self.ok,
+            "message": self.message,
+            "error": self.error,
+            "moved": self.moved,
+            "room": self.room,
+        }
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        return "<CommandResult {} ok={} error={}>".format(self.verb, self.ok, self.error)
+
 # TextInterface handles player interaction
 
 
@@ -807,16 +1414,9 @@ class TextInterface(metaclass=Singleton):
 
         def text_adventure():
             inp = str(input(">"))
+            verb, _ = parse_command(inp)
 
-            if inp == "help" or inp == "what to do":
-                commands = ["go", "pick up", "use", "inv", "where", "combine", "save", "settings", "exit"]
-                wrap_text(", ".join(commands))
-
-            # Displays possible ways out of the room (DEPRECATED!)
-            elif inp.startswith(("ways", "path", "paths", "way")):
-                wrap_text("You can go to: " + ", ".join(pac.ways()))
-
-            elif inp.startswith(("settings", "preferences")):
+            if verb == "settings":
                 print("1. autosave : {}\n2. exit".format("enabled" if self.autosave else "disabled"))
 
                 ce = str(input())
@@ -831,271 +1431,62 @@ class TextInterface(metaclass=Singleton):
                         self.autosave = False
                         print("Autosaving: disabled")
 
-            # Gives you a list of items in the room (DEPRECATED!)
-            elif inp.startswith(("items", "objects", "items in the room", "what items are in the room")):
-                object_list = pac.get_current_room().get_items()
-
-                objects = []
-                for obj in object_list:
-                    # Just for the correct grammar jk
-                    if str(obj.name).startswith(("a", "e", "i", "o", "u")):
-                        um = "an"
-                    else:
-                        um = "a"
+            # Option to quit game
+            elif verb == "exit":
+                n = str(input("Are you sure?"))
 
-                    objects.append(str(um + " " + obj.name))
+                if str(n).lower().startswith(("yes", "yup", "ye", "sure", "y")):
+                    ce = str(input("Would you like to save your current game? y/n "))
+                    if ce.lower() == "y":
+                        pac._save_game()
+                        print("Game saved, bye!")
 
-                # Correct prints
-                if len(objects) == 0:
-                    print("There are no items here.")
+                    else:
+                        print("Bye!")
+                    self.running = False
+                    return
 
-                elif len(objects) == 1:
+                elif n.lower().startswith(("no", "nope", "n", "not sure")):
+                    return
 
-                    print("In the room there is " + objects[0] + "\n")
+            # Everything else is handled by the interpreter
+            else:
+                result = pac.execute(inp)
 
-                else:
-                    wrap_text("In the room there are " + ", ".join(objects))
+                if result.moved:
+                    print(get_room_header(pac.current_room))
 
-            # Moves the player back to the previous room.
-            elif inp.startswith("go back"):
+                if result.message:
+                    wrap_text(result.message)
 
-                try:
-                    desc = pac.go_back()
 
-                except NotImplementedError or NotLinked or AttributeError:
-                    return
+        # This part
+        # Prints the starting message and the usual for the starting room and then enters the 'infinite' loop.
 
-                if not isinstance(desc, list):
-                    print(get_room_header(pac.current_room))
-                    wrap_text(desc)
+        pac._init_save()  # creates SaveGame instance at pac.saving
 
-                else:
-                    wrap_text(desc[0])
+        if self.ask_for_save and pac.saving.has_valid_save():
+            doit = str(input("A save has been found. Do you want to load the save? y/n "))
 
-            # Moves the player to a different room
-            elif inp.startswith(("walk ", "go ", "go to ", "walk to ", "walk down ", "go down")):
-                # Properly cuts the string
-                if inp.startswith("walk down"):
-                    rn = inp[len("walk down "):]
+            if doit.lower() == "y" or not doit:
+                pac._load_game()
 
-                elif inp.startswith("walk "):
-                    rn = inp[len("walk "):]
+                # Start music if the room has it
+                if pac.current_room.music:
+                    pac._start_music_thread(pac.current_room.music)
 
-                elif inp.startswith("go to"):
-                    rn = inp[len("go to "):]
+                print("Save loaded.")
 
-                elif inp.startswith("go down"):
-                    rn = inp[len("go down "):]
+            # Require confirmation
+            elif doit.lower() == "n" or doit:
+                c = input("Are you sure? With next save all your progress will be lost. y (continue) / n (load save anyway) ")
+                if c.lower() == "n":
+                    pac._load_game()
 
-                elif inp.startswith("go "):
-                    rn = inp[len("go "):]
+                    if pac.current_room.music:
+                        pac._start_music_thread(pac.current_room.music)
 
-                elif inp.startswith("walk to"):
-                    rn = inp[len("walk to "):]
-
-                # Printed when you do "walk somethingthatisnothere"
-                else:
-                    print("Where do you want to go?")
-                    return
-
-                # Resolves a/an/the
-                if rn.startswith("a "):
-                    rn = rn[len("a "):]
-
-                elif rn.startswith("an "):
-                    rn = rn[len("an "):]
-
-                elif rn.startswith("the "):
-                    rn = rn[len("the "):]
-
-                # Walks and prints
-                try:
-                    desc = pac.walk(str(rn))
-                except (NotImplementedError or NotLinked):
-                    return
-
-                if not isinstance(desc, list):
-                    print(get_room_header(pac.current_room))
-                    wrap_text(desc)
-
-                else:
-                    wrap_text(desc[0])
-
-            # Picks up the item in the room and puts it into your inventory
-            elif inp.startswith("pick up"):
-                on = inp[len("pick up "):]
-
-                if not on:
-                    print("What do you want to pick up?")
-
-                # Resolves a/an/the
-                if on.startswith("a "):
-                    on = on[len("a "):]
-
-                elif on.startswith("an "):
-                    on = on[len("an "):]
-
-                elif on.startswith("the "):
-                    on = on[len("the "):]
-
-                on_use = pac.pick_up_item(on)
-                if not on_use:
-                    pass
-
-                else:
-                    wrap_text(on_use)
-
-            # Uses the item in your inventory
-            elif inp.startswith("use"):
-                on = inp[len("use "):]
-
-                if not on:
-                    print("What?")
-
-                # Resolves a/an/the
-                if on.startswith("a "):
-                    on = on[len("a "):]
-
-                elif on.startswith("an "):
-                    on = on[len("an "):]
-
-                elif on.startswith("the "):
-                    on = on[len("the "):]
-
-                try:
-                    desc = pac.use_item(pac.get_item_by_name(on))
-
-                except NotImplementedError:
-                    spl = on.split(" with ")
-
-                    if len(spl) == 1:
-                        spl = on.split(" on ")
-
-                        if len(spl) == 1:
-                            print("What do you want to use?")
-                            return
-
-                    try:
-                        desc = pac.use_static_object(pac.get_static_object_by_name(spl[1]), pac.get_item_by_name(spl[0]))
-                    except NotImplementedError:
-                        return
-
-                if not desc:
-                    return
-
-                wrap_text(desc)
-
-            elif inp.startswith("combine"):
-                # Finds the two Item objects
-                sr = inp[len("combine "):]
-
-                if not sr:
-                    print("What do you want to combine?")
-                    return
-
-                # Does proper splitting with multiple keywords
-                sr = sr.split("with")
-
-                if len(sr) == 1:
-                    sr = sr[0].split("and")
-
-                if len(sr) == 1:
-                    print("Use: combine item1 with item2...")
-                    return
-
-                try:
-                    crafting_desc = pac.combine(sr[0].strip(" "), sr[1].strip(" "))
-                except NotImplementedError:
-                    return
-
-                if not crafting_desc:
-                    wrap_text(pac.d_failed_combine)
-                    return
-
-                wrap_text(crafting_desc)
-
-            # Displays items in your inventory
-            elif inp.startswith(("inventory", "inv")):
-                # Converts items to a list of names
-                items = []
-                for it in pac.get_inventory():
-
-                    # Just for the correct grammar jk
-                    if str(it.name).startswith(("a", "e", "i", "o", "u")):
-                        um = "an"
-                    else:
-                        um = "a"
-
-                    items.append(str(um + " " + it.name))
-
-                # Correct prints
-                if len(items) == 0:
-                    print("You do not have anything in your inventory.")
-
-                elif len(items) == 1:
-                    print("You have " + items[0])
-
-                elif len(items) == 2:
-                    wrap_text("You have " + items[0] + " and " + items[1])
-
-                else:
-                    wrap_text("You have " + ", ".join(items))
-
-            # Tells you what room you are currently in
-            elif inp.startswith(("where am i", "where", "room")):
-                wrap_text("You are in the " + str(pac.get_current_room().name))
-
-            # Saves the game
-            elif inp.startswith(("save", "save game", "do a save", "gamesave")):
-                pac._save_game()
-                print("Game has been saved.")
-
-            # Option to quit game
-            elif inp.startswith(("exit", "quit", "q")):
-                n = str(input("Are you sure?"))
-
-                if str(n).lower().startswith(("yes", "yup", "ye", "sure", "y")):
-                    ce = str(input("Would you like to save your current game? y/n "))
-                    if ce.lower() == "y":
-                        pac._save_game()
-                        print("Game saved, bye!")
-
-                    else:
-                        print("Bye!")
-                    self.running = False
-                    return
-
-                elif n.lower().startswith(("no", "nope", "n", "not sure")):
-                    return
-
-
-        # This part
-        # Prints the starting message and the usual for the starting room and then enters the 'infinite' loop.
-
-        pac._init_save()  # creates SaveGame instance at pac.saving
-
-        if self.ask_for_save and pac.saving.has_valid_save():
-            doit = str(input("A save has been found. Do you want to load the save? y/n "))
-
-            if doit.lower() == "y" or not doit:
-                pac._load_game()
-
-                # Start music if the room has it
-                if pac.current_room.music:
-                    pac._start_music_thread(pac.currentroom.music)
-
-                print("Save loaded.")
-
-            # Require confirmation
-            elif doit.lower() == "n" or doit:
-                c = input("Are you sure? With next save all your progress will be lost. y (continue) / n (load save anyway) ")
-                if c.lower() == "n":
-                    pac._load_game()
-
-                    if pac.currentroom.music:
-                        pac._start_music_thread(pac.currentroom.music)
-
-                    print("Save loaded.")
+                    print("Save loaded.")
 
                 else:
                     pass
@@ -1103,6 +1494,12 @@ class TextInterface(metaclass=Singleton):
             else:
                 log.warn("Got unexpected response.")
 
+        if readline is not None:
+            # The whole line is completed, not single words
+            readline.set_completer_delims("")
+            readline.set_completer(pac.get_completer().readline_completer())
+            readline.parse_and_bind("tab: complete")
+
         print(pac.starting_message + "\n" + get_room_header(pac.current_room.name))
         wrap_text(pac.current_room.enter())
 
@@ -1117,6 +1514,35 @@ class TextInterface(metaclass=Singleton):
 
         # Code never reaches this point... probably (except when quitting)
 
+class Player:
+    """
+    Where a player is, what they carry and the rooms they went through.
+    PaCInterpreter has one (PaCInterpreter.player), pac.multiplayer has many in one world.
+    """
+    def __init__(self, name, locations, owner=None):
+        """
+        :param name: player name
+        :param locations: ItemLocations of the world
+        :param owner: location of the items in the inventory (see pac.locations), the Player itself by default
+        :return: None
+        """
+        self.name = name
+        self.inv = Inventory(locations, owner=self if owner is None else owner)
+
+        self.visits = []
+
+        self.current_room = None
+        self.previous_room = None
+
+
+class _Acting(threading.local):
+    # Player the interpreter acts for in a thread, see PaCInterpreter.as_player()
+    player = None
+
+
+_acting_lock = threading.Lock()
+
+
 # Main class
 
 
@@ -1142,13 +1568,35 @@ class PaCInterpreter(metaclass=Singleton):
         self.statics = {}
         self.blueprints = []
 
-        self.inv = []
+        # Normalized names and aliases: object (see add_alias())
+        self.room_names = {}
+        self.item_names = {}
+        self.static_names = {}
 
-        self.visits = []
-        self.links = {}
+        # Matches mistyped names (all names above are in it)
+        self.fuzzy = FuzzyMatcher()
 
-        self.current_room = None
-        self.previous_room = None
+        # Normalized names and aliases of the rooms linked from a room: {room name: {name: Room}}
+        self._exit_names = {}
+
+        # Rooms, items and objects that may differ from their reset state (not entered, empty, not used),
+        # a dict used as an ordered set. Lets get_state() and set_state() skip the untouched part of the world.
+        self.changed = ChangeSet()
+
+        # Flags of the rooms, items and objects packed into byte vectors (see pac.flags)
+        self.room_flags = FlagVector({"entered": 1})
+        self.item_flags = FlagVector({"used": 1, "picked_up": 2, "crafted": 4})
+        self.static_flags = FlagVector({"used": 1})
+
+        # Where every item is (see pac.locations), the inventory keeps it up to date as well
+        self.locations = ItemLocations(self.changed)
+        self.changed.locations = self.locations
+
+        # current_room, previous_room, inv and visits are the player's (or the one of as_player())
+        self.player = Player(None, self.locations, INVENTORY)
+        self._acting = None  # _Acting, created by the first as_player()
+
+        self.links = {}
 
         self.starting_room = None
         self.starting_message = None
@@ -1164,8 +1612,81 @@ class PaCInterpreter(metaclass=Singleton):
         self.music_thread = None
         self.events = None
 
+        # Delayed events, see schedule()
+        self.timers = TimerWheel()
+
+        # See complete()
+        self.completer = None
+
         self.autosave = autosave
 
+        self.metrics = None
+        self.tracer = None
+        self.analytics = None
+
+        # State before begin() was first called, see reset()
+        self.initial_state = None
+
+        # Undo/redo, see enable_history()
+        self.history = None
+
+        # Seconds played before the current session (restored from save slots), see get_play_time()
+        self.play_time = 0.0
+        self._play_started = None
+
+    def _player(self):
+        # The player commands act for in this thread (the properties below skip the call until as_player() was used)
+        acting = self._acting
+        if acting is None or acting.player is None:
+            return self.player
+
+        return acting.player
+
+    @property
+    def current_room(self):
+        return (self.player if self._acting is None else self._player()).current_room
+
+    @current_room.setter
+    def current_room(self, room):
+        (self.player if self._acting is None else self._player()).current_room = room
+
+    @property
+    def previous_room(self):
+        return (self.player if self._acting is None else self._player()).previous_room
+
+    @previous_room.setter
+    def previous_room(self, room):
+        (self.player if self._acting is None else self._player()).previous_room = room
+
+    @property
+    def inv(self):
+        return (self.player if self._acting is None else self._player()).inv
+
+    @property
+    def visits(self):
+        return (self.player if self._acting is None else self._player()).visits
+
+    @contextmanager
+    def as_player(self, player):
+        """
+        Acts for another Player in the current thread: in the with block current_room, previous_room, inv and visits
+        are theirs, so commands can be executed for them (see pac.multiplayer).
+        :param player: Player
+        """
+        if self._acting is None:
+            with _acting_lock:
+                if self._acting is None:
+                    self._acting = _Acting()
+
+        acting = self._acting
+        previous = acting.player
+        acting.player = player
+
+        try:
+            yield player
+        finally:
+            acting.player = previous
+
     def _set_event_dispatcher(self, event_dispatcher):
         """
         !DEPRECATED!
@@ -1186,33 +1707,211 @@ class PaCInterpreter(metaclass=Singleton):
         :param: ask_for_save: bool indicating if the user should be asked to load a save (of one is present)
         :return: None
         """
-        self.running = True
-        self.current_room = self.starting_room
-
-        mixer.init()  # Initializes the mixer module (for Music)
-
-        if not self.events:
-            self.events = EventDispatcher()
-
-        self.events.dispatch_event(START)
-
-        if not self.starting_room or not self.starting_message:
+        if not self.starting_message:
             raise MissingParameters
 
-        self.visits.append(self.current_room)
+        if mixer:
+            mixer.init()  # Initializes the mixer module (for Music)
+
+        self.begin()
 
         # Instances the TextInterface class (no need for it to be class-wide for now)
         text_interface = TextInterface(autosave=self.autosave, ask_for_save=ask_for_save)
 
         # If the starting room has music, start playing.
         if self.starting_room.music:
-            self._start_music_thread(self.starting_room.music)
+            self._play_music(self.starting_room.music)
 
         # With this the TextInterface has the access to the class - the 'story'.
         # Prints the starting message and begins the while True loop.
 
         text_interface.begin_adventure(self)
 
+    def begin(self):
+        """
+        Puts the player into the starting room without starting the TextInterface (for headless use with execute()).
+        Called by start(). If you have not defined a starting room, MissingParameters will be raised.
+        :return: None
+        """
+        if not self.starting_room:
+            raise MissingParameters
+
+        if self.initial_state is None:
+            self.initial_state = self.get_state()
+
+        self.running = True
+        self.current_room = self.starting_room
+        self._play_started = time.monotonic()
+
+        if not self.events:
+            self.events = EventDispatcher()
+
+        self.events.dispatch_event(START)
+
+        self.visits.append(self.current_room)
+
+        if self.tracer is not None:
+            self.tracer.record(trace.ENTER, self.current_room.name)
+
+        # Nothing before the beginning can be undone
+        if self.history is not None:
+            self.history.clear()
+
+    def get_completer(self):
+        """
+        :return: pac.completion.Completer of the player (created when first needed)
+        """
+        if self.completer is None:
+            self.completer = Completer(self)
+
+        return self.completer
+
+    def complete(self, line, limit=20):
+        """
+        Completes a partly typed command: verbs, items and objects in the room, exits and items in the inventory.
+        :param line: what the player typed so far ("pick up ph")
+        :param limit: maximum number of completions
+        :return: sorted list of whole commands ("pick up phone")
+        """
+        return self.get_completer().complete(line, limit)
+
+    def schedule(self, delay, name, **details):
+        """
+        Dispatches a TIMER event after some time (@EventDispatcher.on_timer handlers get name and the details).
+        Timers fire before the next command is executed, or when they expire if self.timers.start() was called.
+        :param delay: seconds
+        :param name: name of the timer ("door-closes")
+        :return: pac.timers.Timer (can be cancelled)
+        """
+        return self.timers.schedule(delay, self._fire_timer, name, details)
+
+    def _fire_timer(self, name, details):
+        if not self.events:
+            self.events = EventDispatcher()
+
+        self.events.dispatch_event(TIMER, name=name, **details)
+
+    def enable_metrics(self, metrics=None):
+        """
+        Starts collecting latency histograms and counters for commands and actions (see the 'stats' command).
+        :param metrics: Metrics to collect into (optional, a new one is created)
+        :return: Metrics
+        """
+        if metrics is None:
+            metrics = Metrics()
+
+        if not isinstance(metrics, Metrics):
+            raise InvalidParameters
+
+        self.disable_metrics()
+
+        if not self.events:
+            self.events = EventDispatcher()
+
+        self.metrics = metrics
+        metrics.instrument(self)
+
+        return metrics
+
+    def disable_metrics(self):
+        """
+        Stops collecting metrics. The collected ones are kept in the Metrics object.
+        :return: None
+        """
+        if self.metrics:
+            self.metrics.uninstrument(self)
+            self.metrics = None
+
+    def enable_analytics(self, path="analytics.jsonl", interval=60.0, **options):
+        """
+        Starts streaming the results of commands into an analytics sink (see pac.analytics), which appends
+        a rollup of where players get stuck to a file every interval.
+        :param path: file the rollups are appended to
+        :param interval: seconds between rollups
+        :param options: other parameters of Analytics (top, capacity, session_timeout, ...)
+        :return: Analytics
+        """
+        self.disable_analytics()
+
+        self.analytics = Analytics(self, path, interval, **options)
+        self.analytics.start()
+
+        return self.analytics
+
+    def disable_analytics(self):
+        """
+        Stops the analytics sink, what it has not written yet is written as a last rollup.
+        :return: None
+        """
+        if self.analytics is not None:
+            self.analytics.stop()
+            self.analytics = None
+
+    def enable_tracing(self, size=4096, dump_path=None):
+        """
+        Starts recording state mutations into a ring buffer (see pac.trace).
+        :param size: number of mutations kept
+        :param dump_path: file to dump the buffer to when a command raises an exception (optional)
+        :return: Tracer
+        """
+        self.tracer = trace.Tracer(size, dump_path)
+        return self.tracer
+
+    def disable_tracing(self):
+        """
+        Stops recording state mutations.
+        :return: None
+        """
+        self.tracer = None
+
+    def enable_history(self, depth=100):
+        """
+        Makes changes undoable: execute() records a checkpoint before every command and the 'undo' and 'redo'
+        commands become available. Checkpoints only store what changed (see pac.history).
+        :param depth: number of checkpoints kept
+        :return: History
+        """
+        self.disable_history()
+
+        self.history = History(self, depth)
+        self.changed.journal = self.history
+
+        return self.history
+
+    def disable_history(self):
+        """
+        Stops recording checkpoints and drops the recorded ones.
+        :return: None
+        """
+        self.history = None
+        self.changed.journal = None
+
+    @staticmethod
+    def set_locale(locale):
+        """
+        Switches all texts to a locale registered with pac.strings.STRINGS.add_locale() (loaded when first used).
+        The string table is shared, so this applies to every world in the process.
+        :param locale: locale name, None for the original texts
+        :return: None
+        """
+        STRINGS.set_locale(locale)
+
+    def finalize(self):
+        """
+        Prepares the built world to be shared by forked processes (pac.cluster does this before forking its workers).
+        The texts are packed into one buffer (pac.strings) and the objects are frozen out of the garbage collector,
+        whose passes would otherwise write to (and so copy) every memory page of the world in every process.
+        The texts are not packed while a locale is loaded.
+        :return: None
+        """
+        STRINGS.freeze()
+
+        gc.collect()
+
+        # Python 3.7+
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+
     def set_default_use_fail_message(self, message):
         """
         Sets the default message to return when not being able to use an item (when not overridden by Item specific fail message).
@@ -1297,13 +1996,55 @@ class PaCInterpreter(metaclass=Singleton):
         """
         return list(self.inv)
 
+    def get_play_time(self):
+        """
+        :return: seconds played (including the time played before loading a slot)
+        """
+        if self._play_started is None:
+            return self.play_time
+
+        return self.play_time + time.monotonic() - self._play_started
+
+    def get_save_slots(self, sort="time", reverse=True, limit=None):
+        """
+        Lists the saved slots, see SaveGame.list_slots().
+        :return: list of dicts (slot, time, room, play_time, size, version)
+        """
+        if not self.saving:
+            self._init_save()
+
+        return self.saving.list_slots(sort, reverse, limit)
+
+    def locate_item(self, item):
+        """
+        Tells where an item is (without searching the rooms).
+        :param item: Item or item name
+        :return: Room, "inventory", "consumed" (used up or combined) or None if the item is nowhere
+        """
+        if not isinstance(item, Item):
+            item = self.get_item_by_name(item)
+
+        return self.locations.locate(item)
+
+    def count_items(self, location):
+        """
+        :param location: Room, "inventory" or "consumed"
+        :return: number of items in the location
+        """
+        return self.locations.count(location)
+
     def get_room_by_name(self, name):
         """
-        Returns the Room by its name.
+        Returns the Room by its name (or alias, in any case). Raises KeyError if the room does not exist.
         :param name: room name string
         :return: Room object
         """
-        return self.rooms[str(name)]
+        room = self.rooms.get(str(name)) or self.room_names.get(normalize_name(name))
+
+        if room is None:
+            raise KeyError(name)
+
+        return room
 
     def get_item_by_name(self, item):
         """
@@ -1311,22 +2052,108 @@ class PaCInterpreter(metaclass=Singleton):
         :param item: item name string
         :return: Item object
         """
-        try:
-            return self.items[item]
-        except KeyError:
+        item = self.items.get(item) or self.item_names.get(normalize_name(item))
+
+        if item is None:
             raise NotImplementedError
 
+        return item
+
     def get_static_object_by_name(self, obj):
         """
         Returns the StaticObject by its name. Raises NotImplementedError if the item does not exist
         :param obj: object name string
         :return: StaticObject object
         """
-        try:
-            return self.statics[obj]
-        except KeyError:
+        obj = self.statics.get(obj) or self.static_names.get(normalize_name(obj))
+
+        if obj is None:
             raise NotImplementedError
 
+        return obj
+
+    def _index_world(self, index, obj):
+        _index_names(index, obj)
+        self._exit_names.clear()
+
+    def resolve(self, name, candidates):
+        """
+        Resolves a name typed by the player, tolerating typos (see pac.fuzzy).
+        :param name: typed name
+        :param candidates: dict {normalized name: object} to choose from (like Room.item_names)
+        :return: tuple - (object or None, name of the closest object to suggest or None)
+        """
+        key = normalize_name(name)
+
+        obj = candidates.get(key)
+        if obj is not None:
+            return obj, None
+
+        accepted, suggestion = self.fuzzy.match(key, candidates)
+
+        if accepted is not None:
+            return candidates[accepted], None
+
+        return None, candidates[suggestion].name if suggestion is not None else None
+
+    def exit_names(self, room=None):
+        """
+        :param room: Room, defaults to the current one
+        :return: dict {normalized name or alias: Room} of the rooms linked from the room
+        """
+        room = room or self.current_room
+
+        names = self._exit_names.get(room.name)
+        if names is None:
+            names = self._exit_names[room.name] = {}
+
+            for name in self.links.get(room.name, []):
+                _index_names(names, self.rooms[name])
+
+        return names
+
+    def inventory_names(self):
+        """
+        :return: dict {normalized name or alias: Item} of the items in the inventory
+        """
+        names = {}
+        for item in self.inv:
+            _index_names(names, item)
+
+        return names
+
+    def add_alias(self, obj, *aliases):
+        """
+        Adds other names a Room, Item or StaticObject can be called by ("door", "the big door", ...).
+        Names and aliases are matched case-insensitively and without a leading article.
+        :param obj: Room, Item or StaticObject
+        :param aliases: alias strings
+        :return: None
+        """
+        if isinstance(obj, Room):
+            index = self.room_names
+        elif isinstance(obj, Item):
+            index = self.item_names
+        elif isinstance(obj, StaticObject):
+            index = self.static_names
+        else:
+            raise InvalidParameters
+
+        obj.aliases.extend(str(alias) for alias in aliases)
+        obj.__dict__.pop("_name_keys", None)
+        self._index_world(index, obj)
+
+        # Rooms index what they hold when it is put in, so update the ones holding it already
+        if isinstance(obj, Item):
+            room = self.locations.locate(obj)
+
+            if isinstance(room, Room) and room.items.get(obj.name) is obj:
+                _index_names(room.item_names, obj)
+
+        elif isinstance(obj, StaticObject):
+            for room in self.rooms.values():
+                if room.statics.get(obj.name) is obj:
+                    _index_names(room.static_names, obj)
 
     def create_room(self, name, desc, on_first_enter=None, starting=False):
         """
@@ -1344,7 +2171,10 @@ class PaCInterpreter(metaclass=Singleton):
             raise AlreadyExists
 
         room = Room(name, desc, on_first_enter, starting)
+        room.changes = self.changed
+        self.room_flags.add(room)
         self.rooms[str(name)] = room
+        self._index_world(self.room_names, room)
 
         if starting:
             self.starting_room = room
@@ -1371,8 +2201,9 @@ class PaCInterpreter(metaclass=Singleton):
         if not on_use:
             on_use = self.d_use
 
+        # Formatted when shown
         if not on_pickup:
-            on_pickup = "You picked up {}".format(str(name))
+            on_pickup = Format(PICKUP_TEMPLATE, str(name))
 
         if not failed_use:
             failed_use = self.d_failed_use
@@ -1381,12 +2212,15 @@ class PaCInterpreter(metaclass=Singleton):
             failed_pickup = self.d_failed_pickup
 
         if not crafting_desc:
-            crafting_desc = "By combining you created a {}".format(str(name))
+            crafting_desc = Format(CRAFTED_TEMPLATE, str(name))
 
         obj = Item(name, desc, on_use, failed_use, failed_pickup, on_pickup, is_craftable, crafting_desc)
+        obj.changes = self.changed
+        self.item_flags.add(obj)
 
         # 'Registers' the object for getItemByName()
         self.items[obj.name] = obj
+        self._index_world(self.item_names, obj)
         return obj
 
     def create_blueprint(self, item1, item2, final_item):
@@ -1432,7 +2266,10 @@ class PaCInterpreter(metaclass=Singleton):
             failed_use = self.d_failed_use
 
         obj = StaticObject(name, display, on_use, failed_use)
+        obj.changes = self.changed
+        self.static_flags.add(obj)
         self.statics[name] = obj
+        self._index_world(self.static_names, obj)
 
         return obj
 
@@ -1455,14 +2292,18 @@ class PaCInterpreter(metaclass=Singleton):
             return False
 
         # Shifts through blueprints
-        for c, blue in enumerate(self.blueprints):
-            item1 = blue[0]
-            item2 = blue[1]
+        for first, second, result in self.blueprints:
+            if (first == item1 and second == item2) or (first == item2 and second == item1):
+                self.inv.remove(item1)
+                self.inv.remove(item2)
 
-            if (item1 == item1 and item2 == item2) or (item1 == item2 and item2 == item1):
-                result = blue[2]
-                self.inv.pop(c)
-                self.inv.pop(c)
+                self.locations.put(item1, CONSUMED)
+                self.locations.put(item2, CONSUMED)
+
+                if self.tracer is not None:
+                    self.tracer.record(trace.INV_REMOVE, item1.name)
+                    self.tracer.record(trace.INV_REMOVE, item2.name)
+                    self.tracer.record(trace.CRAFT, result.name)
 
                 self.put_into_inv(result)
 
@@ -1473,7 +2314,6 @@ class PaCInterpreter(metaclass=Singleton):
 
         return False
 
-
     def link_room(self, room1, room2, two_way=False):
         """
         Links two rooms together (one-way or two-way).
@@ -1485,6 +2325,8 @@ class PaCInterpreter(metaclass=Singleton):
         if not isinstance(room1, Room) or not isinstance(room2, Room):
             raise InvalidParameters
 
+        self._exit_names.clear()
+
         # First link
         try:
             self.links[room1.name].append(room2.name)
@@ -1540,6 +2382,9 @@ class PaCInterpreter(metaclass=Singleton):
 
         self.inv.append(item)
 
+        if self.tracer is not None:
+            self.tracer.record(trace.INV_ADD, item.name)
+
     def pick_up_item(self, item):
         """
         Picks up the item in the current room.
@@ -1548,22 +2393,25 @@ class PaCInterpreter(metaclass=Singleton):
         """
         # Converts string to Item if needed
         if not isinstance(item, Item):
+            item = self.current_room.find_item(item)
 
-            try:
-                item = self.items[item]
-            except KeyError:
+            if item is None:
                 return False
 
-        if not item == self.current_room.items.get(item.name):
+        if self.current_room.items.get(item.name) is not item:
             return False
 
         if not item.has_pick_up_requirements(self.inv):
-            if item.onfaileduse is not None:
+            if item.on_failed_pickup is not None:
                 return str(item.on_failed_pickup)
             else:
                 return self.d_failed_pickup
 
         it = self.current_room.pick_up_item(item)
+
+        if self.tracer is not None:
+            self.tracer.record(trace.PICKUP, item.name)
+
         self.events.dispatch_event(PICKUP, item=item, desc=it)
 
         that_item = self.items[item.name]
@@ -1592,6 +2440,10 @@ class PaCInterpreter(metaclass=Singleton):
                     return self.d_failed_use
 
             desc = item.use()
+
+            if self.tracer is not None:
+                self.tracer.record(trace.USE_ITEM, item.name)
+
             self.events.dispatch_event(USE_ITEM, item=item, desc=desc)
             return desc
 
@@ -1600,12 +2452,12 @@ class PaCInterpreter(metaclass=Singleton):
         Uses the StaticObject in the room.
         :param obj: StaticObject
         :param item: Item to use with (optional)
-        :return: StaticObject display string
+        :return: StaticObject display string, False if it is not here or nothing happens with the item
         """
         if not isinstance(obj, StaticObject):
             raise InvalidParameters
 
-        if obj not in self.current_room.get_static_items():
+        if self.current_room.statics.get(obj.name) is not obj:
             return False
 
         else:
@@ -1618,12 +2470,21 @@ class PaCInterpreter(metaclass=Singleton):
 
             if not item:
                 if obj.music:
-                    self._start_music_thread(obj.music)
+                    self._play_music(obj.music)
                 desc = obj.use()
             else:
-                if obj.music:
-                    self._start_music_thread(obj.music)
+                if item not in self.inv:
+                    return False
+
                 desc = obj.use_with_item(item)
+                if desc is False:
+                    return False
+
+                if obj.music:
+                    self._play_music(obj.music)
+
+            if self.tracer is not None:
+                self.tracer.record(trace.USE_OBJECT, obj.name)
 
             self.events.dispatch_event(USE_OBJECT, object=obj, desc=desc)
             return desc
@@ -1639,35 +2500,41 @@ class PaCInterpreter(metaclass=Singleton):
         # Gets the Room object if needed
         if not isinstance(room, Room):
             try:
-                room = self.rooms[str(room)]
+                room = self.get_room_by_name(room)
             except KeyError:
                 raise NotImplementedError
 
         # Starts the music if the room has one
         if room.music:
             if not self.music_thread == room.music:
-                self._start_music_thread(room.music)
+                self._play_music(room.music)
+
+        current = self.current_room
 
         # Raise NotLinked if the room does not have a link to the specified one
-        if room.name not in self.links.get(self.current_room.name):
+        if room.name not in self.links.get(current.name, []):
             raise NotLinked
 
         # Processes requirements
-        item_r = room.has_item_requirements(self.inv)
-        room_r = room.has_visit_requirement(self.visits)
+        player = self.player if self._acting is None else self._player()
+        item_r = room.has_item_requirements(player.inv)
+        room_r = room.has_visit_requirement(player.visits)
 
         if item_r or room_r:
-            self.events.dispatch_event(ENTER, fr=self.current_room, to=room, first_time=not room.entered)
+            self.events.dispatch_event(ENTER, fr=current, to=room, first_time=not room.entered)
 
         if item_r == 1:
             if room_r == 1:  # Only if everything is fulfilled, return room description
                 desc = room.enter()
 
                 # Sets current room and the one you were just in
-                self.previous_room = self.current_room
-                self.current_room = room
+                player.previous_room = current
+                player.current_room = room
 
-                self.visits.append(room)
+                player.visits.append(room)
+
+                if self.tracer is not None:
+                    self.tracer.record(trace.ENTER, room.name)
 
                 return desc
 
@@ -1707,6 +2574,285 @@ class PaCInterpreter(metaclass=Singleton):
         except KeyError:
             return []
 
+    def execute(self, command):
+        """
+        Parses and executes a command without any terminal input or output.
+        Calls begin() first if the adventure was not started yet.
+        :param command: string, the same as typed into the TextInterface ("walk to park", "pick up phone", ...)
+        :return: CommandResult
+        """
+        if not self.current_room:
+            self.begin()
+
+        # What happened while the player was thinking
+        if self.timers.pending:
+            self.timers.advance()
+
+        verb, argument = parse_command(command)
+
+        try:
+            return self._execute(verb, argument, command)
+        except Exception:
+            if self.tracer is not None:
+                self.tracer.dump_exception(command)
+            raise
+
+    def execute_many(self, commands):
+        """
+        Executes the commands in order.
+        :param commands: iterable of command strings
+        :return: list of CommandResult
+        """
+        return [self.execute(command) for command in commands]
+
+    def _execute(self, verb, argument, command):
+        """
+        Applies an already parsed command.
+        :return: CommandResult
+        """
+        if self.history is not None:
+            self.history.checkpoint()
+
+        room = self.current_room
+
+        def result(ok=True, message=None, error=None):
+            current = self.current_room
+            done = CommandResult(command, verb, argument, ok, message, error, moved=current is not room, room=current.name)
+
+            if self.analytics is not None:
+                self.analytics.observe(self._player().name, done)
+
+            return done
+
+        if verb is None:
+            return result(False, None, "unknown-command")
+
+        elif verb == "help":
+            return result(message=", ".join(HELP))
+
+        elif verb == "ways":
+            return result(message="You can go to: " + ", ".join(self.ways()))
+
+        elif verb == "items":
+            objects = [with_article(obj.name) for obj in self.current_room.get_items()]
+
+            if len(objects) == 0:
+                return result(message="There are no items here.")
+            elif len(objects) == 1:
+                return result(message="In the room there is " + objects[0])
+            else:
+                return result(message="In the room there are " + ", ".join(objects))
+
+        elif verb == "inventory":
+            items = [with_article(it.name) for it in self.inv]
+
+            if len(items) == 0:
+                return result(message="You do not have anything in your inventory.")
+            elif len(items) == 1:
+                return result(message="You have " + items[0])
+            elif len(items) == 2:
+                return result(message="You have " + items[0] + " and " + items[1])
+            else:
+                return result(message="You have " + ", ".join(items))
+
+        elif verb == "where":
+            return result(message="You are in the " + str(self.current_room.name))
+
+        elif verb == "save":
+            # "save" and "save game" use the default save
+            slot = argument if argument and argument != "game" else None
+            self._save_game(slot)
+
+            if slot is None:
+                return result(message="Game has been saved.")
+
+            return result(message="Game has been saved to {}.".format(slot))
+
+        elif verb == "load":
+            if not self._load_game(argument or None):
+                return result(False, "There is no save to load.", "no-save")
+
+            return result(message="Save loaded.")
+
+        elif verb == "slots":
+            slots = self.get_save_slots()
+
+            if not slots:
+                return result(message="There are no saved slots.")
+
+            return result(message="\n".join("{} - {} ({:.0f} min)".format(entry["slot"], entry["room"], entry["play_time"] / 60)
+                                            for entry in slots))
+
+        elif verb == "stats":
+            if not self.metrics:
+                return result(False, "Metrics are disabled.", "unsupported")
+
+            return result(message=self.metrics.summary())
+
+        elif verb in ("undo", "redo"):
+            if self.history is None:
+                return result(False, "Undo is disabled.", "unsupported")
+
+            if verb == "undo":
+                done = self.history.undo()
+            else:
+                done = self.history.redo()
+
+            if not done:
+                return result(False, "There is nothing to {}.".format(verb), "nothing-to-" + verb)
+
+            return result(message="Undone." if verb == "undo" else "Redone.")
+
+        elif verb == "exit":
+            self.running = False
+            return result(message="Bye!")
+
+        elif verb == "settings":
+            # Settings are interactive, only the TextInterface has them
+            return result(False, None, "unsupported")
+
+        elif verb in ("walk", "back"):
+            if verb == "walk" and not argument:
+                return result(False, "Where do you want to go?", "missing-argument")
+
+            # Not "room", result() compares the current room with the one the command started in
+            target = self.previous_room
+            if verb == "walk":
+                target = self.rooms.get(argument) or self.room_names.get(normalize_name(argument))
+
+                if target is None:
+                    target, suggestion = self.resolve(argument, self.exit_names())
+
+                    if target is None:
+                        return result(False, "You can't go to {}.{}".format(argument, did_you_mean(suggestion)), "unknown-room")
+
+            try:
+                desc = self.go_back() if verb == "back" else self.walk(target)
+            except NotImplementedError:
+                return result(False, None, "unknown-room")
+            except NotLinked:
+                return result(False, "You can't go to {} from here.".format(target.name), "not-linked")
+
+            if isinstance(desc, list):
+                return result(False, desc[0], "requirements")
+
+            return result(message=desc)
+
+        elif verb == "pickup":
+            if not argument:
+                return result(False, "What do you want to pick up?", "missing-argument")
+
+            item, suggestion = self.resolve(argument, self.current_room.item_names)
+            if item is None:
+                return result(False, "There is no {} here.{}".format(argument, did_you_mean(suggestion)), "not-here")
+
+            before = len(self.inv)
+            desc = self.pick_up_item(item)
+
+            if desc is False:
+                return result(False, None, "not-here")
+
+            return result(len(self.inv) > before, desc, None if len(self.inv) > before else "requirements")
+
+        elif verb == "use":
+            if not argument:
+                return result(False, "What do you want to use?", "missing-argument")
+
+            def use(item):
+                if item not in self.inv:
+                    return result(False, None, "not-in-inventory")
+
+                ok = item.has_use_requirements(self.inv)
+                return result(ok, self.use_item(item), None if ok else "requirements")
+
+            item = self.item_names.get(normalize_name(argument))
+
+            if item is not None:
+                return use(item)
+
+            # Static object, optionally with an item
+            spl = argument.split(" with ")
+            if len(spl) == 1:
+                spl = argument.split(" on ")
+
+            if len(spl) == 1:
+                name, item = argument, None
+            else:
+                name, item = spl[1], self.item_names.get(normalize_name(spl[0]))
+
+                if item is None:
+                    item, suggestion = self.resolve(spl[0], self.inventory_names())
+
+                    if item is None:
+                        return result(False, "You don't have {}.{}".format(spl[0], did_you_mean(suggestion)), "unknown-item")
+
+            # Objects in other rooms are still known (use_static_object() tells they are not here)
+            obj = self.current_room.find_static_obj(name) or self.static_names.get(normalize_name(name))
+
+            if obj is None:
+                obj, suggestion = self.resolve(name, self.current_room.static_names)
+
+                # A mistyped item from the inventory
+                if obj is None and item is None:
+                    item, item_suggestion = self.resolve(name, self.inventory_names())
+
+                    if item is not None:
+                        return use(item)
+
+                    suggestion = suggestion or item_suggestion
+
+                if obj is None:
+                    return result(False, "What do you want to use?" + did_you_mean(suggestion), "unknown-object")
+
+            ok = obj.has_item_requirements(self.inv)
+
+            # The object is here and the item carried, but nothing happens with it
+            if ok and item is not None and item in self.inv \
+                    and self.current_room.statics.get(obj.name) is obj and obj.use_with_item(item) is False:
+                return result(False, self.d_failed_use, "no-effect")
+
+            desc = self.use_static_object(obj, item)
+
+            if desc is False:
+                return result(False, None, "not-here" if ok and (item is None or item in self.inv) else "not-in-inventory")
+
+            return result(ok, desc, None if ok else "requirements")
+
+        elif verb == "combine":
+            if not argument:
+                return result(False, "What do you want to combine?", "missing-argument")
+
+            # Does proper splitting with multiple keywords
+            spl = argument.split(" with ")
+            if len(spl) == 1:
+                spl = argument.split(" and ")
+
+            if len(spl) == 1:
+                return result(False, "Use: combine item1 with item2...", "missing-argument")
+
+            items = []
+            for name in spl[:2]:
+                item = self.item_names.get(normalize_name(name))
+
+                if item is None:
+                    item, suggestion = self.resolve(name, self.inventory_names())
+
+                    if item is None:
+                        return result(False, "You don't have {}.{}".format(name.strip(" "), did_you_mean(suggestion)), "unknown-item")
+
+                items.append(item)
+
+            first, second = items
+
+            crafting_desc = self.combine(first, second)
+
+            if not crafting_desc:
+                return result(False, self.d_failed_combine, "no-blueprint")
+
+            return result(message=crafting_desc)
+
+        return result(False, None, "unknown-command")
+
     @staticmethod
     def add_music(music, place):
         """
@@ -1730,6 +2876,11 @@ class PaCInterpreter(metaclass=Singleton):
 
         place.add_music(music)
 
+    def _play_music(self, music):
+        # Music is only played for the local player, not for players of pac.multiplayer
+        if self._player() is self.player:
+            self._start_music_thread(music)
+
     @threaded
     def _start_music_thread(self, music, repeat=True):
         """
@@ -1749,68 +2900,295 @@ class PaCInterpreter(metaclass=Singleton):
         self.last_music_thread = music
         self.music_thread.__init__(self.music_thread.path)
 
+        if self.tracer is not None:
+            self.tracer.record(trace.MUSIC, music.path)
+
         self.events.dispatch_event(MUSIC_CHANGE, music=music, path=music.path)
         self.music_thread.start(repeat)
 
-    def _save_game(self):
+    def get_state(self, objects=None):
+        """
+        Returns the current state of the game: only what can change while playing, referenced by names.
+        Descriptions, requirements, blueprints, ... are not included, so a state stays valid when the world's text is edited.
+        Only the rooms, items and objects in self.changed are looked at.
+        :param objects: only include these rooms, items and objects (even unchanged ones), the state
+                        must then be applied with set_state(state, partial=True)
+        :return: dict
+        """
+        rooms = {}
+        items = {}
+        statics = []
+
+        full = objects is not None
+
+        for obj in (objects if full else self.changed):
+            if isinstance(obj, Room):
+                if obj.entered or obj.items or full:
+                    rooms[obj.name] = [obj.entered, list(obj.items.keys())]
+
+            elif isinstance(obj, Item):
+                if obj.used or obj.picked_up or obj.crafted or full:
+                    items[obj.name] = [obj.used, obj.picked_up, obj.crafted]
+
+            elif obj.used:
+                statics.append(obj.name)
+
+        return {
+            "rooms": rooms,
+            "items": items,
+            "statics": statics,
+            "inventory": [item.name for item in self.inv],
+            "visits": [room.name for room in self.visits],
+            "current_room": self.current_room.name if self.current_room else None,
+            "previous_room": self.previous_room.name if self.previous_room else None,
+        }
+
+    def set_state(self, state, partial=False):
         """
-        Saves the current state of the game to save/name_of_the_game.save
+        Applies a state returned by get_state() to the world, in place (references to rooms and items stay valid).
+        Rooms, items and objects that are not in the state are reset, names that do not exist (anymore)
+        in the world are ignored. Takes time proportional to the state and the changes made since the last one.
+        :param state: dict
+        :param partial: leave the rooms, items and objects that are not in the state as they are
         :return: None
         """
-        if not self.saving:
-            self._init_save()
+        if not isinstance(state, dict):
+            raise InvalidParameters
+
+        # Saves made before 0.5 contain whole objects
+        if any(isinstance(room, Room) for room in state.get("rooms", {}).values()):
+            state = self._convert_old_state(state)
+
+        rooms = state.get("rooms", {})
+        items = state.get("items", {})
+        statics = set(state.get("statics", ()))
+
+        # Reset what has changed and is not in the state, the rest is overwritten below
+        reset = []
+        for obj in (() if partial else self.changed):
+            if isinstance(obj, Room):
+                if obj.name not in rooms:
+                    obj.entered = False
+                    obj.clear_items()
+                    reset.append(obj)
+
+            elif isinstance(obj, Item):
+                if obj.name not in items:
+                    obj.used = obj.picked_up = obj.crafted = False
+                    self.locations.take(obj, CONSUMED)
+                    reset.append(obj)
+
+            elif obj.name not in statics:
+                obj.used = False
+                reset.append(obj)
+
+        for obj in reset:
+            del self.changed[obj]
+
+        for name, (entered, item_names) in rooms.items():
+            room = self.rooms.get(name)
+
+            if room is None:
+                log.warn("Room {} does not exist anymore, skipping.".format(name))
+                continue
 
-        rooms = {k: r for k, r in self.rooms.items()}
-        items = {k: r for k, r in self.items.items()}
-        statics = {k: r for k, r in self.statics.items()}
+            room.entered = bool(entered)
 
-        inv = self.inv
-        visited = self.visits
+            if list(room.items) == list(item_names):
+                for item in room.items.values():
+                    self.locations.put(item, room)
+
+                continue
+
+            room.clear_items()
+
+            for item_name in item_names:
+                item = self.items.get(item_name)
+
+                if item is None:
+                    log.warn("Item {} does not exist anymore, skipping.".format(item_name))
+                    continue
+
+                room.put_item(item, room.placements.get(item_name, ""))
+
+        for name, (used, picked_up, crafted) in items.items():
+            item = self.items.get(name)
+
+            if item is not None:
+                item.used, item.picked_up, item.crafted = bool(used), bool(picked_up), bool(crafted)
+
+        for name in statics:
+            obj = self.statics.get(name)
+
+            if obj is not None:
+                obj.used = True
+
+        if self.changed.journal is not None:
+            self.changed.journal.touch_visits()
+
+        # Same lists, code holding on to pac.inv keeps seeing the inventory
+        self.inv[:] = [self.items[name] for name in state.get("inventory", ()) if name in self.items]
+        self.visits[:] = [self.rooms[name] for name in state.get("visits", ()) if name in self.rooms]
+
+        # Older saves do not include the current room, keep the player where they are
+        current = state.get("current_room", self.current_room.name if self.current_room else None)
+        previous = state.get("previous_room", self.previous_room.name if self.previous_room else None)
+
+        self.current_room = self.rooms.get(current) if current else None
+        self.previous_room = self.rooms.get(previous) if previous else None
+
+        # Items that were picked up or used and are neither in a room nor in the inventory are used up
+        for name in items:
+            item = self.items.get(name)
+
+            if item is not None and self.locations.locate(item) is None and (item.used or item.picked_up):
+                self.locations.put(item, CONSUMED)
+
+    def reset(self):
+        """
+        Puts the world back into the state it was in before the game began, in place.
+        The next execute() begins the game again (start() or begin() can also be called).
+        :return: None
+        """
+        if self.initial_state is not None:
+            self.set_state(self.initial_state)
+
+        # Timers of the old game
+        self.timers.clear()
+
+        self.running = False
+
+    @staticmethod
+    def _convert_old_state(state):
+        """
+        Converts a state with whole objects (saves made before 0.5) to the current format.
+        :param state: dict
+        :return: dict
+        """
+        converted = {
+            "rooms": {n: [r.entered, list(r.items.keys())] for n, r in state.get("rooms", {}).items()},
+            "items": {n: [i.used, i.picked_up, i.crafted] for n, i in state.get("items", {}).items()},
+            "statics": [n for n, o in state.get("statics", {}).items() if o.used],
+            "inventory": [item.name for item in state.get("inventory", [])],
+            "visits": [room.name for room in state.get("visits", [])],
+        }
+
+        for key in ("current_room", "previous_room"):
+            if key in state:
+                converted[key] = state[key]
+
+        return converted
+
+    def flag_snapshot(self):
+        """
+        Copies the flags (entered, used, picked up, crafted) of the whole world, without room contents and the player.
+        :return: tuple of bytes - (rooms, items, objects)
+        """
+        return self.room_flags.snapshot(), self.item_flags.snapshot(), self.static_flags.snapshot()
+
+    def flag_diff(self, snapshot):
+        """
+        :param snapshot: tuple returned by flag_snapshot()
+        :return: list of the rooms, items and objects whose flags changed since the snapshot
+        """
+        vectors = (self.room_flags, self.item_flags, self.static_flags)
+        return [vector.objects[index] for vector, data in zip(vectors, snapshot) for index in vector.diff(data)]
+
+    def restore_flags(self, snapshot):
+        """
+        Puts the flags back to a flag_snapshot(), only the objects that differ are changed.
+        :param snapshot: tuple returned by flag_snapshot()
+        :return: list of the rooms, items and objects that changed
+        """
+        vectors = (self.room_flags, self.item_flags, self.static_flags)
+        return [obj for vector, data in zip(vectors, snapshot) for obj in vector.restore(data)]
+
+    def snapshot(self):
+        """
+        Takes a copy of the current state of the game that can be restored later (encoded with pac.codec).
+        :return: bytes
+        """
+        return codec.encode_state(self.get_state())
+
+    def restore(self, snapshot):
+        """
+        Restores a state taken with snapshot(). The same snapshot can be restored any number of times.
+        :param snapshot: bytes returned by snapshot()
+        :return: None
+        """
+        self.set_state(codec.decode_state(snapshot)[0])
+
+    def _save_game(self, slot=None):
+        """
+        Saves the current state of the game to save/name_of_the_game.save (or into a slot)
+        :param slot: slot name, None for the default save
+        :return: None
+        """
+        if not self.saving:
+            self._init_save()
 
         data = {
-            "state": {"rooms": rooms, "items": items, "statics": statics, "inventory": inv, "visits": visited},
-            "game_info": {"name": self.name, "version": self.version}
+            "state": self.get_state(),
+            "game_info": {"name": self.name, "version": self.version},
+            "play_time": self.get_play_time(),
         }
 
-        self.saving.save(data)
+        self.saving.save(data, slot)
+
+        if self.tracer is not None:
+            self.tracer.record(trace.SAVE, self.saving.game_name)
 
     def _init_save(self):
         self.saving = SaveGame(self.name, self.version)
 
-    def _load_game(self):
+    def _load_game(self, slot=None):
+        """
+        Loads the save (or a slot) if there is a valid one.
+        :param slot: slot name, None for the default save
+        :return: bool indicating if the save was loaded
+        """
         if not self.saving:
             self._init_save()
 
-        if self.saving.has_valid_save():
-            data = self.saving.load()
+        # Reads the file once (has_valid_save() would read it again)
+        try:
+            data = self.saving.load(slot)
+        except codec.CodecError as e:
+            log.error("Game save is corrupt: {}".format(e))
+            return False
 
-            # has_valid_save() should check for this, but we check again
-            if data.get("game_info").get("version") != self.version:
-                log.warn("Game version is not the same even though has_valid_save() reported so! Not loading the save!")
-                return
+        if not data:
+            return False
 
-            game_info = data.get("game_info")
-            game_state = data.get("state")
+        if str(data.get("game_info").get("name")) != self.saving.game_name:
+            log.warn("The save belongs to another game! Not loading the save!")
+            return False
 
-            if not game_info or not game_state:
-                log.error("Game save is corrupt.")
-                # User should delete the save him/herself.
-                return
+        game_info = data.get("game_info")
+        game_state = data.get("state")
 
-            self.rooms = game_state.get("rooms")
-            self.items = game_state.get("items")
-            self.statics = game_state.get("statics")
+        if not game_info or not game_state:
+            log.error("Game save is corrupt.")
+            # User should delete the save him/herself.
+            return False
 
-            self.inv = game_state.get("inventory")
-            self.visits = game_state.get("visits")
+        self.set_state(game_state)
 
-            self.current_room = game_state.get("rooms").get(self.current_room.name)
+        if data.get("slot_info"):
+            self.play_time = data["slot_info"].get("play_time", 0.0)
+            self._play_started = time.monotonic() if self._play_started is not None else None
 
-            try:
-                self.previous_room = game_state.get("rooms").get(self.previous_room.name)
-            except AttributeError:
-                pass
+        if self.tracer is not None:
+            self.tracer.record(trace.LOAD, self.saving.game_name if slot is None else "{}:{}".format(self.saving.game_name, slot))
+
+        return True
 
 
 # Shortcuts for convenience
 Story = PaCInterpreter
+
+# These need the classes above
+from . import codec
+from .history import History
+from .completion import Completer
+from .analytics import Analytics
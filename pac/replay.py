@@ -0,0 +1,232 @@
+# coding=utf-8
+"""
+Replays recorded command transcripts against a world, without a player.
+
+Every transcript starts from the same snapshot of the interpreter and the transcripts are
+spread across a multiprocessing pool. Each replay produces a digest of all command results,
+so two runs (for example before and after editing the world) can be compared.
+"""
+
+import hashlib
+import logging
+import os
+import time
+from multiprocessing import Pool
+
+from .pac import PacException, InvalidParameters, PaCInterpreter
+
+log = logging.getLogger(__name__)
+
+# Worker process globals (set by _init_worker)
+_pac = None
+_pristine = None
+
+
+class ReplayMismatch(PacException):
+    """
+    Raised by ReplayReport.check() when a transcript produced a different digest than expected.
+    """
+    pass
+
+
+def load_transcript(path):
+    """
+    Loads a transcript file: one command per line, empty lines and lines starting with # are skipped.
+    :param path: path to the file
+    :return: list of commands
+    """
+    with open(path, "r") as file:
+        return [line.rstrip("\n") for line in file if line.strip() and not line.startswith("#")]
+
+
+def digest_results(results):
+    """
+    Builds a digest of command results; any change in behaviour changes the digest.
+    :param results: list of CommandResult
+    :return: hex string
+    """
+    h = hashlib.sha1()
+
+    for res in results:
+        h.update(repr((res.verb, res.ok, res.error, res.message, res.moved, res.room)).encode("utf-8"))
+
+    return h.hexdigest()
+
+
+def _replay(pac, pristine, commands):
+    pac.restore(pristine)
+
+    started = time.perf_counter()
+    results = pac.execute_many(commands)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "digest": digest_results(results),
+        "commands": len(results),
+        "failed": sum(1 for res in results if not res.ok),
+        "room": pac.current_room.name,
+        "elapsed": elapsed,
+    }
+
+
+def _init_worker(factory, pristine):
+    global _pac, _pristine
+
+    # Forked workers already have the world (the interpreter is a Singleton), spawned ones build it
+    _pac = PaCInterpreter()
+    if not _pac.rooms:
+        if factory is None:
+            raise InvalidParameters("a world factory is needed when worker processes are not forked")
+
+        _pac = factory()
+
+    _pristine = pristine
+
+
+def _replay_in_worker(job):
+    index, commands = job
+    result = _replay(_pac, _pristine, commands)
+    result["index"] = index
+
+    return result
+
+
+class ReplayReport:
+    """
+    Results of Replayer.run(): per-transcript results (in order) and aggregate throughput.
+    """
+    def __init__(self, results, elapsed):
+        """
+        :param results: list of dicts with digest, commands, failed, room and elapsed
+        :param elapsed: wall time of the whole run in seconds
+        :return: None
+        """
+        self.results = results
+        self.elapsed = float(elapsed)
+
+        self.commands = sum(res["commands"] for res in results)
+
+    @property
+    def digests(self):
+        """
+        :return: list of digests, one per transcript
+        """
+        return [res["digest"] for res in self.results]
+
+    @property
+    def commands_per_second(self):
+        return self.commands / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def playthroughs_per_second(self):
+        return len(self.results) / self.elapsed if self.elapsed else 0.0
+
+    def mismatches(self, expected):
+        """
+        Compares the digests to the expected ones (from an earlier run).
+        :param expected: list of digests or a ReplayReport
+        :return: list of transcript indexes that behaved differently
+        """
+        if isinstance(expected, ReplayReport):
+            expected = expected.digests
+
+        if len(expected) != len(self.results):
+            raise InvalidParameters
+
+        return [c for c, (a, b) in enumerate(zip(self.digests, expected)) if a != b]
+
+    def check(self, expected):
+        """
+        Same as mismatches(), but raises ReplayMismatch if any transcript behaved differently.
+        :return: None
+        """
+        different = self.mismatches(expected)
+        if different:
+            raise ReplayMismatch("transcripts {} behaved differently".format(different))
+
+    def to_dict(self):
+        return {
+            "transcripts": len(self.results),
+            "commands": self.commands,
+            "elapsed": self.elapsed,
+            "commands_per_second": self.commands_per_second,
+            "playthroughs_per_second": self.playthroughs_per_second,
+            "results": self.results,
+        }
+
+    def __repr__(self):
+        return "<ReplayReport transcripts={} commands={} commands/s={:.0f} playthroughs/s={:.1f}>".format(
+            len(self.results), self.commands, self.commands_per_second, self.playthroughs_per_second)
+
+
+class Replayer:
+    """
+    Replays transcripts against a world, each one starting from the same state.
+    """
+    def __init__(self, pac=None, factory=None, snapshot=None):
+        """
+        :param pac: PaCInterpreter with the world built (optional if factory is given)
+        :param factory: function that builds the world and returns the PaCInterpreter.
+                        Must be a module-level function; only needed when worker processes are spawned instead of forked.
+        :param snapshot: state to start every transcript from (PaCInterpreter.snapshot()), defaults to the current state
+        :return: None
+        """
+        if pac is None:
+            if factory is None:
+                raise InvalidParameters
+
+            pac = factory()
+
+        if not isinstance(pac, PaCInterpreter):
+            raise InvalidParameters
+
+        self.pac = pac
+        self.factory = factory
+        self.pristine = snapshot if snapshot is not None else pac.snapshot()
+
+    def replay(self, commands):
+        """
+        Replays a single transcript in this process.
+        :param commands: list of commands
+        :return: dict with digest, commands, failed, room and elapsed
+        """
+        result = _replay(self.pac, self.pristine, commands)
+        self.pac.restore(self.pristine)
+
+        return result
+
+    def run(self, transcripts, processes=None, chunksize=None):
+        """
+        Replays all transcripts.
+        :param transcripts: list of transcripts (lists of commands)
+        :param processes: number of worker processes, defaults to the number of cores; 1 replays in this process
+        :param chunksize: transcripts sent to a worker at once (optional)
+        :return: ReplayReport
+        """
+        transcripts = [list(commands) for commands in transcripts]
+
+        if processes is None:
+            processes = os.cpu_count() or 1
+
+        started = time.perf_counter()
+
+        if processes <= 1 or len(transcripts) <= 1:
+            results = []
+            for c, commands in enumerate(transcripts):
+                result = _replay(self.pac, self.pristine, commands)
+                result["index"] = c
+                results.append(result)
+
+            self.pac.restore(self.pristine)
+
+        else:
+            if not chunksize:
+                chunksize = max(1, len(transcripts) // (processes * 4))
+
+            with Pool(processes, initializer=_init_worker, initargs=(self.factory, self.pristine)) as pool:
+                results = pool.map(_replay_in_worker, enumerate(transcripts), chunksize)
+
+        report = ReplayReport(results, time.perf_counter() - started)
+        log.debug("Replay finished: {}".format(report))
+
+        return report
@@ -0,0 +1,615 @@
+# coding=utf-8
+"""
+A stateless HTTP/JSON command API.
+
+Every request carries a session ID and a command:
+
+    POST /command    {"session": "player-1", "command": "pick up the phone"}
+    POST /complete   {"session": "player-1", "line": "pick up the ph"}
+
+The state of the session is loaded from a session store into the interpreter, the command is executed and
+the new state is written back before the response is sent. Nothing about a player is kept in the process
+between requests, so any server process with the same world and store can serve any player.
+
+python -m pac.server --world mygame:build_world --port 8080 --store sessions
+
+With --memory-limit the states are kept in memory (HibernatingStore) and only the least recently used and idle
+ones are written to the store, to be read back by their next command.
+
+Sending SIGHUP to the server applies the edited world module to the running world (see pac.hotreload).
+"""
+
+import argparse
+import hashlib
+import importlib
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from .pac import InvalidParameters, PaCInterpreter, CommandResult, parse_command
+from .history import History
+from .metrics import Histogram
+from .hotreload import build_world, diff_worlds
+from . import codec
+
+log = logging.getLogger(__name__)
+
+# Longest accepted session ID and request body
+MAX_SESSION_LENGTH = 128
+MAX_BODY_SIZE = 64 * 1024
+
+# Verbs a session can not use: its state is saved after every command and undo history is not kept between requests
+SESSION_UNSUPPORTED = {
+    "save": "Your game is saved automatically.",
+    "load": "Your game is saved automatically.",
+    "slots": "Your game is saved automatically.",
+    "undo": "Undo is disabled.",
+    "redo": "Undo is disabled.",
+}
+
+
+class SessionStore:
+    """
+    Session states stored as files in a directory, one per session (encoded with pac.codec).
+    """
+    def __init__(self, path="sessions"):
+        """
+        :param path: directory (created if needed)
+        :return: None
+        """
+        self.path = str(path)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _path(self, session):
+        # Session IDs can be anything, the file is named by the hash
+        return os.path.join(self.path, "{}.state".format(hashlib.sha1(session.encode("utf-8")).hexdigest()))
+
+    def load(self, session):
+        """
+        :param session: session ID
+        :return: bytes, None if the session has no state yet
+        """
+        try:
+            with open(self._path(session), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def save(self, session, data):
+        """
+        Replaces the state of the session (atomically, a reader never sees half of it).
+        :param session: session ID
+        :param data: bytes
+        :return: None
+        """
+        path = self._path(session)
+        tmp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+
+        with open(tmp, "wb") as file:
+            file.write(data)
+
+        os.replace(tmp, path)
+
+    def delete(self, session):
+        """
+        :param session: session ID
+        :return: bool indicating if the session existed
+        """
+        try:
+            os.remove(self._path(session))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class MemoryStore:
+    """
+    Session states kept in a dict (for a single process, tests and benchmarks).
+    """
+    def __init__(self):
+        self.states = {}
+
+    def load(self, session):
+        return self.states.get(session)
+
+    def save(self, session, data):
+        self.states[session] = data
+
+    def delete(self, session):
+        return self.states.pop(session, None) is not None
+
+
+class HibernatingStore:
+    """
+    Session states kept in memory while they are used, the least recently used ones are written to another store
+    (hibernated) when the memory limit is reached or they are idle for too long, and read back (revived)
+    transparently by their next command. Sessions are only moved when the store is used, so a server without
+    requests keeps what it has.
+    """
+    # Memory of an entry besides the session ID and the state (dict slot, list node and tuple), roughly
+    ENTRY_SIZE = 160
+
+    def __init__(self, disk=None, limit=64 * 1024 * 1024, idle=3600.0, metrics=None, clock=time.monotonic):
+        """
+        :param disk: store of the hibernated sessions, a SessionStore in the "sessions" directory by default
+        :param limit: bytes of session states (with the IDs and bookkeeping) kept in memory
+        :param idle: seconds after which an unused session is hibernated
+        :param metrics: pac.metrics.Metrics the revival latency is observed into (as the action "revive"), optional
+        :param clock: function returning the time in seconds
+        :return: None
+        """
+        self.disk = disk if disk is not None else SessionStore()
+        self.limit = int(limit)
+        self.idle = float(idle)
+        self.metrics = metrics
+        self.clock = clock
+
+        # Session: [state, time of the last use], least recently used first
+        self.states = OrderedDict()
+        self.resident = 0
+
+        self.hibernations = 0
+        self.revivals = Histogram()
+
+    def _size(self, session, data):
+        return sys.getsizeof(session) + sys.getsizeof(data) + self.ENTRY_SIZE
+
+    def _evict(self, now, idle):
+        # Hibernates the least recently used sessions until the rest fits and none is idle
+        states = self.states
+        deadline = now - idle
+
+        while states:
+            session, (data, used) = next(iter(states.items()))
+
+            if self.resident <= self.limit and used > deadline:
+                break
+
+            self.disk.save(session, data)
+
+            del states[session]
+            self.resident -= self._size(session, data)
+            self.hibernations += 1
+
+    def load(self, session):
+        """
+        :param session: session ID
+        :return: bytes, None if the session has no state yet
+        """
+        now = self.clock()
+        entry = self.states.get(session)
+
+        if entry is not None:
+            entry[1] = now
+            self.states.move_to_end(session)
+
+            data = entry[0]
+        else:
+            started = time.perf_counter()
+
+            # The copy on disk stays until the session is hibernated again (it is replaced then)
+            data = self.disk.load(session)
+            if data is None:
+                return None
+
+            self.states[session] = [data, now]
+            self.resident += self._size(session, data)
+
+            elapsed = time.perf_counter() - started
+            self.revivals.observe(elapsed)
+
+            if self.metrics is not None:
+                self.metrics.observe_action("revive", elapsed)
+
+        self._evict(now, self.idle)
+        return data
+
+    def save(self, session, data):
+        now = self.clock()
+        entry = self.states.pop(session, None)
+
+        if entry is not None:
+            self.resident -= self._size(session, entry[0])
+
+        self.states[session] = [data, now]
+        self.resident += self._size(session, data)
+
+        self._evict(now, self.idle)
+
+    def delete(self, session):
+        entry = self.states.pop(session, None)
+
+        if entry is not None:
+            self.resident -= self._size(session, entry[0])
+
+        return self.disk.delete(session) or entry is not None
+
+    def hibernate(self, idle=None):
+        """
+        Hibernates the sessions unused for idle seconds.
+        :param idle: seconds, defaults to the store's (0 hibernates all)
+        :return: number of hibernated sessions
+        """
+        before = self.hibernations
+        self._evict(self.clock(), self.idle if idle is None else float(idle))
+
+        return self.hibernations - before
+
+    def close(self):
+        """
+        Hibernates all sessions (before the server stops).
+        :return: None
+        """
+        self.hibernate(0)
+
+    def stats(self):
+        """
+        :return: dict with the sessions and bytes in memory, the number of hibernations and the revival latencies
+        """
+        return {
+            "resident_sessions": len(self.states),
+            "resident_bytes": self.resident,
+            "limit": self.limit,
+            "hibernations": self.hibernations,
+            "revivals": self.revivals.to_dict(),
+        }
+
+
+def check_session(session):
+    """
+    :param session: session ID sent by a client
+    :return: the session ID
+    :raise InvalidParameters: if it is not a non-empty string of at most MAX_SESSION_LENGTH characters
+    """
+    if not isinstance(session, str) or not session or len(session) > MAX_SESSION_LENGTH:
+        raise InvalidParameters("session must be a string of 1 to {} characters".format(MAX_SESSION_LENGTH))
+
+    return session
+
+
+class CommandService:
+    """
+    Executes commands of many sessions on one interpreter.
+
+    The world stays in the state new sessions start in. A session is stored as the difference to it:
+    the rooms, items and objects that changed plus the player (inventory, visits, current room), so
+    loading and storing it costs as much as the session's progress, not the size of the world.
+    After every command the world is rewound with a History (this disables the interpreter's undo).
+    """
+    def __init__(self, pac, store=None, snapshot=None):
+        """
+        :param pac: PaCInterpreter with the world built
+        :param store: SessionStore or MemoryStore (default)
+        :param snapshot: state new sessions start in (PaCInterpreter.snapshot()), defaults to the beginning of the game
+        :return: None
+        """
+        if not isinstance(pac, PaCInterpreter):
+            raise InvalidParameters
+
+        self.pac = pac
+        self.store = store if store is not None else MemoryStore()
+
+        if snapshot is not None:
+            pac.restore(snapshot)
+        elif not pac.current_room:
+            pac.begin()
+
+        # Records what a session changes, so it can be stored and rewound
+        pac.disable_history()
+        self.journal = History(pac, depth=1)
+        pac.changed.journal = self.journal
+
+        # The interpreter holds one session at a time
+        self.lock = threading.Lock()
+
+    def handle(self, session, command):
+        """
+        Loads the state of the session, executes the command and stores the new state.
+        :param session: session ID (new sessions start from the beginning)
+        :param command: command string
+        :return: CommandResult
+        """
+        check_session(session)
+        command = str(command)
+
+        with self.lock:
+            try:
+                state = self.store.load(session)
+                if state is not None:
+                    self.pac.set_state(codec.decode_state(state)[0], partial=True)
+
+                # Analytics tell the sessions apart by the player's name
+                self.pac.player.name = session
+
+                verb, argument = parse_command(command)
+
+                if verb in SESSION_UNSUPPORTED:
+                    return CommandResult(command, verb, argument, False, SESSION_UNSUPPORTED[verb], "unsupported",
+                                         room=self.pac.current_room.name)
+
+                result = self.pac.execute(command)
+
+                state = self.pac.get_state(self.journal.changes())
+                self.store.save(session, codec.encode_state(state))
+
+            finally:
+                self.journal.rewind()
+
+        return result
+
+    def handle_request(self, body):
+        """
+        Handles a decoded JSON request.
+        :param body: dict with session and command
+        :return: dict to send back
+        """
+        if not isinstance(body, dict) or not isinstance(body.get("command"), str):
+            raise InvalidParameters("the request must be a JSON object with session and command")
+
+        session = body.get("session")
+        result = self.handle(session, body["command"])
+
+        return {"session": session, "result": result.to_dict()}
+
+    def complete(self, session, line, limit=20):
+        """
+        Completes a partly typed command of a session (see PaCInterpreter.complete()), nothing is stored.
+        :param session: session ID
+        :param line: what the player typed so far
+        :return: list of whole commands
+        """
+        check_session(session)
+
+        with self.lock:
+            try:
+                state = self.store.load(session)
+                if state is not None:
+                    self.pac.set_state(codec.decode_state(state)[0], partial=True)
+
+                return self.pac.complete(str(line), limit)
+
+            finally:
+                self.journal.rewind()
+
+    def reload(self, factory):
+        """
+        Applies a new definition of the world (see pac.hotreload), sessions keep their states.
+        The new world is built and compared while commands run, only applying it waits for them.
+        :param factory: function that builds the world and returns the PaCInterpreter
+        :return: pac.hotreload.WorldPatch
+        """
+        patch = diff_worlds(self.pac, build_world(factory))
+
+        with self.lock:
+            patch.apply(self.pac)
+
+        log.info("Reloaded the world: {}".format(patch.summary()))
+        return patch
+
+    def stats(self):
+        """
+        :return: dict with the statistics of the store (sessions in memory, revivals, ... if it keeps them)
+                 and the interpreter's metrics (if enabled)
+        """
+        with self.lock:
+            return {
+                "store": self.store.stats() if hasattr(self.store, "stats") else None,
+                "metrics": self.pac.metrics.snapshot() if self.pac.metrics else None,
+            }
+
+    def reset_session(self, session):
+        """
+        Drops the state of a session, its next command starts a new game.
+        :return: bool indicating if the session existed
+        """
+        check_session(session)
+
+        if self.pac.analytics is not None:
+            self.pac.analytics.end_session(session)
+
+        with self.lock:
+            return self.store.delete(session)
+
+
+def respond(service, path, body):
+    """
+    Handles a POST request to /command, /complete or /reset.
+    :param service: CommandService
+    :param path: "/command", "/complete" or "/reset"
+    :param body: decoded JSON body
+    :return: tuple - (HTTP status, dict to send back), 404 for other paths
+    """
+    try:
+        if path == "/command":
+            return 200, service.handle_request(body)
+
+        if path == "/complete":
+            if not isinstance(body, dict) or not isinstance(body.get("line"), str):
+                raise InvalidParameters("the request must be a JSON object with session and line")
+
+            return 200, {"session": body.get("session"), "completions": service.complete(body.get("session"), body["line"])}
+
+        if path == "/reset":
+            session = body.get("session") if isinstance(body, dict) else None
+            return 200, {"session": session, "existed": service.reset_session(session)}
+
+        return 404, {"error": "not-found", "message": "unknown path"}
+
+    except InvalidParameters as e:
+        return 400, {"error": "bad-request", "message": str(e)}
+    except Exception as e:
+        log.exception("Request failed")
+        return 500, {"error": "internal", "message": e.__class__.__name__}
+
+
+class CommandRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /command executes a command, POST /complete completes a partly typed one, POST /reset drops a session,
+    GET /health checks if the server is up and GET /stats returns CommandService.stats().
+    """
+    protocol_version = "HTTP/1.1"
+    server_version = "PaC"
+
+    # Headers and body are written separately, Nagle's algorithm would hold back the body
+    disable_nagle_algorithm = True
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, separators=(",", ":")).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+
+        self.wfile.write(data)
+
+    def _error(self, status, error, message):
+        self._send_json(status, {"error": error, "message": message})
+
+    def _read_body(self):
+        """
+        :return: decoded JSON body, None if an error was already sent
+        """
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+
+        if length < 0 or length > MAX_BODY_SIZE:
+            self.close_connection = True
+            self._error(413 if length > 0 else 400, "bad-request", "invalid Content-Length")
+            return None
+
+        try:
+            return json.loads(self.rfile.read(length).decode("utf-8"))
+        except (ValueError, UnicodeDecodeError):
+            self._error(400, "bad-request", "the body is not valid JSON")
+            return None
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"ok": True})
+        elif self.path == "/stats":
+            self._send_json(200, self.server.service.stats())
+        else:
+            self._error(404, "not-found", "unknown path")
+
+    def do_POST(self):
+        if self.path not in ("/command", "/complete", "/reset"):
+            self.close_connection = True
+            self._error(404, "not-found", "unknown path")
+            return
+
+        body = self._read_body()
+        if body is None:
+            return
+
+        self._send_json(*respond(self.server.service, self.path, body))
+
+    def log_message(self, fmt, *args):
+        log.debug("%s - %s", self.address_string(), fmt % args)
+
+
+class CommandServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server of a CommandService, every connection gets a thread (commands still run one at a time).
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, service, address=("127.0.0.1", 8080), handler=CommandRequestHandler):
+        """
+        :param service: CommandService
+        :param address: tuple - (host, port), port 0 picks a free one
+        :return: None
+        """
+        self.service = service
+        HTTPServer.__init__(self, address, handler)
+
+
+def load_factory(spec, reload=False):
+    """
+    :param spec: "module:function", the function builds the world and returns the PaCInterpreter
+    :param reload: import the module again (its edited source, for CommandService.reload())
+    :return: the function
+    """
+    module, _, name = spec.partition(":")
+    if not module or not name:
+        raise InvalidParameters("the world must be given as module:function")
+
+    module = importlib.import_module(module)
+    if reload:
+        module = importlib.reload(module)
+
+    return getattr(module, name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pac.server", description="Serves a world over HTTP/JSON.")
+    parser.add_argument("--world", required=True, help="module:function that builds the world and returns the PaCInterpreter")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--store", default="sessions", help="directory with the session states")
+    parser.add_argument("--memory", action="store_true", help="keep the session states in memory instead")
+    parser.add_argument("--memory-limit", type=float, metavar="MB",
+                        help="keep up to MB of session states in memory, the least recently used and idle ones "
+                             "are hibernated into --store")
+    parser.add_argument("--idle", type=float, default=3600.0, help="seconds after which a session is hibernated")
+    parser.add_argument("--analytics", help="file to append gameplay analytics rollups to (see pac.analytics)")
+    parser.add_argument("--metrics", action="store_true",
+                        help="collect latency metrics of commands and revivals (served in GET /stats)")
+
+    args = parser.parse_args(argv)
+
+    pac = load_factory(args.world)()
+    metrics = pac.enable_metrics() if args.metrics else None
+
+    if args.memory:
+        store = MemoryStore()
+    elif args.memory_limit is not None:
+        store = HibernatingStore(SessionStore(args.store), int(args.memory_limit * 1024 * 1024), args.idle, metrics)
+    else:
+        store = SessionStore(args.store)
+
+    service = CommandService(pac, store)
+
+    if args.analytics:
+        service.pac.enable_analytics(args.analytics)
+    server = CommandServer(service, (args.host, args.port))
+
+    # SIGHUP applies the edited world
+    def reload_world(*_):
+        try:
+            service.reload(load_factory(args.world, reload=True))
+        except Exception:
+            log.exception("Reloading the world failed")
+
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, reload_world)
+
+    log.info("Serving on {}:{}".format(*server.server_address))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.pac.disable_analytics()
+
+        if isinstance(store, HibernatingStore):
+            store.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    raise SystemExit(main())
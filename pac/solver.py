@@ -0,0 +1,437 @@
+# coding=utf-8
+"""
+Offline solvability checker for PaC worlds.
+
+Explores the player states of a world built with PaCInterpreter (links, room requirements,
+item pick up/use requirements, static object requirements and blueprints) without playing it.
+
+Walking around and picking items up can never hurt the player (inventory and visits only grow),
+so those moves are applied greedily: a search state is the whole group of rooms the player can
+freely walk around in (rooms joined by two-way links whose requirements are met) together with
+everything that can be picked up there. Only the moves that can lock the player out of something
+are branched on: leaving through a one-way link and combining two items (which consumes them).
+States are hashed and deduplicated, so the search stays fast even on very large worlds.
+"""
+
+import logging
+import time
+from multiprocessing import Pool
+
+from .pac import PacException, InvalidParameters, MissingParameters, PaCInterpreter
+
+log = logging.getLogger(__name__)
+
+
+class SolverLimitReached(PacException):
+    """
+    Raised when the solver explores more states than allowed by max_states.
+    """
+    pass
+
+
+class WorldModel:
+    """
+    A compact, picklable snapshot of the world: rooms and items are numbered and all
+    requirements are stored as int bitmasks.
+    """
+    def __init__(self, pac):
+        """
+        Compiles the world of a PaCInterpreter.
+        :param pac: PaCInterpreter with rooms, items and links created
+        :return: None
+        """
+        if not isinstance(pac, PaCInterpreter):
+            raise InvalidParameters
+
+        self.room_names = list(pac.rooms.keys())
+        self.item_names = list(pac.items.keys())
+        self.static_names = list(pac.statics.keys())
+
+        room_ids = {name: c for c, name in enumerate(self.room_names)}
+        item_ids = {name: c for c, name in enumerate(self.item_names)}
+
+        self.room_ids = room_ids
+        self.item_ids = item_ids
+
+        def item_mask(items):
+            mask = 0
+            for item in items:
+                mask |= 1 << item_ids[item.name]
+            return mask
+
+        self.room_items = []
+        self.room_item_reqs = []
+        self.room_visit_reqs = []
+        self.room_statics = []
+
+        for name in self.room_names:
+            room = pac.rooms[name]
+
+            self.room_items.append([item_ids[it] for it in room.items.keys()])
+            self.room_item_reqs.append(item_mask(req[0] for req in room.requirements["items"]))
+
+            visit_mask = 0
+            for req in room.requirements["visited"]:
+                visit_mask |= 1 << room_ids[req[0].name]
+            self.room_visit_reqs.append(visit_mask)
+
+            self.room_statics.append(list(room.statics.keys()))
+
+        self.pickup_reqs = [item_mask(pac.items[name].pickup_requires) for name in self.item_names]
+        self.use_reqs = [item_mask(pac.items[name].use_requires) for name in self.item_names]
+        self.static_reqs = {name: item_mask(obj.item_requirements) for name, obj in pac.statics.items()}
+
+        # Links are split into two-way links (safe to walk back and forth) and one-way links
+        links = {room_ids[fr]: {room_ids[to] for to in tos} for fr, tos in pac.links.items()}
+
+        self.two_way = [[] for _ in self.room_names]
+        self.one_way = [[] for _ in self.room_names]
+
+        for fr, tos in links.items():
+            for to in tos:
+                if fr in links.get(to, ()):
+                    self.two_way[fr].append(to)
+                else:
+                    self.one_way[fr].append(to)
+
+        # PaCInterpreter.combine() uses the first blueprint of a pair (in any order), the others never apply
+        self.blueprints = []
+        pairs = set()
+
+        for a, b, res in pac.blueprints:
+            pair = frozenset((a.name, b.name))
+
+            if pair not in pairs:
+                pairs.add(pair)
+                self.blueprints.append((item_ids[a.name], item_ids[b.name], item_ids[res.name]))
+
+        # Starting position and inventory
+        starting_room = pac.current_room or pac.starting_room
+        if not starting_room:
+            raise MissingParameters
+
+        self.start_room = room_ids[starting_room.name]
+        self.start_inv = item_mask(pac.inv)
+
+        self.start_visited = 1 << self.start_room
+        for room in pac.visits:
+            self.start_visited |= 1 << room_ids[room.name]
+
+        self.start_held = self.start_inv
+        for item in pac.items.values():
+            if item.picked_up:
+                self.start_held |= 1 << item_ids[item.name]
+
+    def enterable(self, room, inv, visited):
+        """
+        :return: bool indicating if the room requirements are fulfilled
+        """
+        return not (self.room_item_reqs[room] & ~inv) and not (self.room_visit_reqs[room] & ~visited)
+
+    def close(self, room, inv, visited, held):
+        """
+        Applies all the 'free' moves from the room: walks everywhere that can be walked back from
+        and picks up everything that can be picked up, until nothing changes anymore.
+        :param room: room index the player is in
+        :return: tuple - (component (set of room indexes), inv, visited, held)
+        """
+        component = {room}
+        visited |= 1 << room
+
+        stack = [room]
+        blocked_rooms = set()
+        blocked_items = set()
+
+        while True:
+            while stack:
+                current = stack.pop()
+
+                for item in self.room_items[current]:
+                    bit = 1 << item
+                    if held & bit:
+                        continue
+
+                    if self.pickup_reqs[item] & ~inv:
+                        blocked_items.add(item)
+                    else:
+                        inv |= bit
+                        held |= bit
+
+                for to in self.two_way[current]:
+                    if to in component:
+                        continue
+
+                    if self.enterable(to, inv, visited):
+                        component.add(to)
+                        visited |= 1 << to
+                        stack.append(to)
+                    else:
+                        blocked_rooms.add(to)
+
+            # Retry everything that was blocked, the inventory or visits might have grown since
+            progress = False
+
+            for item in list(blocked_items):
+                bit = 1 << item
+                if held & bit:
+                    blocked_items.discard(item)
+
+                elif not (self.pickup_reqs[item] & ~inv):
+                    inv |= bit
+                    held |= bit
+                    blocked_items.discard(item)
+                    progress = True
+
+            for to in list(blocked_rooms):
+                if to in component:
+                    blocked_rooms.discard(to)
+
+                elif self.enterable(to, inv, visited):
+                    component.add(to)
+                    visited |= 1 << to
+                    stack.append(to)
+                    blocked_rooms.discard(to)
+                    progress = True
+
+            if not progress:
+                break
+
+        return component, inv, visited, held
+
+    def state(self, room, inv, visited, held):
+        """
+        Closes the state and returns its hashable key and component.
+        :return: tuple - (key, component)
+        """
+        component, inv, visited, held = self.close(room, inv, visited, held)
+        return (min(component), inv, visited, held), component
+
+    def successors(self, key, component):
+        """
+        Yields the keys (and components) of all states one branching move away.
+        :param key: state key returned by state()
+        :param component: set of rooms the player can walk freely in
+        :return: generator of (key, component)
+        """
+        rep, inv, visited, held = key
+
+        # Leaving through a one-way link
+        for room in component:
+            for to in self.one_way[room]:
+                if to not in component and self.enterable(to, inv, visited):
+                    yield self.state(to, inv, visited, held)
+
+        # Combining (consumes both items)
+        for item1, item2, result in self.blueprints:
+            if item1 == item2:
+                continue
+
+            if (inv >> item1) & 1 and (inv >> item2) & 1 and not (inv >> result) & 1:
+                new_inv = (inv & ~(1 << item1) & ~(1 << item2)) | (1 << result)
+                yield self.state(rep, new_inv, visited, held | (1 << result))
+
+
+def _explore(model, seeds, goal, max_states):
+    """
+    Depth-first search over the states reachable from seeds.
+    Module level so it can be sent to worker processes.
+    :return: dict with partial results
+    """
+    seen = {}
+    stack = []
+
+    seed_keys = []
+    for room, inv, visited, held in seeds:
+        key, component = model.state(room, inv, visited, held)
+        seed_keys.append(key)
+
+        if key not in seen:
+            seen[key] = None
+            stack.append((key, component))
+
+    visited_any = 0
+    held_any = 0
+    usable_items = 0
+    usable_statics = set()
+
+    while stack:
+        key, component = stack.pop()
+
+        rep, inv, visited, held = key
+        visited_any |= visited
+        held_any |= held
+
+        unchecked = inv & ~usable_items
+        while unchecked:
+            bit = unchecked & -unchecked
+            if not (model.use_reqs[bit.bit_length() - 1] & ~inv):
+                usable_items |= bit
+            unchecked ^= bit
+
+        for room in component:
+            for name in model.room_statics[room]:
+                if not (model.static_reqs[name] & ~inv):
+                    usable_statics.add(name)
+
+        children = []
+        for child, child_component in model.successors(key, component):
+            children.append(child)
+
+            if child not in seen:
+                seen[child] = None
+                stack.append((child, child_component))
+
+                if max_states and len(seen) > max_states:
+                    raise SolverLimitReached
+
+        seen[key] = children
+
+    # A state is good if the goal can be reached from it
+    good = {key for key in seen if (key[2] & goal) == goal}
+
+    parents = {}
+    for key, children in seen.items():
+        for child in children:
+            parents.setdefault(child, []).append(key)
+
+    stack = list(good)
+    while stack:
+        for parent in parents.get(stack.pop(), ()):
+            if parent not in good:
+                good.add(parent)
+                stack.append(parent)
+
+    return {
+        "states": len(seen),
+        "visited": visited_any,
+        "held": held_any,
+        "usable": usable_items,
+        "statics": usable_statics,
+        "solvable": any(key in good for key in seed_keys),
+        "dead_ends": [key for key in seen if key not in good],
+    }
+
+
+def _explore_star(args):
+    return _explore(*args)
+
+
+class SolverReport:
+    """
+    The result of Solver.solve().
+    """
+    def __init__(self, solvable, unreachable_rooms, unobtainable_items, unusable_items, unusable_statics, dead_ends, states, elapsed):
+        self.solvable = bool(solvable)
+
+        self.unreachable_rooms = unreachable_rooms
+        self.unobtainable_items = unobtainable_items
+        self.unusable_items = unusable_items
+        self.unusable_statics = unusable_statics
+
+        self.dead_ends = dead_ends
+
+        self.states = int(states)
+        self.elapsed = float(elapsed)
+
+    def __repr__(self):
+        return "<SolverReport solvable={} unreachable_rooms={} unobtainable_items={} dead_ends={} states={}>".format(
+            self.solvable, len(self.unreachable_rooms), len(self.unobtainable_items), len(self.dead_ends), self.states)
+
+
+class Solver:
+    """
+    Checks if a world can be finished without playing it.
+    """
+    def __init__(self, pac, max_states=1000000):
+        """
+        Compiles the world of the interpreter. Changes made to the world afterwards are not seen by the solver.
+        :param pac: PaCInterpreter
+        :param max_states: maximum number of explored states (per process), 0 or None for no limit
+        :return: None
+        """
+        self.model = WorldModel(pac)
+        self.max_states = max_states
+
+    def _goal_mask(self, goal):
+        if goal is None:
+            # Every room has to be visited
+            return (1 << len(self.model.room_names)) - 1
+
+        if isinstance(goal, str) or not hasattr(goal, "__iter__"):
+            goal = [goal]
+
+        mask = 0
+        for room in goal:
+            name = getattr(room, "name", room)
+
+            try:
+                mask |= 1 << self.model.room_ids[str(name)]
+            except KeyError:
+                raise InvalidParameters
+
+        return mask
+
+    def solve(self, goal=None, processes=None):
+        """
+        Explores the world.
+        :param goal: Room, room name or a list of them that all have to be visited to finish the game.
+                     If None, the game is considered finished when every room has been visited.
+        :param processes: number of worker processes to spread the search across (optional)
+        :return: SolverReport
+        """
+        started = time.perf_counter()
+        model = self.model
+
+        goal_mask = self._goal_mask(goal)
+        start = (model.start_room, model.start_inv, model.start_visited, model.start_held)
+
+        key, component = model.state(*start)
+        children = []
+
+        if processes and processes > 1:
+            children = [child for child, _ in model.successors(key, component)]
+
+        if len(children) < 2:
+            results = [_explore(model, [start], goal_mask, self.max_states)]
+            solvable = results[0]["solvable"]
+
+        else:
+            # Expand the first state here and hand its subtrees over to the workers
+            seeds = [children[c::processes] for c in range(processes)]
+
+            with Pool(processes) as pool:
+                results = pool.map(_explore_star, [(model, chunk, goal_mask, self.max_states) for chunk in seeds if chunk])
+
+            solvable = (key[2] & goal_mask) == goal_mask or any(res["solvable"] for res in results)
+
+        visited = key[2]
+        held = key[3]
+        usable = 0
+        statics = set()
+        dead_ends = set()
+        states = 0
+
+        for res in results:
+            visited |= res["visited"]
+            held |= res["held"]
+            usable |= res["usable"]
+            statics |= res["statics"]
+            dead_ends.update(res["dead_ends"])
+            states += res["states"]
+
+        if not solvable and len(results) > 1:
+            # The first state was never handed to a worker
+            dead_ends.add(key)
+            states += 1
+
+        unreachable = [name for c, name in enumerate(model.room_names) if not (visited >> c) & 1]
+        unobtainable = [name for c, name in enumerate(model.item_names) if not (held >> c) & 1]
+        unusable_items = [name for c, name in enumerate(model.item_names) if (held >> c) & 1 and not (usable >> c) & 1]
+        unusable_statics = [name for name in model.static_names if name not in statics]
+
+        dead_end_rooms = sorted({model.room_names[dead[0]] for dead in dead_ends})
+
+        report = SolverReport(solvable, unreachable, unobtainable, unusable_items, unusable_statics, dead_end_rooms, states, time.perf_counter() - started)
+        log.debug("Solver finished: {}".format(report))
+
+        return report
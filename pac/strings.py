@@ -0,0 +1,250 @@
+# coding=utf-8
+"""
+Interned world text.
+
+Descriptions and messages of rooms, items and objects are stored once in a string table shared by every
+world in the process (STRINGS) and the objects only keep their ids. Messages built from a template
+("You picked up {}") are kept as a Format and only formatted when they are shown.
+
+Locales are optional tables translating the original texts, registered with add_locale() and only read
+when they are first used.
+
+Once a world is built, freeze() packs all strings into one buffer. Forked processes (pac.cluster) then
+share the texts without copying them: reading a text does not touch a separate object per string.
+"""
+
+import json
+from array import array
+
+
+class Format:
+    """
+    A message formatted from a template in the string table when it is needed.
+    """
+    __slots__ = ("template", "args")
+
+    def __init__(self, template, *args):
+        """
+        :param template: template id in the string table
+        :param args: format() arguments
+        """
+        self.template = template
+        self.args = args
+
+    def __eq__(self, other):
+        return isinstance(other, Format) and (self.template, self.args) == (other.template, other.args)
+
+    def __hash__(self):
+        return hash((self.template, self.args))
+
+
+class StringTable:
+    """
+    Deduplicated strings referenced by integer ids, with optional translations.
+    """
+    def __init__(self):
+        self.strings = []
+        self.ids = {}  # string: id
+
+        # Packed strings (see freeze()), the string id is the index of its offset
+        self.buffer = None
+        self.offsets = None
+
+        self.locale = None
+        self.locales = {}   # name: {id: translated string}, loaded ones
+        self.loaders = {}   # name: path or dict, not loaded yet
+
+        self._translated = None  # Table of the current locale
+
+    def add(self, s):
+        """
+        :param s: string
+        :return: id of the string (the same string always gets the same id)
+        """
+        if self.buffer is not None:
+            self.thaw()
+
+        s = str(s)
+        sid = self.ids.get(s)
+
+        if sid is None:
+            sid = self.ids[s] = len(self.strings)
+            self.strings.append(s)
+
+        return sid
+
+    def intern(self, s):
+        """
+        :param s: string
+        :return: the table's copy of the string (s itself once the table is frozen)
+        """
+        if self.buffer is not None:
+            return str(s)
+
+        return self.strings[self.add(s)]
+
+    def get(self, sid):
+        """
+        :param sid: string id
+        :return: the string, translated to the current locale if there is a translation
+        """
+        if self._translated is not None:
+            translated = self._translated.get(sid)
+            if translated is not None:
+                return translated
+
+        if self.buffer is None:
+            return self.strings[sid]
+
+        offsets = self.offsets
+        return self.buffer[offsets[sid]:offsets[sid + 1]].decode("utf-8")
+
+    def format(self, value):
+        """
+        :param value: Format
+        :return: formatted message
+        """
+        return self.get(value.template).format(*value.args)
+
+    def translate(self, s):
+        """
+        :param s: original string
+        :return: the translation of s in the current locale (s if there is none)
+        """
+        if self._translated is None:
+            return s
+
+        if self.buffer is not None:
+            self.thaw()
+
+        sid = self.ids.get(s)
+        return self._translated.get(sid, s) if sid is not None else s
+
+    def add_locale(self, name, source):
+        """
+        Registers a locale, it is loaded the first time it is used.
+        :param name: locale name ("de", "sl", ...)
+        :param source: path to a JSON file or a dict, {original string: translated string}
+        :return: None
+        """
+        self.loaders[name] = source
+        self.locales.pop(name, None)
+
+        if self.locale == name:
+            self.set_locale(name)
+
+    def set_locale(self, name):
+        """
+        Switches the locale of all texts.
+        :param name: registered locale name, None for the original texts
+        :return: None
+        """
+        if name is None:
+            self.locale = None
+            self._translated = None
+            return
+
+        table = self.locales.get(name)
+
+        if table is None:
+            if name not in self.loaders:
+                raise KeyError(name)
+
+            source = self.loaders[name]
+
+            if not isinstance(source, dict):
+                with open(source, "r", encoding="utf-8") as file:
+                    source = json.load(file)
+
+            table = self.locales[name] = {self.add(original): str(translated) for original, translated in source.items()}
+
+        self.locale = name
+        self._translated = table
+
+    def freeze(self):
+        """
+        Packs the strings into one read-only buffer, only it and the offsets of the strings are kept.
+        Getting a string then decodes it. Adding one unpacks the table again (thaw()).
+        Nothing is packed while a locale is loaded (translating looks strings up).
+        :return: None
+        """
+        if self.buffer is not None or self.locales:
+            return
+
+        encoded = [s.encode("utf-8") for s in self.strings]
+
+        offsets = array("L", [0])
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+
+        self.buffer = b"".join(encoded)
+        self.offsets = offsets
+
+        self.strings = None
+        self.ids = None
+
+    def thaw(self):
+        """
+        Unpacks the strings packed by freeze().
+        :return: None
+        """
+        if self.buffer is None:
+            return
+
+        strings = [self.get_original(sid) for sid in range(len(self.offsets) - 1)]
+
+        self.buffer = None
+        self.offsets = None
+
+        self.strings = strings
+        self.ids = {s: sid for sid, s in enumerate(strings)}
+
+    def get_original(self, sid):
+        """
+        :param sid: string id
+        :return: the string (not translated)
+        """
+        if self.buffer is None:
+            return self.strings[sid]
+
+        return self.buffer[self.offsets[sid]:self.offsets[sid + 1]].decode("utf-8")
+
+    def __len__(self):
+        if self.buffer is not None:
+            return len(self.offsets) - 1
+
+        return len(self.strings)
+
+
+# Shared by all worlds in the process
+STRINGS = StringTable()
+
+
+class Text(object):
+    """
+    A text attribute of a Room, Item or StaticObject, stored as an id in STRINGS.
+    Values can be strings, Format or None.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+
+        value = obj.__dict__[self.name]
+
+        if type(value) is int:
+            return STRINGS.get(value)
+
+        if type(value) is Format:
+            return STRINGS.format(value)
+
+        # None (and strings of objects pickled before 0.5)
+        return value
+
+    def __set__(self, obj, value):
+        if value is not None and not isinstance(value, Format):
+            value = STRINGS.add(value)
+
+        obj.__dict__[self.name] = value
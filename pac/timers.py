@@ -0,0 +1,295 @@
+# coding=utf-8
+"""
+Timers for delayed game events (a door that closes after 30 seconds, a torch that burns out).
+
+Timers are kept in a hierarchical timer wheel: a timer goes into the slot of the tick it expires in, timers far
+in the future into coarser slots of a higher level, which are moved down a level when their time comes closer.
+Scheduling and cancelling a timer are O(1) whatever the number of pending timers, and every tick only looks
+at one slot.
+
+Nothing runs by itself: advance() fires the timers that expired (PaCInterpreter.execute() and
+pac.multiplayer.SharedWorld.execute() call it before every command) and start() runs one thread that sleeps
+until the next timer is due.
+"""
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Timer:
+    """
+    A scheduled call, returned by TimerWheel.schedule().
+    """
+    __slots__ = ("wheel", "expires", "callback", "args", "kwargs", "_slot")
+
+    def __init__(self, wheel, expires, callback, args, kwargs):
+        self.wheel = wheel
+        self.expires = expires  # tick
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+
+        # dict the timer is in, None when it fired or was cancelled
+        self._slot = None
+
+    @property
+    def pending(self):
+        return self._slot is not None
+
+    def cancel(self):
+        """
+        Cancels the timer (nothing happens if it already fired).
+        :return: bool indicating if the timer was pending
+        """
+        return self.wheel.cancel(self)
+
+    def __repr__(self):
+        return "<Timer {} at tick {}>".format(getattr(self.callback, "__name__", self.callback), self.expires)
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel.
+    """
+    def __init__(self, resolution=0.05, bits=8, levels=4, clock=time.monotonic):
+        """
+        :param resolution: length of a tick in seconds (timers fire at most this late)
+        :param bits: every level has 2 ** bits slots
+        :param levels: number of levels, timers further than 2 ** (bits * levels) ticks ahead are placed again
+        :param clock: function returning the time in seconds
+        :return: None
+        """
+        self.resolution = float(resolution)
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.levels = levels
+        self.clock = clock
+
+        # Slot: dict of Timers (a dict keeps them in the order they were scheduled and removes one in O(1))
+        self.wheels = [[{} for _ in range(1 << bits)] for _ in range(levels)]
+
+        self.started = clock()
+        self.tick = 0
+        self.pending = 0
+
+        self.lock = threading.RLock()
+        self._wakeup = threading.Condition(self.lock)
+        self._thread = None
+        self._stop = None
+
+    def _now(self):
+        # Current tick by the clock
+        return int((self.clock() - self.started) / self.resolution)
+
+    def _place(self, timer):
+        delay = timer.expires - self.tick
+        bits = self.bits
+
+        if delay < 0:
+            delay = 0
+
+        for level in range(self.levels):
+            if delay < 1 << (bits * (level + 1)):
+                break
+        else:
+            # Further than the wheel reaches, waits in the top level and is placed again when it comes down
+            level = self.levels - 1
+            expires = self.tick + (1 << (bits * self.levels)) - 1
+            slot = self.wheels[level][(expires >> (bits * level)) & self.mask]
+
+            timer._slot = slot
+            slot[timer] = None
+            return
+
+        slot = self.wheels[level][(max(timer.expires, self.tick) >> (bits * level)) & self.mask]
+
+        timer._slot = slot
+        slot[timer] = None
+
+    def schedule(self, delay, callback, *args, **kwargs):
+        """
+        Calls callback(*args, **kwargs) after delay seconds.
+        :param delay: seconds (at least one tick)
+        :param callback: function
+        :return: Timer
+        """
+        ticks = int(-(-delay // self.resolution)) if delay > 0 else 1
+
+        with self.lock:
+            timer = Timer(self, self._now() + max(1, ticks), callback, args, kwargs)
+
+            self._place(timer)
+            self.pending += 1
+
+            # The driver thread (start()) may sleep past this one
+            if self._thread is not None:
+                self._wakeup.notify()
+
+        return timer
+
+    def cancel(self, timer):
+        """
+        :param timer: Timer
+        :return: bool indicating if the timer was pending
+        """
+        with self.lock:
+            slot = timer._slot
+            if slot is None:
+                return False
+
+            del slot[timer]
+            timer._slot = None
+            self.pending -= 1
+
+            return True
+
+    def _cascade(self, level):
+        # Moves the timers of the current slot of a level a level (or more) down
+        index = (self.tick >> (self.bits * level)) & self.mask
+        slot = self.wheels[level][index]
+
+        if index == 0 and level + 1 < self.levels:
+            self._cascade(level + 1)
+
+        if slot:
+            self.wheels[level][index] = {}
+
+            for timer in slot:
+                self._place(timer)
+
+    def _expired(self, until):
+        # Advances the wheel to the tick, returns the expired timers in order
+        expired = []
+        wheel = self.wheels[0]
+        mask = self.mask
+
+        while self.tick < until:
+            if not self.pending:
+                self.tick = until
+                break
+
+            self.tick += 1
+            index = self.tick & mask
+
+            if index == 0 and self.levels > 1:
+                self._cascade(1)
+
+            slot = wheel[index]
+            if slot:
+                wheel[index] = {}
+
+                for timer in slot:
+                    # A wheel with one level puts timers further than it reaches into the first level as well
+                    if timer.expires > self.tick:
+                        self._place(timer)
+                        continue
+
+                    timer._slot = None
+                    self.pending -= 1
+                    expired.append(timer)
+
+        return expired
+
+    def advance(self, now=None):
+        """
+        Fires the timers that expired, in the order of their expiry (and of scheduling in the same tick).
+        :param now: time by the clock (defaults to the current one)
+        :return: number of fired timers
+        """
+        until = self._now() if now is None else int((now - self.started) / self.resolution)
+
+        with self.lock:
+            # Nothing to do until the next tick
+            if until <= self.tick:
+                return 0
+
+            expired = self._expired(until)
+
+        # Outside the lock, a callback can schedule and cancel timers
+        for timer in expired:
+            try:
+                timer.callback(*timer.args, **timer.kwargs)
+            except Exception:
+                log.exception("Timer {} failed".format(timer))
+
+        return len(expired)
+
+    def next_expiry(self):
+        """
+        :return: seconds until advance() may have something to fire (never later than the next timer),
+                 None if no timer is pending
+        """
+        with self.lock:
+            if not self.pending:
+                return None
+
+            wheel = self.wheels[0]
+            tick = self.tick + 1
+            index = tick & self.mask
+
+            # Ahead in the first level, or else when the next level is moved down
+            while index and not wheel[index]:
+                tick += 1
+                index = tick & self.mask
+
+        return max(0.0, self.started + tick * self.resolution - self.clock())
+
+    def clear(self):
+        """
+        Cancels all timers.
+        :return: None
+        """
+        with self.lock:
+            for wheel in self.wheels:
+                for slot in wheel:
+                    for timer in slot:
+                        timer._slot = None
+
+                    slot.clear()
+
+            self.pending = 0
+
+    def __len__(self):
+        return self.pending
+
+    def _run(self, stop):
+        while not stop.is_set():
+            self.advance()
+
+            with self.lock:
+                if not stop.is_set():
+                    self._wakeup.wait(self.next_expiry())
+
+    def start(self):
+        """
+        Fires the timers in a thread of their own as they expire (callbacks run in that thread).
+        :return: None
+        """
+        with self.lock:
+            if self._thread is not None:
+                return
+
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name="pac-timers", daemon=True)
+
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the thread of start().
+        :return: None
+        """
+        with self.lock:
+            thread = self._thread
+            if thread is None:
+                return
+
+            self._stop.set()
+            self._thread = None
+            self._wakeup.notify()
+
+        if thread is not threading.current_thread():
+            thread.join()
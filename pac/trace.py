@@ -0,0 +1,151 @@
+# coding=utf-8
+"""
+A fixed-size ring buffer of state mutations (rooms entered, items picked up, used, crafted, ...).
+
+Everything is preallocated when the buffer is created, so recording a mutation only overwrites
+a few slots. Cheap enough to leave enabled; dump it when a player reports a bug (or automatically
+when a command raises).
+"""
+
+import os
+import time
+import traceback
+from array import array
+
+# Mutation kinds
+ENTER = 1
+PICKUP = 2
+USE_ITEM = 3
+USE_OBJECT = 4
+CRAFT = 5
+INV_ADD = 6
+INV_REMOVE = 7
+MUSIC = 8
+SAVE = 9
+LOAD = 10
+
+KIND_NAMES = {
+    ENTER: "enter",
+    PICKUP: "pickup",
+    USE_ITEM: "use-item",
+    USE_OBJECT: "use-object",
+    CRAFT: "craft",
+    INV_ADD: "inv-add",
+    INV_REMOVE: "inv-remove",
+    MUSIC: "music",
+    SAVE: "save",
+    LOAD: "load",
+}
+
+
+class Tracer:
+    """
+    Records state mutations with monotonic timestamps into a ring buffer.
+    """
+    def __init__(self, size=4096, dump_path=None):
+        """
+        :param size: number of mutations kept (older ones are overwritten)
+        :param dump_path: file the buffer is written to when a command raises an exception (optional)
+        :return: None
+        """
+        size = int(size)
+        if size < 1:
+            size = 1
+
+        self.size = size
+        self.dump_path = dump_path
+
+        self.times = array("q", bytes(8 * size))
+        self.kinds = bytearray(size)
+        self.subjects = [None] * size
+
+        self.index = 0  # Next slot to write to
+        self.total = 0  # Mutations recorded since the start
+
+    def record(self, kind, subject=None):
+        """
+        Records a mutation.
+        :param kind: one of the kinds defined in this module
+        :param subject: name of the room/item/object (or path) the mutation is about
+        :return: None
+        """
+        i = self.index
+
+        self.times[i] = time.monotonic_ns()
+        self.kinds[i] = kind
+        self.subjects[i] = subject
+
+        i += 1
+        self.index = i if i < self.size else 0
+        self.total += 1
+
+    def clear(self):
+        self.index = 0
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.size)
+
+    def entries(self):
+        """
+        :return: list of (monotonic time in ns, kind name, subject), oldest first
+        """
+        count = len(self)
+        start = (self.index - count) % self.size
+
+        result = []
+        for c in range(count):
+            i = (start + c) % self.size
+            result.append((self.times[i], KIND_NAMES.get(self.kinds[i], str(self.kinds[i])), self.subjects[i]))
+
+        return result
+
+    def format(self):
+        """
+        :return: the buffer as text, one mutation per line (times relative to the last one)
+        """
+        entries = self.entries()
+        if not entries:
+            return ""
+
+        last = entries[-1][0]
+        lines = ["{:>12.6f} {:<10} {}".format((t - last) / 1e9, kind, subject if subject is not None else "")
+                 for t, kind, subject in entries]
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path=None, header=None):
+        """
+        Writes the buffer to a file.
+        :param path: file path, defaults to dump_path
+        :param header: text written before the entries (optional)
+        :return: path written to
+        """
+        path = path or self.dump_path
+        if not path:
+            raise ValueError("no path to dump the trace to")
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with open(path, "w") as file:
+            file.write("# {} of {} mutations\n".format(len(self), self.total))
+            if header:
+                file.write("".join("# " + line + "\n" for line in header.splitlines()))
+
+            file.write(self.format())
+
+        return path
+
+    def dump_exception(self, command=None):
+        """
+        Dumps the buffer with the current exception's traceback, if a dump_path is set.
+        :param command: the command that raised (optional)
+        :return: None
+        """
+        if not self.dump_path:
+            return
+
+        header = "Exception while executing: {!r}\n{}".format(command, traceback.format_exc())
+        self.dump(header=header)